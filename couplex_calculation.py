@@ -1,86 +1,256 @@
 # this function originates from my AMULATOR_offline
 # https://github.com/LangeTo/AMULATOR_offline/blob/main/couplex_functions.py
 
+import multiprocessing
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 import polars as pl
 
+from shared_frames import SharedFrames, attach
+from solve_cache import SolveCache
+
+# the compiled kernel is optional, without numba the pure NumPy implementation is used
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# number of worker processes for the couplex calculation, 1 means everything runs in the current process
+# large multi-plate batches can be spread over all cores with, e.g., PICO_COUPLEX_WORKERS=8
+COUPLEX_WORKERS = int(os.environ.get("PICO_COUPLEX_WORKERS", 1))
+# below this number of rows per worker, starting the workers takes longer than the calculation itself
+MIN_ROWS_PER_WORKER = 500
+
+# columns needed for the couplex calculation, in the order of the arguments of _couplexes
+INPUT_COLUMNS = [
+    "valid_partitions",
+    "positives_ab1",
+    "positives_ab2",
+    "positives_double",
+    "volume_per_well",
+    "mastermix_volume",
+]
+
+# names of the columns returned by the couplex calculation, in the order of the kernel output
+RESULT_COLUMNS = [
+    "couplex_positives",
+    "random_positives",
+    "rcoverlap_positives",
+    "diff_to_obs",
+    "couplexes",
+]
 
-def calculate_couplexes(df) -> pl.DataFrame:
+# results of identical rows are looked up instead of solved again, see solve_cache.py
+# the version in the name has to be increased, whenever the results of the kernel change
+SOLVE_CACHE = SolveCache("ddpcs_v1", INPUT_COLUMNS, RESULT_COLUMNS)
+
+
+def calculate_couplexes(df, workers: int = COUPLEX_WORKERS) -> pl.DataFrame:
     """
-    This function just applies the _couplexes function to each row of the dataframe.
+    This function solves the dDPCS model for each row of the dataframe. Rows with the same inputs as an earlier row are taken from SOLVE_CACHE. If numba is installed, all other rows are solved by a compiled kernel in parallel, otherwise the _couplexes function is applied to each row. For large dataframes, the rows can additionally be split into chunks, which are solved by a pool of worker processes.
 
     Args:
         df (dataframe): preprocessed dataframe
+        workers (int, optional): number of worker processes. Defaults to COUPLEX_WORKERS.
 
     Returns:
-        pl.DataFrame: df now contains a new column with the outputs from _couplexes
+        pl.DataFrame: df now contains new columns with the outputs from the dDPCS model
     """
 
-    # specify the return types for .map_elements, the types need to match the return types of _couplexes() function
-    return_types = pl.Struct(
-        [
-            pl.Field("couplex_positives", pl.Int64),
-            pl.Field("random_positives", pl.Int64),
-            pl.Field("rcoverlap_positives", pl.Int64),
-            pl.Field("diff_to_obs", pl.Int64),
-            pl.Field("couplexes", pl.Int64),
-        ]
-    )
+    # convert the columns needed for the couplexes calculation to the same datatype
+    df = df.cast({col: pl.Float64 for col in INPUT_COLUMNS})
 
-    df = (
-        # convert the columns needed for the couplexes calculation to the same datatype
-        df.cast(
-            {
-                "valid_partitions": pl.Float64,
-                "positives_ab1": pl.Float64,
-                "positives_ab2": pl.Float64,
-                "positives_double": pl.Float64,
-                "volume_per_well": pl.Float64,
-                "mastermix_volume": pl.Float64,
-            }
-        )
-        .with_columns(
-            # select the columns needed for the calculation of the number of couplexes
-            pl.struct(
-                [
-                    "valid_partitions",
-                    "positives_ab1",
-                    "positives_ab2",
-                    "positives_double",
-                    "volume_per_well",
-                    "mastermix_volume",
-                ]
+    def solver(inputs: np.ndarray) -> np.ndarray:
+        # only the rows missing in the cache end up here
+        if workers > 1 and len(inputs) >= 2 * MIN_ROWS_PER_WORKER:
+            return _solve_parallel(
+                pl.DataFrame(inputs, schema=INPUT_COLUMNS, orient="row"), workers
             )
-            # apply the _couplexes() function in a row-wise manner
-            .map_elements(
-                lambda row: _couplexes(
-                    (
-                        row["valid_partitions"],
-                        row["positives_ab1"],
-                        row["positives_ab2"],
-                        row["positives_double"],
-                        row["volume_per_well"],
-                        row["mastermix_volume"],
-                    )
-                ),
-                # return types needs to be specified
-                return_dtype=return_types,
-            ).alias("couplexes_result")
-        )
-        # unpack the result column from above and drop it afterwards
-        .with_columns(
-            [
-                pl.col("couplexes_result").struct.field("couplex_positives"),
-                pl.col("couplexes_result").struct.field("random_positives"),
-                pl.col("couplexes_result").struct.field("rcoverlap_positives"),
-                pl.col("couplexes_result").struct.field("diff_to_obs"),
-                pl.col("couplexes_result").struct.field("couplexes"),
-            ]
+        return solve_couplexes(*np.ascontiguousarray(inputs.T))
+
+    # one row of results per row of the dataframe, the columns are ordered like RESULT_COLUMNS
+    results = SOLVE_CACHE.solve(df.select(INPUT_COLUMNS).to_numpy(), solver)
+
+    return df.with_columns(
+        pl.Series(name, results[:, i], dtype=pl.Int64)
+        for i, name in enumerate(RESULT_COLUMNS)
+    )
+
+
+# the pool is started once and then reused for all calculations of this process
+_executor = None
+_executor_workers = 0
+
+
+def _get_executor(workers: int) -> ProcessPoolExecutor:
+    """
+    This function returns the process pool and only starts a new one if the number of workers changed.
+
+    Args:
+        workers (int): number of worker processes
+
+    Returns:
+        ProcessPoolExecutor: the pool of worker processes
+    """
+
+    global _executor, _executor_workers
+
+    if _executor is None or _executor_workers != workers:
+        if _executor is not None:
+            _executor.shutdown()
+        # spawn instead of fork, because forking the threads of a running shiny server is not safe
+        _executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
         )
-        .drop("couplexes_result")
+        _executor_workers = workers
+
+    return _executor
+
+
+def _solve_parallel(df: pl.DataFrame, workers: int) -> np.ndarray:
+    """
+    This function splits the dataframe into chunks of rows, solves them in the worker processes and puts the results back together in the original order. The chunks and the results are handed over as shared Arrow IPC files (see shared_frames.py) instead of being pickled.
+
+    Args:
+        df (pl.DataFrame): the columns of INPUT_COLUMNS as Float64
+        workers (int): number of worker processes
+
+    Returns:
+        np.ndarray: a 2d integer array with one row per input row and the columns of RESULT_COLUMNS
+    """
+
+    # a few chunks per worker balance the load, because the time per row depends on the number of double positives
+    n_chunks = min(workers * 4, df.height // MIN_ROWS_PER_WORKER * workers)
+    chunk_size = -(-df.height // n_chunks)
+
+    # all shared files are removed when the calculation is done, even if it fails
+    with SharedFrames() as frames:
+        handles = [
+            frames.export(df.slice(offset, chunk_size))
+            for offset in range(0, df.height, chunk_size)
+        ]
+        # map returns the results in the order of the chunks
+        result_handles = list(_get_executor(workers).map(_solve_chunk, handles))
+
+        return np.vstack([attach(handle).to_numpy() for handle in result_handles])
+
+
+def _solve_chunk(handle: str) -> str:
+    """
+    This function runs in the worker processes and solves one chunk of rows.
+
+    Args:
+        handle (str): handle of the shared chunk with the columns of INPUT_COLUMNS
+
+    Returns:
+        str: handle of the shared results of this chunk, it is stored next to the chunk and thus removed together with it
+    """
+
+    df = attach(handle)
+    results = solve_couplexes(*(df[col].to_numpy() for col in INPUT_COLUMNS))
+
+    result_handle = handle.replace(".arrow", "_results.arrow")
+    pl.DataFrame(results, schema=RESULT_COLUMNS, orient="row").write_ipc(
+        result_handle, compression="uncompressed"
     )
 
-    return df
+    return result_handle
+
+
+def _solve_rows_numpy(n, nA, nB, nD, cycled_volume, mastermix_vol) -> np.ndarray:
+    """
+    Pure NumPy fallback of the kernel, which applies _couplexes to each row.
+
+    Args:
+        n, nA, nB, nD, cycled_volume, mastermix_vol (np.ndarray): the columns of the dataframe as float arrays, see _couplexes() for details
+
+    Returns:
+        np.ndarray: a 2d integer array with one row per input row and the columns of RESULT_COLUMNS
+    """
+
+    results = np.empty((len(n), len(RESULT_COLUMNS)), dtype=np.int64)
+    for row, args in enumerate(zip(n, nA, nB, nD, cycled_volume, mastermix_vol)):
+        result = _couplexes(args)
+        results[row] = [result[name] for name in RESULT_COLUMNS]
+
+    return results
+
+
+def _solve_row(n, nA, nB, nD, cycled_volume, mastermix_vol):
+    """
+    This function does the same calculation as _couplexes, but in one loop over nC without any intermediate arrays. The order of the operations is exactly the same, so that the results are identical. It is only used compiled by numba.
+
+    Returns:
+        tuple: the values of RESULT_COLUMNS
+    """
+
+    # see _couplexes for the explanation of the single steps
+    nA = nA + nD
+    nB = nB + nD
+
+    min_diff = np.inf
+    min_nC = 0.0
+    min_nR = 0.0
+    min_nO = 0.0
+    # same length as np.arange(0, nD, 1)
+    for i in range(int(np.ceil(nD))):
+        nC = float(i)
+        nA_i = nA - i
+        nB_i = nB - i
+        nR = np.rint(nA_i * nB_i / n)
+        nO = np.rint(nA_i * nB_i * nC / n**2)
+        nD_calc = nR + nC - nO
+        diff = np.rint((nD - nD_calc) ** 2)
+        # strictly smaller to return the first minimum like np.argmin
+        if diff < min_diff:
+            min_diff = diff
+            min_nC = nC
+            min_nR = nR
+            min_nO = nO
+
+    couplexes = np.rint(n * (np.log(n) - np.log(n - min_nC)))
+
+    if mastermix_vol:
+        couplexes = couplexes * mastermix_vol / cycled_volume
+
+    return (
+        np.int64(np.rint(min_nC)),
+        np.int64(np.rint(min_nR)),
+        np.int64(np.rint(min_nO)),
+        np.int64(np.rint(min_diff)),
+        np.int64(np.rint(couplexes)),
+    )
+
+
+def _solve_rows(n, nA, nB, nD, cycled_volume, mastermix_vol):
+    """
+    This function applies _solve_row to all rows, the rows are distributed over all cores by numba.
+
+    Returns:
+        np.ndarray: a 2d integer array with one row per input row and the columns of RESULT_COLUMNS
+    """
+
+    results = np.empty((len(n), 5), dtype=np.int64)
+    for row in numba.prange(len(n)):
+        result = _solve_row(
+            n[row], nA[row], nB[row], nD[row], cycled_volume[row], mastermix_vol[row]
+        )
+        for col in range(5):
+            results[row, col] = result[col]
+
+    return results
+
+
+# the kernel is detected at import time, the compiled functions are cached on disk
+if numba is not None:
+    _solve_row = numba.njit(cache=True)(_solve_row)
+    _solve_rows = numba.njit(parallel=True, cache=True)(_solve_rows)
+    solve_couplexes = _solve_rows
+else:
+    solve_couplexes = _solve_rows_numpy
 
 
 def _couplexes(args) -> pl.Struct:
@@ -158,3 +328,19 @@ def _couplexes(args) -> pl.Struct:
         "diff_to_obs": int(round(diff[min_index])),
         "couplexes": int(round(couplexes)),
     }
+
+
+# compare the compiled kernel with _couplexes on the example files
+# python couplex_calculation.py
+if __name__ == "__main__":
+    from pathlib import Path
+
+    # class
+    from pico import PICO
+
+    print(f"numba available: {numba is not None}")
+    for file in sorted((Path(__file__).parent / "examples").glob("*.csv")):
+        df = PICO(file_info={"name": file.name, "datapath": str(file)}).df_filtered_prelim
+        arrays = [df[col].cast(pl.Float64).to_numpy() for col in INPUT_COLUMNS]
+        assert np.array_equal(solve_couplexes(*arrays), _solve_rows_numpy(*arrays))
+        print(f"{file.name}: identical results for {len(df)} rows")
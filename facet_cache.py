@@ -0,0 +1,205 @@
+# python packages
+import math
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import matplotlib.pyplot as plt
+import numpy as np
+import polars as pl
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from plotnine import ggplot, theme
+
+# rendered panels kept per PICO object, a panel of 400 x 300 px needs about 0.5 MB
+PANEL_CACHE_SIZE = 128
+
+
+class PanelCache:
+    """
+    Cache of rendered facet panels as RGBA arrays. The key of a panel contains everything that changes its pixels, i.e. the plotted data subset (see frame_key()), the shared axis limits, the plot options and the size of the panel. Thus, unticking one antibody leaves the keys of all other panels unchanged and only the layout of the composed image changes. The least recently used panels are removed first. Panels are rendered asynchronously, a panel which is still being rendered is not started a second time.
+    """
+
+    def __init__(self, maxsize: int = PANEL_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.panels = OrderedDict()
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple, render) -> Future:
+        """
+        This function returns the cached panel or starts rendering it.
+
+        Args:
+            key (tuple): the key of the panel
+            render (function): starts rendering the panel, if it is not cached, and returns a Future of the RGBA array (see plot_rendering.submit_panel())
+
+        Returns:
+            Future: the panel as RGBA array
+        """
+
+        with self._lock:
+            panel = self.panels.get(key)
+            if panel is not None:
+                self.panels.move_to_end(key)
+                self.hits += 1
+                future = Future()
+                future.set_result(panel)
+                return future
+            future = self.pending.get(key)
+            if future is not None:
+                self.hits += 1
+                return future
+            self.misses += 1
+
+        future = render()
+        with self._lock:
+            self.pending[key] = future
+        # a finished future calls this right away, so the lock must not be held here
+        future.add_done_callback(lambda future: self._store(key, future))
+
+        return future
+
+    def _store(self, key: tuple, future: Future):
+        """
+        This function moves a rendered panel into the cache. Failed panels are not cached, they are rendered again with the next request.
+        """
+
+        with self._lock:
+            self.pending.pop(key, None)
+            if future.cancelled() or future.exception() is not None:
+                return
+            self.panels[key] = future.result()
+            while len(self.panels) > self.maxsize:
+                self.panels.popitem(last=False)
+
+
+def frame_key(df: pl.DataFrame) -> tuple:
+    """
+    This function returns a fingerprint of the content of a dataframe. Enums are hashed as strings, because two plates (or a plate before and after editing its metadata) may use the same physical codes for different labels.
+
+    Args:
+        df (pl.DataFrame): the data of a panel
+
+    Returns:
+        tuple: number of rows and the sum of the row hashes
+    """
+
+    df = df.with_columns(pl.col(pl.Enum).cast(pl.String))
+
+    return df.height, int(df.hash_rows(seed=0).sum())
+
+
+def wrap_dims(n: int) -> tuple:
+    """
+    This function returns the number of rows and columns of n panels just as facet_wrap() does it without nrow and ncol.
+
+    Args:
+        n (int): number of panels
+
+    Returns:
+        tuple: number of rows and number of columns
+    """
+
+    ncol = math.ceil(math.sqrt(n))
+
+    return math.ceil(n / ncol), ncol
+
+
+def render_panel(p: ggplot, width: float, height: float, dpi: int) -> np.ndarray:
+    """
+    This function renders a plot with a single facet into an RGBA array.
+
+    Args:
+        p (ggplot): the plot of the panel
+        width (float): width in inches
+        height (float): height in inches
+        dpi (int): resolution
+
+    Returns:
+        np.ndarray: the rendered image (height x width x 4)
+    """
+
+    figure = (p + theme(figure_size=(width, height), dpi=dpi)).draw()
+    # the Agg canvas renders into memory independent of the backend of the app
+    canvas = FigureCanvasAgg(figure)
+    canvas.draw()
+    panel = np.asarray(canvas.buffer_rgba()).copy()
+    # plotnine creates the figure with pyplot, which keeps a reference until it is closed
+    plt.close(figure)
+
+    return panel
+
+
+def compose(panels: list, ncol: int, dpi: int) -> Figure:
+    """
+    This function places the panels row by row into one image, just as facet_wrap() does it.
+
+    Args:
+        panels (list): RGBA arrays of the same size
+        ncol (int): number of columns
+        dpi (int): resolution
+
+    Returns:
+        Figure: a figure, which only shows the composed image
+    """
+
+    height, width = panels[0].shape[:2]
+    nrow = math.ceil(len(panels) / ncol)
+
+    # empty positions stay white
+    image = np.full((nrow * height, ncol * width, 4), 255, dtype=np.uint8)
+    for i, panel in enumerate(panels):
+        row, col = divmod(i, ncol)
+        image[row * height : (row + 1) * height, col * width : (col + 1) * width] = (
+            panel
+        )
+
+    # the figure is not created with pyplot, so it is not registered anywhere and needs no closing
+    figure = Figure(figsize=(ncol * width / dpi, nrow * height / dpi), dpi=dpi)
+    # shiny reads the grid position of the axes for the coordinates of the image, so the axes are a subplot filling the figure
+    ax = figure.add_subplot()
+    figure.subplots_adjust(left=0, right=1, bottom=0, top=1)
+    ax.imshow(image, interpolation="antialiased")
+    ax.set_axis_off()
+
+    return figure
+
+
+def compose_when_done(panels: list, ncol: int, dpi: int) -> Future:
+    """
+    This function composes the panels (see compose()) as soon as all of them are rendered. It returns immediately, the image is composed in the thread finishing the last panel.
+
+    Args:
+        panels (list): Futures of RGBA arrays of the same size, see PanelCache.get()
+        ncol (int): number of columns
+        dpi (int): resolution
+
+    Returns:
+        Future: the composed figure
+    """
+
+    composed = Future()
+    remaining = [len(panels)]
+    lock = threading.Lock()
+
+    def done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] > 0:
+                return
+        try:
+            composed.set_result(
+                compose([panel.result() for panel in panels], ncol, dpi)
+            )
+        except Exception as e:
+            composed.set_exception(e)
+
+    for panel in panels:
+        panel.add_done_callback(done)
+
+    return composed
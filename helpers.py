@@ -1,5 +1,7 @@
 import math
 
+import polars as pl
+
 # this function originates from my AMULATOR_offline
 # https://github.com/LangeTo/AMULATOR_offline/blob/main/couplex_functions.py
 
@@ -33,3 +35,41 @@ def round_up(n, decimals=0):
 
     multiplier = 10**decimals
     return math.ceil(n * multiplier) / multiplier
+
+
+def to_columnar(df, decimals=4):
+    """
+    Turn a polars dataframe into a compact columnar dict that can be sent to the browser as JSON. String columns are dictionary encoded, i.e. every label is only sent once and the rows only carry integer codes, floats are rounded to save some bytes.
+
+    Parameters:
+    df (pl.DataFrame): The dataframe to be converted.
+    decimals (int): The number of decimal places of float columns. Default is 4.
+
+    Returns:
+    dict: {"length": number of rows, "columns": {column name: values or {"labels": [...], "codes": [...]}}}
+    """
+
+    columns = {}
+    for name, dtype in df.schema.items():
+        s = df[name]
+        if isinstance(dtype, pl.Enum):
+            # enums are already dictionary encoded
+            columns[name] = {
+                "labels": dtype.categories.to_list(),
+                "codes": s.to_physical().to_list(),
+            }
+        elif dtype == pl.String:
+            labels = s.unique(maintain_order=True)
+            columns[name] = {
+                "labels": labels.to_list(),
+                "codes": s.replace_strict(
+                    labels, range(len(labels)), return_dtype=pl.UInt32
+                ).to_list(),
+            }
+        elif dtype.is_float():
+            # NaN is not valid JSON, so it is sent as null
+            columns[name] = s.fill_nan(None).round(decimals).to_list()
+        else:
+            columns[name] = s.to_list()
+
+    return {"length": df.height, "columns": columns}
@@ -0,0 +1,327 @@
+# python packages
+import argparse
+import hashlib
+import multiprocessing
+import os
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import polars as pl
+
+# watchfiles uses inotify on linux, so new files are seen right away
+# without it, the folder is scanned every POLL_INTERVAL seconds
+try:
+    from watchfiles import watch
+except ImportError:
+    watch = None
+
+# own functions
+from report import process_file
+from snapshots import SNAPSHOT_ROOT, load_snapshot
+from study_store import DEFAULT_ROOT, StudyStore, file_lock, replace_parquet
+
+# number of processes processing files at the same time
+INGEST_WORKERS = int(os.environ.get("PICO_INGEST_WORKERS", 2))
+# maximal number of files handed to the workers at once, further files wait in the folder
+# thus, hundreds of files arriving together neither fill the memory nor delay the files of the next scan for long
+MAX_PENDING = int(os.environ.get("PICO_INGEST_MAX_PENDING", 2 * INGEST_WORKERS))
+# seconds between two scans of the folder, also used as timeout of the file events
+POLL_INTERVAL = float(os.environ.get("PICO_INGEST_POLL_INTERVAL", 5))
+
+LEDGER_SCHEMA = {
+    "sha256": pl.String,
+    "path": pl.String,
+    "status": pl.String,
+    "plate_id": pl.String,
+    "token": pl.String,
+    "message": pl.String,
+    "ingested_at": pl.Datetime("us"),
+}
+
+
+def file_hash(path: Path) -> str:
+    """
+    This function calculates the SHA-256 hash of the content of a file.
+
+    Args:
+        path (Path): the file
+
+    Returns:
+        str: the hash as hex string
+    """
+
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+class IngestLedger:
+    """
+    Record of all ingested files by the hash of their content, stored as Parquet file next to the study store. A file is processed again only if its content changes, renaming or copying it does not matter. Failed files are recorded as well, so that a broken export is not processed again and again. The app watches this file to show new plates in the open sessions.
+    """
+
+    def __init__(self, root: str = DEFAULT_ROOT):
+        self.path = Path(root) / "ingested.parquet"
+
+    def read(self) -> pl.DataFrame:
+        """
+        This function returns all entries of the ledger.
+
+        Returns:
+            pl.DataFrame: one row per ingested file, see LEDGER_SCHEMA
+        """
+
+        if not self.path.exists():
+            return pl.DataFrame(schema=LEDGER_SCHEMA)
+
+        return pl.read_parquet(self.path)
+
+    def add(self, entries: list):
+        """
+        This function appends entries to the ledger.
+
+        Args:
+            entries (list): dictionaries with the columns of LEDGER_SCHEMA
+        """
+
+        if not entries:
+            return
+
+        # e.g. a second daemon watching another folder, see StudyStore.append()
+        with file_lock(self.path):
+            df = pl.concat([self.read(), pl.DataFrame(entries, schema=LEDGER_SCHEMA)])
+            replace_parquet(df, self.path)
+
+
+class IngestDaemon:
+    """
+    Watches a folder for new or changed MultipleOccupancy files and processes them through the PICO pipeline. Each file is saved as snapshot, appended to the study store and recorded in the ledger.
+
+    A file is only picked up, if its size and modification time did not change since the previous scan, i.e. the instrument finished writing it. The content is hashed just before the file is processed, so that files already in the ledger are skipped without processing. At most max_pending files are in the pool at once. The remaining files stay in the queue and are handed over one by one when workers finish. The workers only write the snapshots, which are kept until they are removed by hand, because the study store and the ledger refer to them. The study store and the ledger are written by the daemon itself under a file lock, since the app appends to the same study store.
+    """
+
+    def __init__(
+        self,
+        folder: str,
+        root: str = DEFAULT_ROOT,
+        snapshot_root: str = SNAPSHOT_ROOT,
+        workers: int = INGEST_WORKERS,
+        max_pending: int = MAX_PENDING,
+        hyperwells: bool = False,
+        estimator: str = "ddpcs",
+        pattern: str = "*.csv",
+    ):
+        self.folder = Path(folder)
+        self.store = StudyStore(root)
+        self.ledger = IngestLedger(root)
+        self.snapshot_root = snapshot_root
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self.hyperwells = hyperwells
+        self.estimator = estimator
+        self.pattern = pattern
+
+        # hashes of all ingested files, the ledger is only read once
+        self.hashes = set(self.ledger.read()["sha256"].to_list())
+        # size and modification time of each file at the previous scan and when it was last handled
+        self.seen = {}
+        self.handled = {}
+        # files ready to be processed and the files currently processed by the workers
+        self.queue = deque()
+        self.pending = {}
+        self._stop = threading.Event()
+
+    def scan(self):
+        """
+        This function adds all new or changed files, which are completely written, to the queue.
+        """
+
+        seen = {}
+        for path in sorted(self.folder.glob(self.pattern)):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                # the file was removed in the meantime
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            seen[path] = signature
+
+            # still being written or unchanged since it was handled
+            if self.seen.get(path) != signature or self.handled.get(path) == signature:
+                continue
+            if path in self.queue or path in self.pending.values():
+                continue
+            self.queue.append(path)
+
+        self.seen = seen
+
+    def dispatch(self, executor: ProcessPoolExecutor):
+        """
+        This function hands files from the queue to the workers until max_pending files are processed.
+
+        Args:
+            executor (ProcessPoolExecutor): the pool of workers
+        """
+
+        while self.queue and len(self.pending) < self.max_pending:
+            path = self.queue.popleft()
+            try:
+                digest = file_hash(path)
+            except FileNotFoundError:
+                continue
+            self.handled[path] = self.seen.get(path)
+
+            # the same content was already ingested, maybe under another name
+            if digest in self.hashes or any(
+                pending_digest == digest for pending_digest, _ in self.pending
+            ):
+                continue
+
+            future = executor.submit(
+                process_file,
+                str(path),
+                self.hyperwells,
+                self.estimator,
+                self.snapshot_root,
+                True,
+            )
+            self.pending[(digest, future)] = path
+
+    def collect(self, timeout: float = None) -> list:
+        """
+        This function stores the results of all finished files.
+
+        Args:
+            timeout (float, optional): seconds to wait for at least one file to finish. Defaults to None, i.e. no waiting.
+
+        Returns:
+            list: the new entries of the ledger
+        """
+
+        if timeout and self.pending:
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline and not any(
+                future.done() for _, future in self.pending
+            ):
+                time.sleep(0.1)
+
+        entries = []
+        for key in [key for key in self.pending if key[1].done()]:
+            digest, future = key
+            path = self.pending.pop(key)
+            entry = {
+                "sha256": digest,
+                "path": str(path),
+                "status": "done",
+                "plate_id": None,
+                "token": None,
+                "message": None,
+                "ingested_at": datetime.now(),
+            }
+            try:
+                token = future.result()
+                pico = load_snapshot(token, self.snapshot_root)
+                self.store.append(pico)
+                entry.update(plate_id=pico.plate_id, token=token)
+            except Exception as e:
+                # e.g. a file of an unsupported version, it is recorded and not tried again until its content changes
+                entry.update(status="failed", message=f"{type(e).__name__}: {e}")
+            self.hashes.add(digest)
+            entries.append(entry)
+
+        self.ledger.add(entries)
+        for entry in entries:
+            print(f"{entry['status']}: {entry['path']} {entry['message'] or entry['plate_id']}")
+
+        return entries
+
+    def run(self, once: bool = False):
+        """
+        This function processes the files of the folder until stop() is called.
+
+        Args:
+            once (bool, optional): process the files in the folder and return afterwards. Defaults to False.
+        """
+
+        # spawn instead of fork, so that the workers do not inherit the threads of watchfiles
+        with ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            if once:
+                # files of a finished batch are complete, so two scans right after each other are enough
+                self.scan()
+                self.scan()
+                while self.queue or self.pending:
+                    self.dispatch(executor)
+                    self.collect(timeout=POLL_INTERVAL)
+                return
+
+            for _ in self._changes():
+                self.collect()
+                self.scan()
+                self.dispatch(executor)
+
+    def stop(self):
+        """
+        This function ends run() after the current scan. Files processed at this moment are finished first.
+        """
+
+        self._stop.set()
+
+    def _changes(self):
+        """
+        This function waits for changes of the folder. It returns at the latest after POLL_INTERVAL seconds, so that files become stable and results are collected without further events.
+        """
+
+        if watch is not None:
+            yield from watch(
+                self.folder,
+                stop_event=self._stop,
+                rust_timeout=int(POLL_INTERVAL * 1000),
+                yield_on_timeout=True,
+            )
+        else:
+            while not self._stop.wait(POLL_INTERVAL):
+                yield set()
+
+
+# command line interface of the daemon
+# python ingest.py /mnt/qiacuity/exports
+# python ingest.py /mnt/qiacuity/exports --once
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Process new MultipleOccupancy files of a folder into the study store."
+    )
+    parser.add_argument("folder", help="folder of the exports of the instruments")
+    parser.add_argument("--root", default=DEFAULT_ROOT, help="location of the store")
+    parser.add_argument(
+        "--snapshots", default=SNAPSHOT_ROOT, help="location of the snapshots"
+    )
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS)
+    parser.add_argument("--max-pending", type=int, default=MAX_PENDING)
+    parser.add_argument("--hyperwells", action="store_true", help="combine hyperwells")
+    parser.add_argument(
+        "--estimator", default="ddpcs", choices=["ddpcs", "ml", "joint"]
+    )
+    parser.add_argument(
+        "--once", action="store_true", help="process the current files and exit"
+    )
+    args = parser.parse_args()
+
+    daemon = IngestDaemon(
+        args.folder,
+        root=args.root,
+        snapshot_root=args.snapshots,
+        workers=args.workers,
+        max_pending=args.max_pending,
+        hyperwells=args.hyperwells,
+        estimator=args.estimator,
+    )
+    try:
+        daemon.run(once=args.once)
+    except KeyboardInterrupt:
+        daemon.stop()
@@ -0,0 +1,323 @@
+// client-side rendering of the plots for the interactive mode
+// the server sends the data once per upload (see PICO.get_plot_payload() in pico.py)
+// afterwards, all filtering and redrawing happens here in the browser without the server
+
+(function () {
+  // the payload from the server and the current values of the control elements
+  const state = { payload: null, couplexes: [], lambdas: [], inputs: {} };
+
+  // inputs that change what is displayed
+  const watched = [
+    "interactive_plots",
+    "lambda_filter",
+    "slider_lambda",
+    "filter_group",
+    "filter_sample",
+    "filter_antibodies",
+    "plot_type",
+  ];
+
+  // turn the columnar payload (see to_columnar() in helpers.py) into an array of rows
+  function decode(columnar) {
+    const names = Object.keys(columnar.columns);
+    const rows = new Array(columnar.length);
+    for (let i = 0; i < columnar.length; i++) {
+      const row = {};
+      for (const name of names) {
+        const col = columnar.columns[name];
+        // dictionary encoded string columns carry labels and codes
+        row[name] = Array.isArray(col) ? col[i] : col.labels[col.codes[i]];
+      }
+      rows[i] = row;
+    }
+    return rows;
+  }
+
+  // same logic as PICO.filtering()
+  function filterRows() {
+    const inputs = state.inputs;
+    const groups = new Set(inputs.filter_group || []);
+    const samples = new Set(inputs.filter_sample || []);
+    const antibodies = new Set(inputs.filter_antibodies || []);
+    const [minLambda, maxLambda] = inputs.lambda_filter && inputs.slider_lambda
+      ? inputs.slider_lambda
+      : [-Infinity, Infinity];
+
+    return state.couplexes.filter(
+      (row) =>
+        row.lambda_ab1 >= minLambda &&
+        row.lambda_ab1 <= maxLambda &&
+        row.lambda_ab2 >= minLambda &&
+        row.lambda_ab2 <= maxLambda &&
+        groups.has(row.group) &&
+        samples.has(row.sample_name) &&
+        antibodies.has(row.antibodies)
+    );
+  }
+
+  // message for empty selections, same as in the static plots
+  function emptySpec(colors) {
+    return {
+      width: "container",
+      height: 300,
+      mark: { type: "text", fontSize: 16, color: colors.dark },
+      data: { values: [{}] },
+      encoding: {
+        text: {
+          value: [
+            "The current selection returns an empty dataframe.",
+            "Nothing to display :-(",
+          ],
+        },
+      },
+      config: { view: { stroke: null } },
+    };
+  }
+
+  function couplexSpec(rows) {
+    const colors = state.payload.colors;
+    if (rows.length === 0) {
+      return emptySpec(colors);
+    }
+
+    const plotType = state.inputs.plot_type || ["Boxplot", "Violinplot"];
+    const x = { field: "sample_name", type: "nominal", title: "Sample" };
+    const y = {
+      field: "couplexes",
+      type: "quantitative",
+      title: `Number of couplexes in ${state.payload.vol} ul`,
+    };
+
+    const layers = [
+      {
+        // jitter the points horizontally like position_jitter in the static plot
+        transform: [{ calculate: "0.4 * (random() - 0.5)", as: "jitter" }],
+        mark: { type: "point", filled: true, size: 80, opacity: 0.5 },
+        encoding: {
+          x: x,
+          xOffset: { field: "jitter", type: "quantitative" },
+          y: y,
+          color: { value: colors.primary },
+          tooltip: [
+            { field: "group" },
+            { field: "sample_name" },
+            { field: "well" },
+            { field: "couplexes" },
+          ],
+        },
+      },
+    ];
+
+    // the violin is not available as a vega-lite mark, so the boxplot also represents the violin plot
+    if (plotType.length > 0) {
+      layers.push({
+        mark: {
+          type: "boxplot",
+          extent: "min-max",
+          size: 30,
+          opacity: 0,
+          median: { color: colors.dark },
+          rule: { color: colors.dark },
+          box: { stroke: colors.dark },
+        },
+        encoding: { x: x, y: y },
+      });
+    }
+
+    return {
+      data: { values: rows },
+      facet: {
+        column: { field: "antibodies", type: "nominal", title: null },
+      },
+      spec: { width: 200, height: 450, layer: layers },
+      resolve: { scale: { x: "independent" } },
+      config: {
+        header: { labelColor: colors.dark },
+        axis: { labelColor: colors.dark, titleColor: colors.dark },
+      },
+    };
+  }
+
+  function lambdaRangeSpec(rows) {
+    const colors = state.payload.colors;
+    if (rows.length === 0) {
+      return emptySpec(colors);
+    }
+
+    // same long format as in PICO._format_for_lambda_range()
+    const longRows = [];
+    for (const row of rows) {
+      const facet = `${row.group} | ${row.sample_name} | ${row.antibodies}`;
+      longRows.push({ facet: facet, antibody: row.antibody1, lambda: row.lambda_ab1 });
+      longRows.push({ facet: facet, antibody: row.antibody2, lambda: row.lambda_ab2 });
+    }
+
+    const y = { field: "antibody", type: "nominal", title: "Antibodies" };
+
+    return {
+      data: { values: longRows },
+      facet: { field: "facet", type: "nominal", title: null, columns: 3 },
+      spec: {
+        width: 200,
+        transform: [
+          {
+            aggregate: [
+              { op: "min", field: "lambda", as: "min" },
+              { op: "max", field: "lambda", as: "max" },
+              { op: "mean", field: "lambda", as: "mean" },
+            ],
+            groupby: ["facet", "antibody"],
+          },
+        ],
+        layer: [
+          {
+            mark: { type: "rule", strokeWidth: 6, color: colors.dark },
+            encoding: {
+              x: { field: "min", type: "quantitative", title: "λ-range" },
+              x2: { field: "max" },
+              y: y,
+            },
+          },
+          {
+            transform: [{ fold: ["min", "max", "mean"], as: ["stat", "lambda"] }],
+            mark: { type: "point", filled: true, size: 120 },
+            encoding: {
+              x: { field: "lambda", type: "quantitative" },
+              y: y,
+              color: {
+                field: "stat",
+                type: "nominal",
+                scale: {
+                  domain: ["min", "mean", "max"],
+                  range: [colors.primary, colors.secondary, colors.primary],
+                },
+                legend: null,
+              },
+              tooltip: [
+                { field: "antibody" },
+                { field: "stat" },
+                { field: "lambda", format: ".2f" },
+              ],
+            },
+          },
+        ],
+      },
+      resolve: { scale: { y: "independent" } },
+      config: {
+        header: { labelColor: colors.dark },
+        axis: { labelColor: colors.dark, titleColor: colors.dark },
+      },
+    };
+  }
+
+  function lambdaHistSpec() {
+    const colors = state.payload.colors;
+    const inputs = state.inputs;
+    const filtering = inputs.lambda_filter && inputs.slider_lambda;
+    const [minLambda, maxLambda] = filtering ? inputs.slider_lambda : [0, 0];
+
+    return {
+      width: "container",
+      height: 60,
+      data: { values: state.lambdas },
+      transform: [
+        {
+          calculate: filtering
+            ? `datum.lambda_ab < ${minLambda} || datum.lambda_ab > ${maxLambda} ? 'outside' : 'within'`
+            : "'outside'",
+          as: "color_class",
+        },
+      ],
+      mark: { type: "bar" },
+      encoding: {
+        x: {
+          field: "lambda_ab",
+          type: "quantitative",
+          bin: { step: 0.01, extent: [0, state.payload.max_lambda] },
+          scale: { domain: [0, state.payload.max_lambda] },
+          title: null,
+        },
+        y: { aggregate: "count", type: "quantitative", axis: null },
+        color: {
+          field: "color_class",
+          type: "nominal",
+          scale: {
+            domain: ["within", "outside"],
+            range: [colors.primary, colors.secondary],
+          },
+          legend: null,
+        },
+      },
+      config: {
+        view: { stroke: null },
+        axis: { labelColor: colors.dark, grid: false },
+      },
+    };
+  }
+
+  // same message as PICO.filtering() shows for the static plots
+  function filterMessage(rows) {
+    const el = document.getElementById("interactive_filter_message");
+    if (el === null) {
+      return;
+    }
+    const colors = state.payload.colors;
+    const flagged = rows.filter((row) => row.qc_flags !== 0).length;
+    el.innerHTML =
+      `Current plot displays <span style='color: ${colors.primary};'>${rows.length}</span> ` +
+      `of <span style='color: ${colors.primary};'>${state.couplexes.length}</span> total data points, ` +
+      `<span style='color: ${colors.secondary};'>${flagged}</span> of them are flagged by the quality control.`;
+  }
+
+  function embed(id, spec) {
+    const el = document.getElementById(id);
+    // the containers only exist after upload and when the interactive mode is selected
+    if (el !== null) {
+      vegaEmbed(el, spec, { actions: false, renderer: "canvas" });
+    }
+  }
+
+  function render() {
+    if (state.payload === null || !state.inputs.interactive_plots) {
+      return;
+    }
+    const rows = filterRows();
+    filterMessage(rows);
+    embed("interactive_couplexes", couplexSpec(rows));
+    embed("interactive_lambda_ranges", lambdaRangeSpec(rows));
+    embed("interactive_lambda_hist", lambdaHistSpec());
+  }
+
+  // several inputs usually change at once, e.g. after an upload, thus, rendering happens only once per animation frame
+  let scheduled = false;
+  function scheduleRender() {
+    if (!scheduled) {
+      scheduled = true;
+      window.requestAnimationFrame(() => {
+        scheduled = false;
+        render();
+      });
+    }
+  }
+
+  Shiny.addCustomMessageHandler("pico_payload", function (payload) {
+    state.payload = payload;
+    state.couplexes = decode(payload.couplexes);
+    state.lambdas = decode(payload.lambda);
+    scheduleRender();
+  });
+
+  $(document).on("shiny:inputchanged", function (event) {
+    if (watched.includes(event.name)) {
+      state.inputs[event.name] = event.value;
+      scheduleRender();
+    }
+  });
+
+  // the containers of the plots are inserted after the upload by the server
+  $(document).on("shiny:value", function (event) {
+    if (event.name === "dynamic_filters") {
+      scheduleRender();
+    }
+  });
+})();
@@ -0,0 +1,189 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+import polars as pl
+
+# own functions
+from couplex_calculation import INPUT_COLUMNS, RESULT_COLUMNS
+
+
+def design_matrix(channels: int) -> np.ndarray:
+    """
+    This function returns the linear model behind the joint estimation. Free antibodies and couplexes are Poisson distributed, thus, the fraction of partitions that are negative in all channels of a set T is F(T) = exp(-sum of the lambdas of all free antibodies in T and of all couplexes with at least one antibody in T). So -ln F(T) is linear in the lambdas and there is one equation for each non-empty set of channels.
+
+    Args:
+        channels (int): number of fluorescence channels
+
+    Returns:
+        np.ndarray: one row per non-empty set of channels (bit k of the row number + 1 is channel k), one column per free antibody followed by one column per pair of antibodies
+    """
+
+    pairs = list(itertools.combinations(range(channels), 2))
+    sets = np.arange(1, 2**channels)
+    # membership of each channel in each set
+    member = (sets[:, None] >> np.arange(channels)) & 1
+
+    return np.hstack(
+        [
+            member,
+            np.stack([member[:, i] | member[:, j] for i, j in pairs], axis=1),
+        ]
+    ).astype(np.float64)
+
+
+def solve_joint(counts: np.ndarray, channels: int) -> np.ndarray:
+    """
+    This function estimates the lambdas of all free antibodies and of all couplexes of many wells at once. For each well, the weighted least squares fit of the linear model of design_matrix() is calculated, the normal equations of all wells are solved in one batched call.
+
+    Args:
+        counts (np.ndarray): partition counts with one row per well and one column per group, bit k of the column number is set if channel k is positive
+        channels (int): number of fluorescence channels
+
+    Returns:
+        np.ndarray: lambdas with one row per well, first the free antibodies then the pairs like in design_matrix()
+    """
+
+    A = design_matrix(channels)
+    n = counts.sum(axis=1, keepdims=True)
+    sets = np.arange(1, 2**channels)
+    groups = np.arange(2**channels)
+
+    # F(T) is the sum over all groups without any positive channel in T
+    negative_in = (groups[None, :] & sets[:, None]) == 0
+    F = (counts @ negative_in.T.astype(np.float64)) / n
+    # half a partition avoids the logarithm of 0, if all partitions are positive
+    F = np.clip(F, 0.5 / n, 1.0)
+    y = -np.log(F)
+
+    # the variance of -ln F is approximately (1 - F) / (n F), so the weights are the inverse
+    w = n * F / np.maximum(1 - F, 1 / n)
+
+    # batched normal equations A' W A x = A' W y
+    AtWA = np.einsum("tp,wt,tq->wpq", A, w, A)
+    AtWy = np.einsum("tp,wt,wt->wp", A, w, y)
+
+    return np.linalg.solve(AtWA, AtWy[:, :, None])[:, :, 0]
+
+
+def estimate_joint(df: pd.DataFrame, hyperwells: bool = False) -> pl.DataFrame:
+    """
+    This function estimates the couplexes of all colorpairs of a well in one solve from the counts of all groups ("++--", "+-+-", ...) of the MultipleOccupancy file. Unlike calculate_clusters() and the dDPCS model, which look at each pair of channels on its own, partitions positive in three or four channels are used as joint evidence for all pairs. The outputs match the columns of the dDPCS model, so that the results can replace them (see calculate_couplexes_joint()).
+
+    Args:
+        df (pd.DataFrame): the MultipleOccupancy file as read by parsers.read_multiple_occupancy()
+        hyperwells (bool, optional): if true, the wells of a hyperwell are combined like in PICO._aggregate_hyperwells(). Defaults to False.
+
+    Returns:
+        pl.DataFrame: one row per well and colorpair with couplex_positives, random_positives, rcoverlap_positives, diff_to_obs and the number of couplexes in the valid partitions (couplexes_cycled)
+    """
+
+    # the first letters of the colors form the colorpairs just as in calculate_clusters()
+    colors = [color[0] for color in df["Categories"].iloc[0].split("-")]
+    channels = len(colors)
+    pairs = list(itertools.combinations(range(channels), 2))
+
+    df = pl.from_pandas(df[["Well", "Hyperwell", "Group", "Count categories"]])
+
+    # bit k of the group is set, if channel k is positive, e.g. "+-+" is 0b101
+    group = pl.sum_horizontal(
+        (pl.col("Group").str.slice(k, 1) == "+").cast(pl.Int64) * 2**k
+        for k in range(channels)
+    )
+    well = pl.col("Well")
+    if hyperwells:
+        well = (
+            pl.when(pl.col("Hyperwell").is_not_null() & (pl.col("Hyperwell") != "-"))
+            .then(pl.col("Hyperwell"))
+            .otherwise(pl.col("Well"))
+        )
+
+    df = (
+        df.select(well.alias("well"), group.alias("group"), pl.col("Count categories"))
+        .group_by(["well", "group"], maintain_order=True)
+        .agg(pl.col("Count categories").sum())
+    )
+    wells = df["well"].unique(maintain_order=True)
+
+    # one row per well and one column per group
+    counts = np.zeros((len(wells), 2**channels))
+    counts[
+        df["well"].replace_strict(wells, range(len(wells))).to_numpy(),
+        df["group"].to_numpy(),
+    ] = df["Count categories"].to_numpy()
+    n = counts.sum(axis=1)
+
+    # negative estimates are noise around 0
+    lambdas = np.clip(solve_joint(counts, channels), 0, None)
+    free, couplex = lambdas[:, :channels], lambdas[:, channels:]
+    groups = np.arange(2**channels)
+
+    results = []
+    for p, (i, j) in enumerate(pairs):
+        # everything else that makes a partition positive for antibody i or j
+        others = [q for q, pair in enumerate(pairs) if q != p]
+        lambda_i = free[:, i] + couplex[:, [q for q in others if i in pairs[q]]].sum(1)
+        lambda_j = free[:, j] + couplex[:, [q for q in others if j in pairs[q]]].sum(1)
+
+        # the same quantities as in the dDPCS model, but calculated from the joint fit
+        couplex_positives = -n * np.expm1(-couplex[:, p])
+        random_positives = n * np.expm1(-lambda_i) * np.expm1(-lambda_j)
+        rcoverlap_positives = random_positives * couplex_positives / n
+        # observed double positives of this pair, i.e. all groups with both channels positive
+        double = (groups >> i & 1) & (groups >> j & 1) == 1
+        positives_double = counts[:, double].sum(axis=1)
+        diff_to_obs = (
+            positives_double
+            - (random_positives + couplex_positives - rcoverlap_positives)
+        ) ** 2
+
+        results.append(
+            pl.DataFrame(
+                {
+                    "well": wells,
+                    "colorpair": colors[i] + colors[j],
+                    "couplex_positives": couplex_positives,
+                    "random_positives": random_positives,
+                    "rcoverlap_positives": rcoverlap_positives,
+                    "diff_to_obs": diff_to_obs,
+                    "couplexes_cycled": n * couplex[:, p],
+                }
+            )
+        )
+
+    return pl.concat(results)
+
+
+def calculate_couplexes_joint(
+    df: pl.DataFrame, df_joint: pl.DataFrame
+) -> pl.DataFrame:
+    """
+    This function adds the results of the joint estimation to the preprocessed dataframe. It is the counterpart of calculate_couplexes() and returns the same columns with the same data types, including the correction for the dead volume.
+
+    Args:
+        df (pl.DataFrame): preprocessed dataframe
+        df_joint (pl.DataFrame): result of estimate_joint()
+
+    Returns:
+        pl.DataFrame: df with the columns of the dDPCS model
+    """
+
+    df = df.cast({col: pl.Float64 for col in INPUT_COLUMNS}).join(
+        df_joint, on=["well", "colorpair"], how="left", maintain_order="left"
+    )
+
+    return (
+        df.with_columns(
+            # if the master mix volume is unknown, there is no correction for the dead volume
+            pl.when(pl.col("mastermix_volume") != 0)
+            .then(
+                pl.col("couplexes_cycled")
+                * pl.col("mastermix_volume")
+                / pl.col("volume_per_well")
+            )
+            .otherwise(pl.col("couplexes_cycled"))
+            .alias("couplexes")
+        )
+        .with_columns(pl.col(RESULT_COLUMNS).round().cast(pl.Int64))
+        .drop("couplexes_cycled")
+    )
@@ -0,0 +1,135 @@
+import numpy as np
+import polars as pl
+
+# own functions
+from couplex_calculation import INPUT_COLUMNS, RESULT_COLUMNS
+
+# the Fisher scoring converges in a few iterations, the limit only protects against rows that never settle
+MAX_ITERATIONS = 25
+# largest change of a lambda that still counts as converged
+TOLERANCE = 1e-10
+# probabilities of empty clusters are clipped to this value, so that their logarithm and inverse exist
+MIN_PROBABILITY = 1e-12
+
+
+def _probabilities(theta: np.ndarray) -> tuple:
+    """
+    This function calculates the probabilities of the four clusters of a colorpair and their derivatives. Free molecules of antibody A (lambda_A), free molecules of antibody B (lambda_B) and couplexes (lambda_C) are Poisson distributed into the partitions, a partition is positive for A if it contains a free A or a couplex and the same for B.
+
+    Args:
+        theta (np.ndarray): lambda_A, lambda_B and lambda_C with one row per row of the dataframe
+
+    Returns:
+        tuple: the probabilities of the negative, A-only, B-only and double positive partitions (rows x 4) and their derivatives with respect to the lambdas (rows x 4 x 3)
+    """
+
+    E, F, G = np.exp(-theta).T
+
+    p0 = E * F * G
+    pA = (1 - E) * F * G
+    pB = E * (1 - F) * G
+    pD = 1 - p0 - pA - pB
+    p = np.stack([p0, pA, pB, pD], axis=1)
+
+    # derivatives of p0, pA and pB, the derivatives of pD are minus their sum
+    dp = np.empty((len(theta), 4, 3))
+    dp[:, 0] = -p0[:, None]
+    dp[:, 1] = np.stack([p0, -pA, -pA], axis=1)
+    dp[:, 2] = np.stack([-pB, p0, -pB], axis=1)
+    dp[:, 3] = -dp[:, :3].sum(axis=1)
+
+    return np.clip(p, MIN_PROBABILITY, None), dp
+
+
+def solve_ml(n, nA, nB, nD) -> tuple:
+    """
+    This function maximises the multinomial likelihood of the observed clusters (negative, A-only, B-only, double positive) over continuous lambda_A, lambda_B and lambda_C >= 0 for all rows at once. Without the constraint, the model has as many parameters as the clusters have degrees of freedom, so the unconstrained maximum has a closed form, which is the starting point. Fisher scoring (Newton steps with the expected information, i.e. IRLS) then moves the rows, whose closed-form lambda_C is negative, onto the boundary. The inverse of the information at the maximum gives the standard errors.
+
+    Args:
+        n, nA, nB, nD (np.ndarray): valid partitions, single positives of antibody A and B and double positives like the inputs of _couplexes() in couplex_calculation.py
+
+    Returns:
+        tuple: the lambdas (rows x 3), their standard errors (rows x 3) and the number of iterations needed
+    """
+
+    counts = np.stack([n - nA - nB - nD, nA, nB, nD], axis=1)
+    # half a partition avoids the logarithm of 0, if a cluster is empty
+    f = np.clip(counts / n[:, None], 0.5 / n[:, None], None)
+
+    # closed form: p0 = exp(-a - b - c), p0 + pA = exp(-b - c) and p0 + pB = exp(-a - c)
+    a = np.log(f[:, 0] + f[:, 1]) - np.log(f[:, 0])
+    b = np.log(f[:, 0] + f[:, 2]) - np.log(f[:, 0])
+    c = -np.log(f[:, 0] + f[:, 1]) - b
+    theta = np.clip(np.stack([a, b, c], axis=1), 0, None)
+
+    for iteration in range(1, MAX_ITERATIONS + 1):
+        p, dp = _probabilities(theta)
+        # score and expected information of the multinomial likelihood
+        score = np.einsum("rk,rkq->rq", counts / p, dp)
+        information = n[:, None, None] * np.einsum("rk,rkp,rkq->rpq", 1 / p, dp, dp)
+
+        # lambdas on the boundary, whose score points outside, are kept fixed (active set)
+        fixed = (theta <= 0) & (score <= 0)
+        score = np.where(fixed, 0.0, score)
+        fixed_pairs = fixed[:, :, None] | fixed[:, None, :]
+        information = np.where(fixed_pairs, np.eye(3), information)
+
+        step = np.linalg.solve(information, score[:, :, None])[:, :, 0]
+        theta = np.clip(theta + step, 0, None)
+
+        if np.abs(step).max(initial=0) < TOLERANCE:
+            break
+
+    # standard errors of the unconstrained model at the maximum
+    p, dp = _probabilities(theta)
+    information = n[:, None, None] * np.einsum("rk,rkp,rkq->rpq", 1 / p, dp, dp)
+    se = np.sqrt(np.diagonal(np.linalg.inv(information), axis1=1, axis2=2))
+
+    return theta, se, iteration
+
+
+def calculate_couplexes_ml(df: pl.DataFrame) -> pl.DataFrame:
+    """
+    This function is the maximum likelihood counterpart of calculate_couplexes(). It returns the same columns, but derived from the continuous lambdas instead of a scan over integer numbers of couplex positive partitions, and the standard error of the couplexes as additional column.
+
+    Args:
+        df (pl.DataFrame): preprocessed dataframe
+
+    Returns:
+        pl.DataFrame: df with the columns of the dDPCS model and couplexes_se
+    """
+
+    df = df.cast({col: pl.Float64 for col in INPUT_COLUMNS})
+    n, nA, nB, nD, cycled_volume, mastermix_vol = (
+        df[col].to_numpy() for col in INPUT_COLUMNS
+    )
+
+    theta, se, _ = solve_ml(n, nA, nB, nD)
+    a, b, c = theta.T
+
+    # the same quantities as in the dDPCS model, i.e. partitions with a couplex, random double positives and both
+    couplex_positives = -n * np.expm1(-c)
+    random_positives = n * np.expm1(-a) * np.expm1(-b)
+    rcoverlap_positives = random_positives * couplex_positives / n
+    p, _ = _probabilities(theta)
+    diff_to_obs = (nD - n * p[:, 3]) ** 2
+
+    # if the master mix volume is unknown, there is no correction for the dead volume
+    volume_factor = np.where(mastermix_vol != 0, mastermix_vol / cycled_volume, 1.0)
+    couplexes = n * c * volume_factor
+
+    results = [
+        couplex_positives,
+        random_positives,
+        rcoverlap_positives,
+        diff_to_obs,
+        couplexes,
+    ]
+
+    return df.with_columns(
+        *(
+            pl.Series(name, np.rint(result), dtype=pl.Int64)
+            for name, result in zip(RESULT_COLUMNS, results)
+        ),
+        pl.Series("couplexes_se", n * se[:, 2] * volume_factor),
+    )
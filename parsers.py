@@ -0,0 +1,173 @@
+# python packages
+import csv
+
+from typing import NamedTuple
+
+import pandas as pd
+
+# only the first bytes of a file are read to recognise its version
+SNIFF_BYTES = 8192
+
+# apparently the MO file from the QIAcuity has two different "µ":
+# for col in df.columns:
+# print(col, [ord(char) for char in col])
+# "µ" is once used as with the decimal code 956 and the other times with 181
+# both are replaced with "u" in the column names
+MICRO_SIGNS = (chr(956), chr(181))
+
+# the columns of the MultipleOccupancy file actually used by the pipeline with their data types
+# all other columns, e.g. the concentrations calculated by the QIAcuity Software Suite, are never parsed
+COLUMNS = {
+    "Plate name": str,
+    "Plate ID": str,
+    "Plate type": str,
+    "Well": str,
+    "Hyperwell": str,
+    "Reaction Mix name": str,
+    "Sample name": str,
+    "Target names": str,
+    "Categories": str,
+    "Group": str,
+    # partition counts never exceed the 26K partitions of a well
+    # the counts are nullable, the QIAcuity Software Suite leaves them empty e.g. for wells excluded from the analysis
+    "Valid partitions": "Int32",
+    "Volume per well [uL]": "float64",
+    "Count categories": "Int32",
+}
+
+# columns, which are only needed in the hyperwell mode (see PICO)
+# if the file has none of them, they are filled with "-", i.e. no well is part of a hyperwell
+HYPERWELL_COLUMNS = ("Hyperwell",)
+
+
+class MOParser(NamedTuple):
+    """
+    Description of one version of the MultipleOccupancy file exported by the QIAcuity Software Suite. A file belongs to the version, if its header contains all markers of the version.
+    """
+
+    version: str
+    # column names that only exist from this version on
+    markers: tuple = ()
+    # projection of the file, i.e. the normalised names of the columns to read and their data types
+    # the versions so far only differ in columns appended at the end (e.g. the CXT matrix of 3.1.0.0), which are not read
+    # a version, which renames or drops a column used by the pipeline, needs its own projection
+    columns: dict = COLUMNS
+
+
+# registry of all supported versions, see register_parser()
+PARSERS = {}
+
+
+def register_parser(parser: MOParser):
+    """
+    This function adds a version of the MultipleOccupancy file to the registry.
+
+    Args:
+        parser (MOParser): the description of the version
+    """
+
+    PARSERS[parser.version] = parser
+
+
+register_parser(MOParser(version="2.5.0.1"))
+register_parser(
+    MOParser(version="3.1.0.0", markers=("CXT matrix RM template name", "REF"))
+)
+
+
+def normalise_column(col: str) -> str:
+    """
+    This function replaces both versions of "µ" in a column name with "u".
+
+    Args:
+        col (str): column name from the file
+
+    Returns:
+        str: the normalised column name
+    """
+
+    for sign in MICRO_SIGNS:
+        col = col.replace(sign, "u")
+
+    return col
+
+
+def sniff_format(path: str) -> tuple:
+    """
+    This function recognises the version of a MultipleOccupancy file from its header without reading the whole file.
+
+    Args:
+        path (str): path of the file
+
+    Returns:
+        tuple: the MOParser of the version, the column names of the file and the number of lines before the header
+    """
+
+    with open(path, "rb") as f:
+        head = f.read(SNIFF_BYTES).decode("utf-8-sig", errors="replace")
+    lines = head.splitlines()
+
+    # the QIAcuity Software Suite writes "sep=," into the first line for Excel
+    skiprows = 1 if lines and lines[0].startswith("sep=") else 0
+    if len(lines) <= skiprows:
+        raise ValueError("The file is empty.")
+    header = next(csv.reader([lines[skiprows]]))
+
+    # the partition counts per group of fluorescence channels are the essence of a MultipleOccupancy file
+    if not {"Group", "Count categories"} <= set(header):
+        raise ValueError("This is not a MultipleOccupancy file.")
+
+    # the version with the most matching markers is the most specific one
+    parser = max(
+        (
+            parser
+            for parser in PARSERS.values()
+            if all(marker in header for marker in parser.markers)
+        ),
+        key=lambda parser: len(parser.markers),
+    )
+
+    return parser, header, skiprows
+
+
+def read_multiple_occupancy(path: str, hyperwells: bool = False) -> tuple:
+    """
+    This function reads a MultipleOccupancy file with the parser of its version. Only the columns declared by the parser are parsed and they are directly converted into their data types.
+
+    Args:
+        path (str): path of the file
+        hyperwells (bool, optional): if true, the columns of the hyperwells are required, see HYPERWELL_COLUMNS. Defaults to False.
+
+    Returns:
+        tuple: the pandas dataframe with normalised column names and the version of the file
+    """
+
+    parser, header, skiprows = sniff_format(path)
+
+    # names in the file mapped to the normalised names of the projection
+    names = {
+        col: normalise_column(col)
+        for col in header
+        if normalise_column(col) in parser.columns
+    }
+    missing = set(parser.columns) - set(names.values())
+    # without the hyperwell mode the file does not need to contain the hyperwells
+    optional = set() if hyperwells else missing & set(HYPERWELL_COLUMNS)
+    missing -= optional
+    if missing:
+        raise ValueError(
+            f"The MultipleOccupancy file ({parser.version}) is missing the columns: {', '.join(sorted(missing))}."
+        )
+
+    df = pd.read_csv(
+        path,
+        sep=",",
+        skiprows=skiprows,
+        encoding="utf-8-sig",
+        usecols=list(names),
+        dtype={col: parser.columns[name] for col, name in names.items()},
+    ).rename(columns=names)
+    for col in optional:
+        df[col] = "-"
+
+    return df, parser.version
@@ -1,8 +1,10 @@
 # python packages
-import pandas as pd
+import copy
+
 import polars as pl
 import numpy as np
 
+from matplotlib.figure import Figure
 from plotnine import *
 
 # shiny packages
@@ -12,27 +14,63 @@ from shinyswatch.theme import minty as shiny_theme
 # own functions
 from cluster_calculation import calculate_clusters
 from couplex_calculation import calculate_couplexes
-from helpers import round_up
+from facet_cache import PanelCache, compose_when_done, frame_key, wrap_dims
+from helpers import round_up, to_columnar
+from joint_estimation import calculate_couplexes_joint, estimate_joint
+from ml_estimation import calculate_couplexes_ml
+from parsers import read_multiple_occupancy
+from plate_layout import WELL_PATTERN, WellGrid, plot_heatmap
+from plot_rendering import submit_panel
+from quality_control import QC_FLAGS, flag_quality
+from quantification import (
+    add_molar_concentration,
+    fit_standard_curves,
+    get_standard_curve_plot,
+)
+from sensitivity import sensitivity_band
+
+# lambda ranges, whose aggregates are kept per PICO object, see PICO._get_filtered_lambda_aggregates()
+# the cache only holds a few small dataframes, but dragging the slider around should not let it grow forever
+LAMBDA_AGGREGATES_CACHE_SIZE = 32
 
 
 class PICO:
 
-    def __init__(self, file_info: FileInfo):
+    def __init__(
+        self, file_info: FileInfo, hyperwells: bool = False, estimator: str = "ddpcs"
+    ):
 
         # save the file_info
         self.file_info = file_info
+        # if true, the wells of a hyperwell are combined into one reaction
+        self.hyperwells = hyperwells
+        # "ddpcs" solves the dDPCS model for each colorpair, "ml" maximises its likelihood and "joint" estimates all colorpairs of a well at once
+        self.estimator = estimator
 
         # extract the file name without the file ending
         # needed for the names of the downloads
         self.file_name = file_info["name"].rsplit(".", 1)[0]
 
-        # read the uploaded file
+        # read the uploaded file with the parser matching the version of the QIAcuity Software Suite
+        # only the columns used below are parsed and the partition counts are directly read as integers
         # this is the raw data and it is in pandas
         # TODO: to change this I will have to change cluster_calculation.py because this depends on pandas and the polars logic is different in many cases, it's gonna be a tidious task
-        self.df = pd.read_csv(self.file_info["datapath"], sep=",", skiprows=1)
+        self.df, self.file_version = read_multiple_occupancy(
+            self.file_info["datapath"], hyperwells=self.hyperwells
+        )
 
         # extract the plate format to identify the master mix volume
         self.plate_format = self.df["Plate type"][0]
+        # the plate ID identifies the plate in the study store
+        self.plate_id = str(self.df["Plate ID"][0])
+        # the plate name usually starts with the date of the run, e.g. V20231115_..., which is the run date in the study store
+        self.plate_name = str(self.df["Plate name"][0])
+        # these are the same in every row, so they do not need to be copied into all following dataframes
+        self.df = self.df.drop(columns=["Plate type", "Plate ID", "Plate name"])
+
+        # the joint estimation needs the counts of all groups, i.e. the raw data before the colorpairs are separated
+        if self.estimator == "joint":
+            self.df_joint = estimate_joint(self.df, hyperwells=self.hyperwells)
 
         # calculate the clusters of the 2 dimensional dPCR data
         self.df_clusters = self._calculate_clusters()
@@ -40,15 +78,26 @@ class PICO:
         # column renamings, add mastermix volume and lambda calculation
         self.df_clusters_formatted = self._general_formatting()
 
+        # the partitions of all wells of a hyperwell are summed up before anything is calculated from them
+        if self.hyperwells:
+            self.df_clusters_formatted = self._aggregate_hyperwells()
+
         # remove NTC and if any population contains no positive partitions
         # also remove unnecessary columns to reduce dataframe complexity/width
         self.df_filtered_prelim = self._general_filtering()
 
+        # the raw data and the intermediate steps are not needed anymore, everything else is derived from df_filtered_prelim
+        del self.df, self.df_clusters, self.df_clusters_formatted
+
         # prepares data for lambda range plot in the sidebar
-        self.df_lambda = self._format_for_lambda_hist()
+        # this dataframe is kept for the entire session, so it is stored with compact data types
+        df_lambda = self._format_for_lambda_hist()
         # extract minimal and maximal lambda values for limits in plots
-        self.min_lambda = self.df_lambda["lambda_ab"].min()
-        self.max_lambda = self.df_lambda["lambda_ab"].max()
+        # they are also the bounds of filtering() without lambda filter, so they are taken before the cast to Float32
+        # otherwise the wells with the smallest and the largest lambda would be outside the bounds of the Float64 lambdas of df_couplexes
+        self.min_lambda = df_lambda["lambda_ab"].min()
+        self.max_lambda = df_lambda["lambda_ab"].max()
+        self.df_lambda = self._compact_dtypes(df_lambda)
 
         # identifies the available groups, samples and colorparis for filtering in the ui
         self.groups = self.df_filtered_prelim["group"].unique().to_list()
@@ -58,10 +107,60 @@ class PICO:
         # calculates the number of couplexes per row
         self.df_couplexes = self._calculate_couplexes()
 
+        # flag suspicious rows once, the flags are stored bit-packed in the column qc_flags
+        self.df_couplexes = self._quality_control()
+
+        # df_couplexes is kept for the entire session and filtered over and over again
+        # thus, labels are stored as enums and counts and floats with the smallest sufficient data type
+        self.df_couplexes = self._compact_dtypes(self.df_couplexes)
+
         # by default the filtered dataframe is the same as the overall dataframe
         # then upon activation of the lambda filter or changing the slider value, the lambda filters are applied and this changes the dataframe that is plotted
         self.df_couplexes_filtered = self.df_couplexes
 
+        # the lambda range plot only needs count, sum, min and max of the lambdas per group, sample and antibody
+        # these are precomputed once, so that the plot never needs to go through the rows of df_couplexes again
+        self.df_lambda_aggregates = self._aggregate_lambda_ranges(self.df_couplexes)
+        # the lambda filter removes single rows, thus, the aggregates of the lambda filtered rows are cached per filter range
+        self.lambda_aggregates_cache = {}
+        # rendered facets of the plots, see get_couplex_panels() and get_lambda_range_panels()
+        self.panel_cache = PanelCache()
+        # the values of all wells arranged as on the plate, filtering only updates which wells are visible
+        self.well_grid = WellGrid(self.df_couplexes, self.plate_format)
+
+        # dilutions of the samples and the standard curves fitted with them, see set_dilutions()
+        self.df_dilutions = None
+        self.df_standard_curves = None
+
+    @classmethod
+    def from_snapshot(cls, frames: dict, metadata: dict) -> "PICO":
+        """
+        This function creates an object of the class PICO from the saved state of a processed object (see snapshots.py) without reading and processing the uploaded file again.
+
+        Args:
+            frames (dict): the dataframes df_couplexes, df_lambda and df_lambda_aggregates
+            metadata (dict): the remaining attributes like vol, groups, samples and antibodies
+
+        Returns:
+            PICO: the restored object
+        """
+
+        pico = cls.__new__(cls)
+        # snapshots saved before the plate name was kept have no plate_name
+        pico.plate_name = None
+        pico.__dict__.update(metadata)
+        pico.__dict__.update(frames)
+
+        # same defaults as after the initialization
+        pico.df_couplexes_filtered = pico.df_couplexes
+        pico.lambda_aggregates_cache = {}
+        pico.panel_cache = PanelCache()
+        pico.well_grid = WellGrid(pico.df_couplexes, pico.plate_format)
+        pico.df_dilutions = None
+        pico.df_standard_curves = None
+
+        return pico
+
     ###############################################
     # Private functions
     ###############################################
@@ -90,21 +189,14 @@ class PICO:
         Returns:
             pl.DataFrame: a formatted dataframe with further information based on the input
         """
-        df = self.df_clusters
-        # apparently the MO file from the QIAcuity has two different "µ":
-        # for col in df_extrac.columns:
-        # print(col, [ord(char) for char in col])
-        # replace "µ" with "u" in column names
-        # "µ" is once used as with the decimal code 956 and the other times with 181
-        new_columns = [
-            col.replace(chr(956), "u").replace(chr(181), "u") for col in df.columns
-        ]
-        df = df.rename({old: new for old, new in zip(df.columns, new_columns)}).rename(
+        # the column names were already normalised by the parser, e.g. "µ" is replaced by "u" (see parsers.py)
+        df = self.df_clusters.rename(
             {
                 "Count categories": "positives_double",
                 "Sample name": "sample_name",
                 "Reaction Mix name": "group",
                 "Well": "well",
+                "Hyperwell": "hyperwell",
                 "Valid partitions": "valid_partitions",
                 "Volume per well [uL]": "volume_per_well",
             },
@@ -131,6 +223,24 @@ class PICO:
                 pl.lit(self.vol).alias("mastermix_volume"),
                 # add dead volume
                 (pl.lit(self.vol) - pl.col("volume_per_well")).alias("dead_volume"),
+            ]
+        )
+
+        return self._add_lambdas(df)
+
+    def _add_lambdas(self, df: pl.DataFrame) -> pl.DataFrame:
+        """
+        This function calculates the lambdas of both antibodies from the partition counts.
+
+        Args:
+            df (pl.DataFrame): a dataframe with valid_partitions, positives_ab1, positives_ab2 and positives_double
+
+        Returns:
+            pl.DataFrame: df with the columns lambda_ab1 and lambda_ab2
+        """
+
+        return df.with_columns(
+            [
                 # add lambda of antibody 1
                 (
                     pl.col("valid_partitions").log()
@@ -152,7 +262,60 @@ class PICO:
             ]
         )
 
-        return df
+    def _aggregate_hyperwells(self) -> pl.DataFrame:
+        """
+        This function combines the wells of each hyperwell into one reaction. The partition counts and volumes of all wells of a hyperwell are summed up in one group_by, so that the dDPCS model is solved once per hyperwell with all its partitions. Wells that are not part of a hyperwell ("-" in the column Hyperwell) are kept as they are.
+
+        Returns:
+            pl.DataFrame: df_clusters_formatted with one row per hyperwell and colorpair, the name of the hyperwell is used as well
+        """
+
+        df = self.df_clusters_formatted
+        in_hyperwell = pl.col("hyperwell").is_not_null() & (pl.col("hyperwell") != "-")
+
+        df_hyperwells = (
+            df.filter(in_hyperwell)
+            .group_by(
+                [
+                    "hyperwell",
+                    "group",
+                    "sample_name",
+                    "colorpair",
+                    "antibodies",
+                    "antibody1",
+                    "antibody2",
+                ],
+                maintain_order=True,
+            )
+            .agg(
+                pl.col(
+                    [
+                        "valid_partitions",
+                        "positives_ab1",
+                        "positives_ab2",
+                        "positives_double",
+                        "volume_per_well",
+                    ]
+                ).sum(),
+                # without a known plate format there is no master mix volume to sum up (see _general_formatting)
+                (
+                    pl.col("mastermix_volume").sum()
+                    if self.vol
+                    else pl.col("mastermix_volume").first()
+                ),
+            )
+            .with_columns(
+                pl.col("hyperwell").alias("well"),
+                (pl.col("mastermix_volume") - pl.col("volume_per_well")).alias(
+                    "dead_volume"
+                ),
+            )
+        )
+
+        return pl.concat(
+            [df.filter(~in_hyperwell), self._add_lambdas(df_hyperwells)],
+            how="diagonal_relaxed",
+        )
 
     def _general_filtering(self) -> pl.DataFrame:
         """
@@ -218,13 +381,143 @@ class PICO:
         Returns:
             pl.DataFrame: a dataframe with the couplexes calculated for all rows of the dataframe
         """
+        if self.estimator == "joint":
+            return calculate_couplexes_joint(self.df_filtered_prelim, self.df_joint)
+        if self.estimator == "ml":
+            return calculate_couplexes_ml(self.df_filtered_prelim)
         return calculate_couplexes(self.df_filtered_prelim)
 
+    def _aggregate_lambda_ranges(self, df: pl.DataFrame) -> pl.DataFrame:
+        """
+        This function calculates count, sum, min and max of the lambdas for each group, sample and antibody. These aggregates can be combined for any selection of the checkboxes without going through the rows again.
+
+        Args:
+            df (pl.DataFrame): df_couplexes or a lambda filtered version of it
+
+        Returns:
+            pl.DataFrame: a dataframe with one row per group, sample, colorpair, antibody pair and antibody
+        """
+
+        # extract the information of the first and the second antibody
+        df_abs = [
+            df.select(
+                [
+                    "group",
+                    "sample_name",
+                    "colorpair",
+                    "antibodies",
+                    pl.col(f"lambda_ab{i}").alias("lambda_ab"),
+                    pl.col(f"antibody{i}").alias("antibody"),
+                ]
+            )
+            for i in (1, 2)
+        ]
+
+        return (
+            # combine the dataframes of the first and the second antibody
+            pl.concat(df_abs)
+            # calculation of count, sum, min and max for the experimental groups
+            .group_by(
+                ["group", "sample_name", "colorpair", "antibodies", "antibody"],
+                maintain_order=True,
+            ).agg(
+                count=pl.col("lambda_ab").count(),
+                sum=pl.col("lambda_ab").sum(),
+                min=pl.col("lambda_ab").min(),
+                max=pl.col("lambda_ab").max(),
+            )
+        )
+
+    def _quality_control(self) -> pl.DataFrame:
+        """
+        After the calculation of the couplexes, each row is checked for lambdas out of the suggested range, low numbers of valid partitions, unusual dead volumes, outliers within the replicates and a poor fit of the dDPCS model.
+
+        Returns:
+            pl.DataFrame: a dataframe with the additional column qc_flags (see quality_control.py)
+        """
+        return flag_quality(self.df_couplexes)
+
+    def _compact_dtypes(self, df: pl.DataFrame) -> pl.DataFrame:
+        """
+        This function casts the columns of a dataframe to memory-compact data types. Labels become enums, so that each label is stored once and filtering with is_in compares integers, counts become UInt32 and the lambdas of the histogram become Float32. The values of df_couplexes keep Float64, because they are exported. The categories of the enums are sorted, so that plots keep the alphabetical order.
+
+        Args:
+            df (pl.DataFrame): df_couplexes or df_lambda
+
+        Returns:
+            pl.DataFrame: the same dataframe with compact data types
+        """
+
+        def enum(*cols):
+            # one enum for several columns if the columns shall be comparable or combined, e.g. antibody1 and antibody2
+            values = pl.concat([df[col].drop_nulls() for col in cols]).unique()
+            return pl.Enum(sorted(values.to_list()))
+
+        dtypes = {}
+        for col in ["group", "sample_name", "well", "colorpair", "antibodies", "antibody"]:
+            if col in df.columns:
+                dtypes[col] = enum(col)
+        if "antibody1" in df.columns:
+            dtypes["antibody1"] = dtypes["antibody2"] = enum("antibody1", "antibody2")
+        # partition counts never exceed the number of partitions of a well
+        for col in [
+            "valid_partitions",
+            "positives_ab1",
+            "positives_ab2",
+            "positives_double",
+            "couplex_positives",
+            "random_positives",
+            "rcoverlap_positives",
+            "couplexes",
+        ]:
+            if col in df.columns:
+                dtypes[col] = pl.UInt32
+        # the precision of Float32 is far beyond the precision of the histogram
+        # volumes, lambdas and standard errors of df_couplexes are downloaded, with Float32 the exported values would change
+        if "lambda_ab" in df.columns and df.schema["lambda_ab"].is_float():
+            dtypes["lambda_ab"] = pl.Float32
+
+        return df.cast(dtypes)
+
+    def _remap_labels(self, df: pl.DataFrame, df_metadata: pl.DataFrame) -> pl.DataFrame:
+        """
+        This function replaces the reaction mixes and sample names of a dataframe by the ones from the metadata. The new labels are joined by well, wells missing in the metadata keep their labels. All other columns stay untouched.
+
+        Args:
+            df (pl.DataFrame): df_couplexes or df_lambda
+            df_metadata (pl.DataFrame): well, group and sample_name as strings
+
+        Returns:
+            pl.DataFrame: df with the new labels as enums
+        """
+
+        df = (
+            df.with_columns(pl.col("well").cast(pl.String).alias("_well"))
+            .join(
+                df_metadata.rename(
+                    {"well": "_well", "group": "_group", "sample_name": "_sample_name"}
+                ),
+                on="_well",
+                how="left",
+                maintain_order="left",
+            )
+            .with_columns(
+                pl.coalesce("_group", pl.col("group").cast(pl.String)).alias("group"),
+                pl.coalesce(
+                    "_sample_name", pl.col("sample_name").cast(pl.String)
+                ).alias("sample_name"),
+            )
+            .drop(["_well", "_group", "_sample_name"])
+        )
+
+        # the enums of the old labels do not contain the new labels
+        return self._compact_dtypes(df)
+
     def _format_for_lambda_range(
         self, lambda_filter: bool, groups: tuple, samples: tuple, antibodies: tuple
     ) -> tuple:
         """
-        This function prepares the data for the lambda ranges of all experimental groups with minimal, maximal and mean values. The plot and the data formatting is inspired by https://plotnine.org/reference/geom_segment.html#an-elaborate-range-plot.
+        This function prepares the data for the lambda ranges of all experimental groups with minimal, maximal and mean values. The plot and the data formatting is inspired by https://plotnine.org/reference/geom_segment.html#an-elaborate-range-plot. The statistics are taken from the precomputed aggregates and not from the rows of df_couplexes.
 
         Args:
             lambda_filter (bool): true if the box apply lambda filter is ticked
@@ -233,59 +526,23 @@ class PICO:
             antibodies (tuple): antibody pairs to be included in the plot
 
         Returns:
-            tuple: a dataframe (df_segments) for geom_segment containing the ranges of the lambdas and a second dataframe (df_points) for geom_point containing the min, max and mean values of each lamda range
+            tuple: a dataframe (df_segments) for geom_segment containing the ranges of the lambdas and a dictionary (points) with a dataframe for geom_point containing the min, max and mean values of each lamda range per statistic
         """
 
-        # if lambda_filter is false (box not ticked), the raw dataframe with the couplexes from all rows is display, however, if the filter is applied, the dataframe used for plotting is the filtered one
-        # similarly, if groups, samples or antibodies were filtered, the filtered dataframe is used
-        df = self.df_couplexes
+        # if lambda_filter is false (box not ticked), the aggregates from all rows are displayed, however, if the filter is applied, the aggregates of the filtered rows are used
+        # similarly, if groups, samples or antibodies were filtered, only the selected aggregates are used
+        df = self.df_lambda_aggregates
         if (
             lambda_filter
-            or len(groups) != len(self.df_couplexes["group"].unique().to_list())
-            or len(samples) != len(self.df_couplexes["sample_name"].unique().to_list())
-            or len(antibodies)
-            != len(self.df_couplexes["antibodies"].unique().to_list())
-        ):
-            df = self.df_couplexes_filtered
-
-        # extract the information of the first antibody
-        df_ab1 = df.select(
-            [
-                "group",
-                "sample_name",
-                "well",
-                "colorpair",
-                "antibodies",
-                pl.col("lambda_ab1").alias("lambda_ab"),
-                pl.col("antibody1").alias("antibody"),
-            ]
-        )
-
-        # extract the information of the second antibody
-        df_ab2 = df.select(
-            [
-                "group",
-                "sample_name",
-                "well",
-                "colorpair",
-                "antibodies",
-                pl.col("lambda_ab2").alias("lambda_ab"),
-                pl.col("antibody2").alias("antibody"),
-            ]
-        )
+            or len(groups) != len(self.groups)
+            or len(samples) != len(self.samples)
+            or len(antibodies) != len(self.antibodies)
+        ) and self.df_couplexes_filtered is not self.df_couplexes:
+            df = self._get_filtered_lambda_aggregates()
 
-        df_segments = (
-            # combine the dataframes of the first and the second antibody
-            pl.concat([df_ab1, df_ab2])
-            # calculation of min, max and mean for the experimental groups
-            .group_by(
-                ["group", "sample_name", "colorpair", "antibodies", "antibody"]
-            ).agg(
-                min=pl.col("lambda_ab").min(),
-                max=pl.col("lambda_ab").max(),
-                mean=pl.col("lambda_ab").mean(),
-            )
-        )
+        df_segments = df.with_columns(
+            mean=pl.col("sum") / pl.col("count"),
+        ).drop(["count", "sum"])
 
         # gather min, max and mean in one column for plotting the points
         df_points = (
@@ -306,134 +563,54 @@ class PICO:
             .with_columns(pl.col("lambda").round(2).cast(pl.String).alias("lambda_str"))
         )
 
+        # split the points by statistic once instead of filtering them for every label
+        points = df_points.partition_by("stat", as_dict=True, include_key=True)
+        points = {key[0]: df for key, df in points.items()}
+        points["all"] = df_points
+
         # get the minimal and maximal values of the current dataframe
         max_lambda = df_segments["max"].max()
         min_lambda = df_segments["min"].min()
 
-        return df_segments, df_points, max_lambda, min_lambda
+        return df_segments, points, max_lambda, min_lambda
 
-    ###############################################
-    # Public functions
-    ###############################################
-
-    def filtering(
-        self,
-        lambda_filter: bool,
-        filter_values_lambda: tuple,
-        groups: tuple,
-        samples: tuple,
-        antibodies: tuple,
-    ):
+    def _get_filtered_lambda_aggregates(self) -> pl.DataFrame:
         """
-        This functions filters for the lambda values defined by the slider in the ui and for the ticked boxes in the checkboxes of group, sample and antibodies. This function updates self.df_couplexes_filtered.
+        This function returns the lambda aggregates matching self.df_couplexes_filtered. The aggregates of the lambda filtered rows are computed once per filter range and then the selection of the checkboxes is applied to the aggregates.
 
-        Args:
-            lambda_filter (bool): true if the box apply lambda filter is ticked
-            filter_values_lambda (tuple): min and max value for filtering from the slider
-            groups (tuple): groups (reaction mixes from QIAcuity Software Suite) to be included in the plot
-            samples (tuple): samples to be included in the plot
-            antibodies (tuple): antibody pairs to be included in the plot
+        Returns:
+            pl.DataFrame: the aggregates of the currently filtered data
         """
 
-        # if lambda filtering is not applied minimal and maximal values from the dataframe itself are used (fake fitlering)
-        min_lambda_set = self.min_lambda
-        max_lambda_set = self.max_lambda
+        min_lambda_set, max_lambda_set = self.filter_values_lambda
+        key = (min_lambda_set, max_lambda_set)
+
+        if key not in self.lambda_aggregates_cache:
+            # the cache is cleared once it is full, see LAMBDA_AGGREGATES_CACHE_SIZE
+            if len(self.lambda_aggregates_cache) >= LAMBDA_AGGREGATES_CACHE_SIZE:
+                self.lambda_aggregates_cache.clear()
+            self.lambda_aggregates_cache[key] = self._aggregate_lambda_ranges(
+                self.df_couplexes.filter(
+                    pl.col("lambda_ab1") >= min_lambda_set,
+                    pl.col("lambda_ab1") <= max_lambda_set,
+                    pl.col("lambda_ab2") >= min_lambda_set,
+                    pl.col("lambda_ab2") <= max_lambda_set,
+                )
+            )
 
-        # however, when a lambda filter is applied, the filter values from the slider are used
-        if lambda_filter:
-            # get the minimal and maximal lambda values for filtering from the slider
-            min_lambda_set, max_lambda_set = filter_values_lambda
+        groups, samples, antibodies = self.filter_selection
 
-        self.df_couplexes_filtered = self.df_couplexes.filter(
-            pl.col("lambda_ab1") >= min_lambda_set,
-            pl.col("lambda_ab1") <= max_lambda_set,
-            pl.col("lambda_ab2") >= min_lambda_set,
-            pl.col("lambda_ab2") <= max_lambda_set,
-            # this following filter check if the values in columns are in the lists that come from the checkboxes
+        return self.lambda_aggregates_cache[key].filter(
             pl.col("group").is_in(groups),
             pl.col("sample_name").is_in(samples),
             pl.col("antibodies").is_in(antibodies),
         )
 
-        # calculate the number of filtered values
-        rows_before = str(self.df_couplexes.select(pl.len()).to_numpy().item())
-        rows_after = str(self.df_couplexes_filtered.select(pl.len()).to_numpy().item())
-
-        # save the message to display as a property of the class
-        self.filter_msg = f"Current plot displays <span style='color: {shiny_theme.colors.primary};'>{rows_after}</span> of <span style='color: {shiny_theme.colors.primary};'>{rows_before}</span> total data points."
-
-    def get_lambda_hist(
-        self, lambda_filter: bool = False, filter_values_lambda: tuple = None
-    ) -> ggplot:
-        """
-        This function plots the entire lambda range of the uploaded data and depending on the chosen lambda values, it colors the bins of the histogram based filter values from the slider.
-
-        Args:
-            lambda_filter (bool, optional): If false, no filtering applied. Defaults to False.
-            filter_values_lambda (tuple, optional): Minimal and maximal value for filtering, obtained from the input.slider_lambda() of the ui. Defaults to None.
-
-        Returns:
-            ggplot: A histogram of the lambda range with colored bins depending on input.slider_lambda().
-        """
-
-        if lambda_filter and filter_values_lambda:
-            # unpack the filter values
-            min_val, max_val = filter_values_lambda
-            # create a new column, which identifies the the color of the bin
-            df = self.df_lambda.with_columns(
-                pl.when(pl.col("lambda_ab") < min_val)
-                .then(pl.lit("below"))
-                .when(pl.col("lambda_ab") > max_val)
-                .then(pl.lit("above"))
-                .otherwise(pl.lit("within"))
-                .alias("color_class")
-            )
-
-            # use the theme colors for the bin colors
-            bin_colors = {
-                "below": shiny_theme.colors.secondary,
-                "within": shiny_theme.colors.primary,
-                "above": shiny_theme.colors.secondary,
-            }
-
-        # if no filtering, all bins have the same color
-        else:
-            df = self.df_lambda.with_columns(pl.lit("within").alias("color_class"))
-            bin_colors = {"within": shiny_theme.colors.secondary}
-
-        p = (
-            ggplot(df, aes(x="lambda_ab", fill="color_class", color="color_class"))
-            + geom_histogram(binwidth=0.01, show_legend=False)
-            # same maximal x values as the slider, obtained form the data and rounded up
-            # min value below zero because middle of first bin is 0
-            + scale_x_continuous(limits=[-0.01, round_up(self.max_lambda, 1)])
-            + scale_fill_manual(values=bin_colors)
-            + scale_color_manual(values=bin_colors)
-            # create some space to display the x axis ticks correctly on shinyapps.io
-            + labs(x=" ")
-            + theme(
-                # remove all labels, lines and text from the histogram to have a plain plot
-                axis_title_y=element_blank(),
-                axis_text_y=element_blank(),
-                axis_ticks=element_blank(),
-                panel_background=element_blank(),
-                # color of all the text
-                text=element_text(color=shiny_theme.colors.dark),
-            )
-        )
-
-        return p
-
-    def get_couplex_plot(
-        self,
-        lambda_filter: bool,
-        groups: tuple,
-        samples: tuple,
-        antibodies: tuple,
-        plot_type: tuple,
-    ) -> ggplot:
+    def _couplex_plot_data(
+        self, lambda_filter: bool, groups: tuple, samples: tuple, antibodies: tuple
+    ) -> pl.DataFrame:
         """
-        This function plots the number of couplexes of the filtered dataframe, which is saved in self.df_filtered.
+        This function returns the dataframe displayed in the plot of the couplexes.
 
         Args:
             lambda_filter (bool): true if the box apply lambda filter is ticked
@@ -442,7 +619,7 @@ class PICO:
             antibodies (tuple): antibody pairs to be included in the plot
 
         Returns:
-            ggplot: violin plot with the number of couplexes
+            pl.DataFrame: df_couplexes or df_couplexes_filtered
         """
 
         # if lambda_filter is false (box not ticked), the raw dataframe with the couplexes from all rows is display, however, if the filter is applied, the dataframe used for plotting is the filtered one
@@ -457,125 +634,115 @@ class PICO:
         ):
             df = self.df_couplexes_filtered
 
-        if df.is_empty():
-            # if the filtering results in an empty dataframe, a message is displayed
-            p = (
-                ggplot()
-                + annotate(
-                    "text",
-                    x=0.5,
-                    y=0.6,
-                    label="The current selection returns an empty dataframe.\nNothing to display :-(",
-                    ha="center",
-                    va="center",
-                    size=16,
-                    color=shiny_theme.colors.dark,
-                )
-                + theme_void()
+        return df
+
+    def _couplex_plot(
+        self, df: pl.DataFrame, plot_type: tuple, sensitivity: float
+    ) -> ggplot:
+        """
+        This function builds the plot of the couplexes of a non-empty dataframe with one facet per antibody pair (see get_couplex_plot()).
+
+        Args:
+            df (pl.DataFrame): the rows to plot
+            plot_type (tuple): "Boxplot" and/or "Violinplot"
+            sensitivity (float): relative deviation of the volumes for the sensitivity band, 0 for no band
+
+        Returns:
+            ggplot: the plot of the couplexes
+        """
+
+        p = ggplot(df, aes("sample_name", "couplexes"))
+
+        # the band is drawn first to stay behind the points
+        if sensitivity > 0:
+            p += geom_crossbar(
+                sensitivity_band(df, sensitivity),
+                aes(
+                    "sample_name",
+                    y="couplexes_median",
+                    ymin="couplexes_low",
+                    ymax="couplexes_high",
+                ),
+                width=0.6,
+                fill=shiny_theme.colors.secondary,
+                color=shiny_theme.colors.secondary,
+                alpha=0.3,
             )
-        else:
+
+        p = (
+            p
+            # fix random_state to have the same jitter before and after filtering
+            + geom_point(
+                # shift the points a bit to the right
+                # aes(x=stage("sample_name", after_scale="x+0.15")),
+                position=position_jitter(width=0.2, random_state=123),
+                size=3,
+                color=shiny_theme.colors.primary,
+                alpha=0.5,
+            )
+            + labs(
+                x="Sample",
+                y=f"Number of couplexes in {self.vol} ul",
+            )
+            + facet_wrap("antibodies")
+            + theme(
+                # remove background from facets
+                panel_background=element_blank(),
+                # remove x ticks
+                axis_ticks_major_x=element_blank(),
+                # adjust color of y ticks
+                axis_ticks_major_y=element_line(color=shiny_theme.colors.dark),
+                # background color of facet labels
+                strip_background=element_rect(fill=shiny_theme.colors.secondary),
+                # color of all the text
+                text=element_text(color=shiny_theme.colors.dark),
+                # text on the secondary color shall be white just as in the shiny theme
+                strip_text=element_text(color=shiny_theme.colors.light),
+            )
+        )
+
+        # allow to switch between plot types
+        if len(plot_type) == 2:
             p = (
-                ggplot(df, aes("sample_name", "couplexes"))
-                # fix random_state to have the same jitter before and after filtering
-                + geom_point(
-                    # shift the points a bit to the right
-                    # aes(x=stage("sample_name", after_scale="x+0.15")),
-                    position=position_jitter(width=0.2, random_state=123),
-                    size=3,
-                    color=shiny_theme.colors.primary,
-                    alpha=0.5,
-                )
-                + labs(
-                    x="Sample",
-                    y=f"Number of couplexes in {self.vol} ul",
-                )
-                + facet_wrap("antibodies")
-                + theme(
-                    # remove background from facets
-                    panel_background=element_blank(),
-                    # remove x ticks
-                    axis_ticks_major_x=element_blank(),
-                    # adjust color of y ticks
-                    axis_ticks_major_y=element_line(color=shiny_theme.colors.dark),
-                    # background color of facet labels
-                    strip_background=element_rect(fill=shiny_theme.colors.secondary),
-                    # color of all the text
-                    text=element_text(color=shiny_theme.colors.dark),
-                    # text on the secondary color shall be white just as in the shiny theme
-                    strip_text=element_text(color=shiny_theme.colors.light),
-                )
+                p
+                + geom_violin(scale="width", color=shiny_theme.colors.dark, alpha=0)
+                + geom_boxplot(width=0.3, outlier_shape="", alpha=0)
             )
 
-            # allow to switch between plot types
-            if len(plot_type) == 2:
-                p = (
-                    p
-                    + geom_violin(scale="width", color=shiny_theme.colors.dark, alpha=0)
-                    + geom_boxplot(width=0.3, outlier_shape="", alpha=0)
+        if len(plot_type) == 1:
+            if plot_type[0] == "Boxplot":
+                p += geom_boxplot(width=0.3, outlier_shape="", alpha=0)
+            if plot_type[0] == "Violinplot":
+                p += geom_violin(
+                    scale="width", color=shiny_theme.colors.dark, alpha=0
                 )
 
-            if len(plot_type) == 1:
-                if plot_type[0] == "Boxplot":
-                    p += geom_boxplot(width=0.3, outlier_shape="", alpha=0)
-                if plot_type[0] == "Violinplot":
-                    p += geom_violin(
-                        scale="width", color=shiny_theme.colors.dark, alpha=0
-                    )
-
         return p
 
-    def get_lambda_ranges(
+    def _lambda_range_plot(
         self,
-        lambda_filter: bool,
-        groups: tuple,
-        samples: tuple,
-        antibodies: tuple,
-        additional_space=0.05,
-        num_x_ticks=4,
+        df_segments: pl.DataFrame,
+        points: dict,
+        min_lambda: float,
+        max_lambda: float,
+        additional_space: float,
+        num_x_ticks: int,
     ) -> ggplot:
         """
-        This functions plots the lambda ranges of each experimental group, sample and antibody. Because some PICO experiments have an inherent redundancy as one antibody may be used in multiple antibody combinations, this plot will contain redundant information, too, i.e. some lambda ranges are plotted twice. However, the combination of two antibodies is unique. First, the function calls another function to format the data and then plots the lambda ranges using plotnine.
+        This function builds the range plot of the lambdas from the formatted data with one facet per group, sample and antibody pair (see get_lambda_ranges()).
 
         Args:
-            lambda_filter (bool): true if the box apply lambda filter is ticked
-            groups (tuple): groups (reaction mixes from QIAcuity Software Suite) to be included in the plot
-            samples (tuple): samples to be included in the plot
-            antibodies (tuple): antibody pairs to be included in the plot
-            additional_space (float, optional): additional space from min and max lambda to limit of x-axis. Defaults to 0.05.
-            num_x_ticks (int, optional): number of vertical lines in the ranges. Defaults to 4.
+            df_segments (pl.DataFrame): ranges of the lambdas, see _format_for_lambda_range()
+            points (dict): min, max and mean of the lambdas, see _format_for_lambda_range()
+            min_lambda (float): lower end of the x-axis without the additional space
+            max_lambda (float): upper end of the x-axis without the additional space
+            additional_space (float): additional space from min and max lambda to limit of x-axis
+            num_x_ticks (int): number of vertical lines in the ranges
 
         Returns:
-            ggplot: a range plot of the lambda values of the couplex plot according to the filters
+            ggplot: the range plot of the lambdas
         """
 
-        # return warning when dataframes are empty because of filtering
-        if self.df_couplexes.is_empty() or self.df_couplexes_filtered.is_empty():
-
-            p = (
-                ggplot()
-                + annotate(
-                    "text",
-                    x=0.5,
-                    y=0.6,
-                    label="The current selection returns an empty dataframe.\nNothing to display :-(",
-                    ha="center",
-                    va="center",
-                    size=16,
-                    color=shiny_theme.colors.dark,
-                )
-                + theme_void()
-            )
-
-            return p
-
-        # prepare the data
-        df_segments, df_points, max_lambda, min_lambda = self._format_for_lambda_range(
-            lambda_filter=lambda_filter,
-            groups=groups,
-            samples=samples,
-            antibodies=antibodies,
-        )
-
         # generate list for vertial lines used by geom_vline and labels from 0 to max_lambda
         tickx = list(
             np.round(
@@ -613,7 +780,7 @@ class PICO:
             )
             # mean, min and max points
             + geom_point(
-                df_points,
+                points["all"],
                 aes("lambda", "antibody", color="stat", fill="stat"),
                 size=5,
                 stroke=0.7,
@@ -621,13 +788,13 @@ class PICO:
             )
             # labels for mean, min and max points
             + geom_text(
-                df_points.filter(pl.col("stat") == "mean"),
+                points["mean"],
                 aes(x="lambda", y="antibody", label="lambda_str"),
                 color=shiny_theme.colors.light,
                 size=8,
             )
             + geom_text(
-                df_points.filter(pl.col("stat") == "min"),
+                points["min"],
                 aes(x="lambda", y="antibody", label="lambda_str"),
                 color=shiny_theme.colors.dark,
                 size=8,
@@ -635,7 +802,7 @@ class PICO:
                 nudge_x=-0.04,
             )
             + geom_text(
-                df_points.filter(pl.col("stat") == "max"),
+                points["max"],
                 aes(x="lambda", y="antibody", label="lambda_str"),
                 color=shiny_theme.colors.dark,
                 size=8,
@@ -681,6 +848,574 @@ class PICO:
 
         return p
 
+    ###############################################
+    # Public functions
+    ###############################################
+
+    def filtering(
+        self,
+        lambda_filter: bool,
+        filter_values_lambda: tuple,
+        groups: tuple,
+        samples: tuple,
+        antibodies: tuple,
+    ):
+        """
+        This functions filters for the lambda values defined by the slider in the ui and for the ticked boxes in the checkboxes of group, sample and antibodies. This function updates self.df_couplexes_filtered.
+
+        Args:
+            lambda_filter (bool): true if the box apply lambda filter is ticked
+            filter_values_lambda (tuple): min and max value for filtering from the slider
+            groups (tuple): groups (reaction mixes from QIAcuity Software Suite) to be included in the plot
+            samples (tuple): samples to be included in the plot
+            antibodies (tuple): antibody pairs to be included in the plot
+        """
+
+        # if lambda filtering is not applied minimal and maximal values from the dataframe itself are used (fake fitlering)
+        min_lambda_set = self.min_lambda
+        max_lambda_set = self.max_lambda
+
+        # however, when a lambda filter is applied, the filter values from the slider are used
+        if lambda_filter:
+            # get the minimal and maximal lambda values for filtering from the slider
+            min_lambda_set, max_lambda_set = filter_values_lambda
+
+        # remember the applied filters, they are needed to pick the matching lambda aggregates
+        self.filter_values_lambda = (min_lambda_set, max_lambda_set)
+        self.filter_selection = (groups, samples, antibodies)
+
+        self.df_couplexes_filtered = self.df_couplexes.filter(
+            pl.col("lambda_ab1") >= min_lambda_set,
+            pl.col("lambda_ab1") <= max_lambda_set,
+            pl.col("lambda_ab2") >= min_lambda_set,
+            pl.col("lambda_ab2") <= max_lambda_set,
+            # this following filter check if the values in columns are in the lists that come from the checkboxes
+            pl.col("group").is_in(groups),
+            pl.col("sample_name").is_in(samples),
+            pl.col("antibodies").is_in(antibodies),
+        )
+
+        # calculate the number of filtered values
+        rows_before = str(self.df_couplexes.select(pl.len()).to_numpy().item())
+        rows_after = str(self.df_couplexes_filtered.select(pl.len()).to_numpy().item())
+        # and how many of them were flagged by the quality control
+        rows_flagged = str(
+            self.df_couplexes_filtered.select((pl.col("qc_flags") != 0).sum()).item()
+        )
+
+        # save the message to display as a property of the class
+        self.filter_msg = f"Current plot displays <span style='color: {shiny_theme.colors.primary};'>{rows_after}</span> of <span style='color: {shiny_theme.colors.primary};'>{rows_before}</span> total data points, <span style='color: {shiny_theme.colors.secondary};'>{rows_flagged}</span> of them are flagged by the quality control."
+
+    def get_lambda_hist(
+        self, lambda_filter: bool = False, filter_values_lambda: tuple = None
+    ) -> ggplot:
+        """
+        This function plots the entire lambda range of the uploaded data and depending on the chosen lambda values, it colors the bins of the histogram based filter values from the slider.
+
+        Args:
+            lambda_filter (bool, optional): If false, no filtering applied. Defaults to False.
+            filter_values_lambda (tuple, optional): Minimal and maximal value for filtering, obtained from the input.slider_lambda() of the ui. Defaults to None.
+
+        Returns:
+            ggplot: A histogram of the lambda range with colored bins depending on input.slider_lambda().
+        """
+
+        if lambda_filter and filter_values_lambda:
+            # unpack the filter values
+            min_val, max_val = filter_values_lambda
+            # create a new column, which identifies the the color of the bin
+            df = self.df_lambda.with_columns(
+                pl.when(pl.col("lambda_ab") < min_val)
+                .then(pl.lit("below"))
+                .when(pl.col("lambda_ab") > max_val)
+                .then(pl.lit("above"))
+                .otherwise(pl.lit("within"))
+                .alias("color_class")
+            )
+
+            # use the theme colors for the bin colors
+            bin_colors = {
+                "below": shiny_theme.colors.secondary,
+                "within": shiny_theme.colors.primary,
+                "above": shiny_theme.colors.secondary,
+            }
+
+        # if no filtering, all bins have the same color
+        else:
+            df = self.df_lambda.with_columns(pl.lit("within").alias("color_class"))
+            bin_colors = {"within": shiny_theme.colors.secondary}
+
+        p = (
+            ggplot(df, aes(x="lambda_ab", fill="color_class", color="color_class"))
+            + geom_histogram(binwidth=0.01, show_legend=False)
+            # same maximal x values as the slider, obtained form the data and rounded up
+            # min value below zero because middle of first bin is 0
+            + scale_x_continuous(limits=[-0.01, round_up(self.max_lambda, 1)])
+            + scale_fill_manual(values=bin_colors)
+            + scale_color_manual(values=bin_colors)
+            # create some space to display the x axis ticks correctly on shinyapps.io
+            + labs(x=" ")
+            + theme(
+                # remove all labels, lines and text from the histogram to have a plain plot
+                axis_title_y=element_blank(),
+                axis_text_y=element_blank(),
+                axis_ticks=element_blank(),
+                panel_background=element_blank(),
+                # color of all the text
+                text=element_text(color=shiny_theme.colors.dark),
+            )
+        )
+
+        return p
+
+    def get_couplex_plot(
+        self,
+        lambda_filter: bool,
+        groups: tuple,
+        samples: tuple,
+        antibodies: tuple,
+        plot_type: tuple,
+        sensitivity: float = 0,
+    ) -> ggplot:
+        """
+        This function plots the number of couplexes of the filtered dataframe, which is saved in self.df_filtered.
+
+        Args:
+            lambda_filter (bool): true if the box apply lambda filter is ticked
+            groups (tuple): groups (reaction mixes from QIAcuity Software Suite) to be included in the plot
+            samples (tuple): samples to be included in the plot
+            antibodies (tuple): antibody pairs to be included in the plot
+            sensitivity (float, optional): if above 0, a band shows the range of the median number of couplexes, if the master mix volume and the volume per well deviate by up to this fraction (see sensitivity.py). Defaults to 0.
+
+        Returns:
+            ggplot: violin plot with the number of couplexes
+        """
+
+        df = self._couplex_plot_data(lambda_filter, groups, samples, antibodies)
+
+        if df.is_empty():
+            # if the filtering results in an empty dataframe, a message is displayed
+            p = (
+                ggplot()
+                + annotate(
+                    "text",
+                    x=0.5,
+                    y=0.6,
+                    label="The current selection returns an empty dataframe.\nNothing to display :-(",
+                    ha="center",
+                    va="center",
+                    size=16,
+                    color=shiny_theme.colors.dark,
+                )
+                + theme_void()
+            )
+        else:
+            p = self._couplex_plot(df, plot_type, sensitivity)
+
+        return p
+
+    def get_lambda_ranges(
+        self,
+        lambda_filter: bool,
+        groups: tuple,
+        samples: tuple,
+        antibodies: tuple,
+        additional_space=0.05,
+        num_x_ticks=4,
+    ) -> ggplot:
+        """
+        This functions plots the lambda ranges of each experimental group, sample and antibody. Because some PICO experiments have an inherent redundancy as one antibody may be used in multiple antibody combinations, this plot will contain redundant information, too, i.e. some lambda ranges are plotted twice. However, the combination of two antibodies is unique. First, the function calls another function to format the data and then plots the lambda ranges using plotnine.
+
+        Args:
+            lambda_filter (bool): true if the box apply lambda filter is ticked
+            groups (tuple): groups (reaction mixes from QIAcuity Software Suite) to be included in the plot
+            samples (tuple): samples to be included in the plot
+            antibodies (tuple): antibody pairs to be included in the plot
+            additional_space (float, optional): additional space from min and max lambda to limit of x-axis. Defaults to 0.05.
+            num_x_ticks (int, optional): number of vertical lines in the ranges. Defaults to 4.
+
+        Returns:
+            ggplot: a range plot of the lambda values of the couplex plot according to the filters
+        """
+
+        # return warning when dataframes are empty because of filtering
+        if self.df_couplexes.is_empty() or self.df_couplexes_filtered.is_empty():
+
+            p = (
+                ggplot()
+                + annotate(
+                    "text",
+                    x=0.5,
+                    y=0.6,
+                    label="The current selection returns an empty dataframe.\nNothing to display :-(",
+                    ha="center",
+                    va="center",
+                    size=16,
+                    color=shiny_theme.colors.dark,
+                )
+                + theme_void()
+            )
+
+            return p
+
+        # prepare the data
+        df_segments, points, max_lambda, min_lambda = self._format_for_lambda_range(
+            lambda_filter=lambda_filter,
+            groups=groups,
+            samples=samples,
+            antibodies=antibodies,
+        )
+
+        p = self._lambda_range_plot(
+            df_segments, points, min_lambda, max_lambda, additional_space, num_x_ticks
+        )
+
+        return p
+
+    def get_couplex_panels(
+        self,
+        lambda_filter: bool,
+        groups: tuple,
+        samples: tuple,
+        antibodies: tuple,
+        plot_type: tuple,
+        sensitivity: float = 0,
+        width: float = 960,
+        height: float = 600,
+        dpi: int = 96,
+    ):
+        """
+        This function draws the same plot as get_couplex_plot(), but each facet is rendered on its own and cached in self.panel_cache. The y-axis is shared by all antibody pairs of the plate instead of only the displayed ones, so that the panels do not change if antibodies are unticked. Only panels with changed data are rendered again, all of them at the same time in the pool of plot_rendering.py. The visible panels are composed into one image, once they are rendered.
+
+        Args:
+            lambda_filter (bool): true if the box apply lambda filter is ticked
+            groups (tuple): groups (reaction mixes from QIAcuity Software Suite) to be included in the plot
+            samples (tuple): samples to be included in the plot
+            antibodies (tuple): antibody pairs to be included in the plot
+            plot_type (tuple): "Boxplot" and/or "Violinplot"
+            sensitivity (float, optional): see get_couplex_plot(). Defaults to 0.
+            width (float, optional): width of the whole image in pixels. Defaults to 960.
+            height (float, optional): height of the whole image in pixels. Defaults to 600.
+            dpi (int, optional): resolution. Defaults to 96.
+
+        Returns:
+            Future | ggplot: the Future of the composed image (see plot_rendering.submit_render()) or the message of get_couplex_plot(), if nothing is selected
+        """
+
+        df = self._couplex_plot_data(lambda_filter, groups, samples, antibodies)
+        if df.is_empty():
+            return self.get_couplex_plot(
+                lambda_filter, groups, samples, antibodies, plot_type, sensitivity
+            )
+
+        # the band can exceed the largest number of couplexes by the largest rescaling
+        upper = self.df_couplexes["couplexes"].max()
+        if sensitivity > 0:
+            upper *= (1 + sensitivity) / (1 - sensitivity)
+        limits = (self.df_couplexes["couplexes"].min(), upper)
+
+        facets = df["antibodies"].unique().sort().to_list()
+        # the size of the panels is given by the layout of all antibody pairs, so that it does not change with the selection
+        nrow, ncol = wrap_dims(len(self.antibodies))
+        size = (width / ncol / dpi, height / nrow / dpi)
+        ncol = wrap_dims(len(facets))[1]
+
+        panels = []
+        for facet in facets:
+            df_facet = df.filter(pl.col("antibodies") == facet)
+            key = (
+                "couplexes",
+                frame_key(df_facet.select("sample_name", "antibodies", "couplexes")),
+                self.vol,
+                limits,
+                tuple(plot_type),
+                sensitivity,
+                size,
+                dpi,
+            )
+            panels.append(
+                self.panel_cache.get(
+                    key,
+                    lambda: submit_panel(
+                        self._couplex_plot(df_facet, plot_type, sensitivity)
+                        + coord_cartesian(ylim=limits),
+                        *size,
+                        dpi,
+                    ),
+                )
+            )
+
+        return compose_when_done(panels, ncol, dpi)
+
+    def get_lambda_range_panels(
+        self,
+        lambda_filter: bool,
+        groups: tuple,
+        samples: tuple,
+        antibodies: tuple,
+        additional_space=0.05,
+        num_x_ticks=4,
+        width: float = 960,
+        height: float = 600,
+        dpi: int = 96,
+    ):
+        """
+        This function draws the same plot as get_lambda_ranges(), but each facet is rendered on its own and cached in self.panel_cache (see get_couplex_panels()). The x-axis is shared by all groups, samples and antibody pairs of the lambda filtered plate instead of only the displayed ones.
+
+        Args:
+            lambda_filter (bool): true if the box apply lambda filter is ticked
+            groups (tuple): groups (reaction mixes from QIAcuity Software Suite) to be included in the plot
+            samples (tuple): samples to be included in the plot
+            antibodies (tuple): antibody pairs to be included in the plot
+            additional_space (float, optional): additional space from min and max lambda to limit of x-axis. Defaults to 0.05.
+            num_x_ticks (int, optional): number of vertical lines in the ranges. Defaults to 4.
+            width (float, optional): width of the whole image in pixels. Defaults to 960.
+            height (float, optional): height of the whole image in pixels. Defaults to 600.
+            dpi (int, optional): resolution. Defaults to 96.
+
+        Returns:
+            Future | ggplot: the Future of the composed image (see get_couplex_panels()) or the message of get_lambda_ranges(), if nothing is selected
+        """
+
+        if self.df_couplexes.is_empty() or self.df_couplexes_filtered.is_empty():
+            return self.get_lambda_ranges(lambda_filter, groups, samples, antibodies)
+
+        df_segments, points, _, _ = self._format_for_lambda_range(
+            lambda_filter=lambda_filter,
+            groups=groups,
+            samples=samples,
+            antibodies=antibodies,
+        )
+
+        # limits of the plate before the selection of the checkboxes
+        df_limits = self.df_lambda_aggregates
+        if lambda_filter:
+            df_limits = self.lambda_aggregates_cache.get(
+                self.filter_values_lambda, df_segments
+            )
+        min_lambda, max_lambda = df_limits["min"].min(), df_limits["max"].max()
+
+        facet_columns = ["group", "sample_name", "antibodies"]
+        facets = df_segments.select(facet_columns).unique().sort(facet_columns).rows()
+        # the size of the panels is given by the layout of all facets of the plate, so that it does not change with the selection
+        nrow, ncol = wrap_dims(self.df_lambda_aggregates.select(facet_columns).n_unique())
+        size = (width / ncol / dpi, height / nrow / dpi)
+        ncol = wrap_dims(len(facets))[1]
+
+        panels = []
+        for facet in facets:
+            selection = [pl.col(col) == value for col, value in zip(facet_columns, facet)]
+            df_facet = df_segments.filter(selection)
+            points_facet = {stat: df.filter(selection) for stat, df in points.items()}
+            key = (
+                "lambda_ranges",
+                frame_key(df_facet),
+                min_lambda,
+                max_lambda,
+                additional_space,
+                num_x_ticks,
+                size,
+                dpi,
+            )
+            panels.append(
+                self.panel_cache.get(
+                    key,
+                    lambda: submit_panel(
+                        self._lambda_range_plot(
+                            df_facet,
+                            points_facet,
+                            min_lambda,
+                            max_lambda,
+                            additional_space,
+                            num_x_ticks,
+                        ),
+                        *size,
+                        dpi,
+                    ),
+                )
+            )
+
+        return compose_when_done(panels, ncol, dpi)
+
+    def get_plate_heatmap(
+        self,
+        lambda_filter: bool,
+        filter_values_lambda: tuple,
+        groups: tuple,
+        samples: tuple,
+        antibodies: tuple,
+        metric: str = "couplexes",
+        width: float = 960,
+        height: float = 600,
+        dpi: int = 96,
+    ) -> Figure:
+        """
+        This function shows the number of couplexes, the lambda or the quality control flags of each well at its position on the plate, one panel per antibody pair. Spatial problems like edge effects or a bad row are thus visible at a glance. The filters are applied to self.well_grid, i.e. no row of df_couplexes is touched.
+
+        Args:
+            lambda_filter (bool): true if the box apply lambda filter is ticked
+            filter_values_lambda (tuple): min and max value for filtering from the slider
+            groups (tuple): groups (reaction mixes from QIAcuity Software Suite) to be included in the plot
+            samples (tuple): samples to be included in the plot
+            antibodies (tuple): antibody pairs to be included in the plot
+            metric (str, optional): "couplexes", "lambda" or "qc" (see plate_layout.py). Defaults to "couplexes".
+            width (float, optional): width of the image in pixels. Defaults to 960.
+            height (float, optional): height of the image in pixels. Defaults to 600.
+            dpi (int, optional): resolution. Defaults to 96.
+
+        Returns:
+            Figure: the heatmap, wells which are empty or filtered out are grey
+        """
+
+        # same lambda range as in filtering()
+        lambda_range = (self.min_lambda, self.max_lambda)
+        if lambda_filter:
+            lambda_range = filter_values_lambda
+
+        mask = self.well_grid.update(lambda_range, groups, samples, antibodies)
+
+        return plot_heatmap(
+            self.well_grid,
+            mask,
+            antibodies,
+            metric,
+            colors=(
+                shiny_theme.colors.light,
+                shiny_theme.colors.primary,
+                # the theme has no grey, this is a grey of bootstrap, which is darker than the lowest values
+                "#adb5bd",
+                shiny_theme.colors.dark,
+            ),
+            width=width,
+            height=height,
+            dpi=dpi,
+        )
+
+    def get_metadata(self) -> pl.DataFrame:
+        """
+        This function returns the reaction mix and the sample name of each well, e.g. to edit them in the app.
+
+        Returns:
+            pl.DataFrame: well, group and sample_name as strings
+        """
+
+        # the wells are sorted like on the plate, i.e. A2 before A10, names like hyperwells come last
+        well = pl.col("well")
+        return (
+            self.df_couplexes.select(
+                pl.col(["well", "group", "sample_name"]).cast(pl.String)
+            )
+            .unique(maintain_order=True)
+            .sort(
+                well.str.extract(WELL_PATTERN.pattern, 1),
+                well.str.extract(WELL_PATTERN.pattern, 2).cast(pl.Int32),
+                well,
+                nulls_last=True,
+            )
+        )
+
+    def remap_metadata(self, df_metadata: pl.DataFrame) -> "PICO":
+        """
+        This function changes reaction mixes and sample names without processing the file again. The partition counts, lambdas and couplexes do not depend on the labels, thus, only the labels are replaced through a join and the aggregates depending on the labels (replicate outliers of the quality control, lambda aggregates and standard curves) are recalculated.
+
+        Args:
+            df_metadata (pl.DataFrame): well, group and sample_name, see get_metadata()
+
+        Returns:
+            PICO: a copy of this object with the new labels, the dataframes without labels are shared with this object
+        """
+
+        df_metadata = df_metadata.select(
+            pl.col(["well", "group", "sample_name"]).cast(pl.String)
+        ).unique("well", keep="last")
+
+        pico = copy.copy(self)
+
+        # the replicates are defined by the labels, so the flags are set again
+        pico.df_couplexes = flag_quality(
+            self._remap_labels(self.df_couplexes, df_metadata).drop("qc_flags")
+        )
+        pico.df_lambda = self._remap_labels(self.df_lambda, df_metadata)
+        pico.groups = pico.df_couplexes["group"].cast(pl.String).unique().to_list()
+        pico.samples = (
+            pico.df_couplexes["sample_name"].cast(pl.String).unique().to_list()
+        )
+
+        # same as after the initialization
+        pico.df_couplexes_filtered = pico.df_couplexes
+        pico.df_lambda_aggregates = pico._aggregate_lambda_ranges(pico.df_couplexes)
+        pico.lambda_aggregates_cache = {}
+        pico.well_grid = WellGrid(pico.df_couplexes, pico.plate_format)
+        if pico.df_dilutions is not None:
+            pico.set_dilutions(pico.df_dilutions)
+
+        return pico
+
+    def set_dilutions(self, df_dilutions: pl.DataFrame):
+        """
+        This function adds the dilutions of the samples and fits the standard curves of all series and antibody pairs at once. The fits only depend on the dilutions, thus, they are calculated here once and filtering never triggers a refit. Rows outside the suggested lambda range (see quality_control.py) are not used for the fits.
+
+        Args:
+            df_dilutions (pl.DataFrame): result of quantification.read_dilutions()
+        """
+
+        self.df_dilutions = df_dilutions
+        self.df_standard_curves = fit_standard_curves(
+            add_molar_concentration(
+                self.df_couplexes.filter(
+                    (pl.col("qc_flags") & QC_FLAGS["lambda_out_of_range"]) == 0
+                ),
+                df_dilutions,
+            )
+        )
+
+    def get_quantified_data(self) -> pl.DataFrame:
+        """
+        This function returns the processed and filtered data with the molar concentration of the undiluted samples.
+
+        Returns:
+            pl.DataFrame: filtered results with the additional columns series, dilution and couplexes_molar (mol/l)
+        """
+
+        df = add_molar_concentration(self.df_couplexes_filtered, self.df_dilutions)
+
+        return df.with_columns(
+            pl.col("antibodies").cast(pl.String).str.replace("\n&\n", " & ")
+        )
+
+    def get_standard_curves(self, antibodies: tuple) -> pl.DataFrame:
+        """
+        This function returns the cached standard curves of the selected antibody pairs.
+
+        Args:
+            antibodies (tuple): antibody pairs to be included
+
+        Returns:
+            pl.DataFrame: the fit parameters, see quantification.fit_standard_curves()
+        """
+
+        df = self.df_standard_curves.filter(pl.col("antibodies").is_in(antibodies))
+
+        return df.with_columns(
+            pl.col("antibodies").cast(pl.String).str.replace("\n&\n", " & ")
+        )
+
+    def get_standard_curve_plot(self, antibodies: tuple) -> ggplot:
+        """
+        This function plots the filtered couplexes over the relative concentration with the cached standard curves.
+
+        Args:
+            antibodies (tuple): antibody pairs to be included in the plot
+
+        Returns:
+            ggplot: one facet per antibody pair, one color per series
+        """
+
+        return get_standard_curve_plot(
+            add_molar_concentration(self.df_couplexes_filtered, self.df_dilutions),
+            self.df_standard_curves.filter(pl.col("antibodies").is_in(antibodies)),
+        )
+
     def get_processed_data(self) -> pl.DataFrame:
         """
         This functions returns the processed data and replaces the lines breaks necessary for the depiction in the UI and the plots by a space.
@@ -690,7 +1425,7 @@ class PICO:
         """
 
         df = self.df_couplexes.with_columns(
-            pl.col("antibodies").str.replace("\n&\n", " & ")
+            pl.col("antibodies").cast(pl.String).str.replace("\n&\n", " & ")
         )
 
         return df
@@ -704,7 +1439,46 @@ class PICO:
         """
 
         df = self.df_couplexes_filtered.with_columns(
-            pl.col("antibodies").str.replace("\n&\n", " & ")
+            pl.col("antibodies").cast(pl.String).str.replace("\n&\n", " & ")
         )
 
         return df
+
+    def get_plot_payload(self) -> dict:
+        """
+        This function packs everything the interactive plots need into a compact columnar format. It is sent to the browser only once per upload, afterwards filtering and redrawing happens client-side (see interactive_plots.js) and the server is not involved anymore.
+
+        Returns:
+            dict: columnar versions of df_couplexes and df_lambda and the metadata needed for the axes of the plots
+        """
+
+        # only the columns actually used by the plots and the filters are sent
+        df_couplexes = self.df_couplexes.select(
+            [
+                "group",
+                "sample_name",
+                "well",
+                "antibodies",
+                "antibody1",
+                "lambda_ab1",
+                "antibody2",
+                "lambda_ab2",
+                "couplexes",
+                "qc_flags",
+            ]
+        )
+
+        return {
+            "couplexes": to_columnar(df_couplexes),
+            "lambda": to_columnar(self.df_lambda.select("lambda_ab")),
+            "vol": self.vol,
+            # same upper limit as the slider and the static histogram
+            "max_lambda": round_up(self.max_lambda, 1),
+            # use the theme colors just as in the static plots
+            "colors": {
+                "primary": shiny_theme.colors.primary,
+                "secondary": shiny_theme.colors.secondary,
+                "dark": shiny_theme.colors.dark,
+                "light": shiny_theme.colors.light,
+            },
+        }
@@ -0,0 +1,265 @@
+# python packages
+import re
+import string
+
+import numpy as np
+import polars as pl
+
+from matplotlib.colors import LinearSegmentedColormap
+from matplotlib.figure import Figure
+
+from facet_cache import wrap_dims
+
+# rows and columns of the QIAcuity nanoplates, the wells of the 24-well plates are arranged in 8 rows of 3 wells
+PLATE_LAYOUTS = {"24-well": (8, 3), "96-well": (8, 12)}
+
+# values that can be shown in the heatmap and their labels in the app
+HEATMAP_METRICS = {
+    "couplexes": "Number of couplexes",
+    "lambda": "Mean \u03bb of both antibodies",
+    "qc": "Number of quality control flags",
+}
+
+# a well is a row letter and a column number, e.g. A1 or H12
+WELL_PATTERN = re.compile(r"^([A-Z])(\d{1,2})$")
+
+
+def plate_shape(plate_format: str, wells: list) -> tuple:
+    """
+    This function returns the number of rows and columns of a plate. Unknown plate formats are as large as the wells require.
+
+    Args:
+        plate_format (str): the plate type of the MultipleOccupancy file, e.g. "Nanoplate 26K 24-well"
+        wells (list): the wells of the plate
+
+    Returns:
+        tuple: number of rows and number of columns
+    """
+
+    for key, shape in PLATE_LAYOUTS.items():
+        if key in plate_format:
+            return shape
+
+    rows, cols = well_positions(wells)
+    return max(rows.max(initial=-1) + 1, 1), max(cols.max(initial=-1) + 1, 1)
+
+
+def well_positions(wells: list) -> tuple:
+    """
+    This function converts wells like "B3" into zero-based row and column indices. Names, which are not a position on the plate (e.g. hyperwells), get -1.
+
+    Args:
+        wells (list): the wells
+
+    Returns:
+        tuple: array of row indices and array of column indices
+    """
+
+    rows = np.full(len(wells), -1, dtype=np.int64)
+    cols = np.full(len(wells), -1, dtype=np.int64)
+    for i, well in enumerate(wells):
+        match = WELL_PATTERN.match(str(well))
+        if match:
+            rows[i] = string.ascii_uppercase.index(match.group(1))
+            cols[i] = int(match.group(2)) - 1
+
+    return rows, cols
+
+
+class WellGrid:
+    """
+    Dense grid of a plate with one layer per antibody pair, i.e. all values of a plate are arrays of the shape (antibody pairs, rows, columns). The grid is built once from df_couplexes. Filtering only changes the mask of the visible wells, which is calculated from the grid itself and not from the dataframe. The mask of the lambda range and the mask of the selected labels are kept separately, so that changing the checkboxes does not recalculate the lambda mask and vice versa.
+    """
+
+    def __init__(self, df: pl.DataFrame, plate_format: str):
+        self.antibodies = df["antibodies"].cast(pl.String).unique().sort().to_list()
+        self.groups = df["group"].cast(pl.String).unique().sort().to_list()
+        self.samples = df["sample_name"].cast(pl.String).unique().sort().to_list()
+
+        wells = df["well"].cast(pl.String).to_list()
+        self.shape = plate_shape(plate_format, wells)
+        rows, cols = well_positions(wells)
+        layers = (
+            df["antibodies"]
+            .cast(pl.String)
+            .replace_strict(self.antibodies, range(len(self.antibodies)))
+            .to_numpy()
+        )
+
+        # rows without a position on the plate (hyperwells) or beyond the plate format are not part of the grid
+        on_plate = (rows >= 0) & (rows < self.shape[0]) & (cols < self.shape[1])
+        index = (layers[on_plate], rows[on_plate], cols[on_plate])
+        grid_shape = (len(self.antibodies), *self.shape)
+
+        def layer(values, fill, dtype):
+            grid = np.full(grid_shape, fill, dtype=dtype)
+            grid[index] = np.asarray(values)[on_plate]
+            return grid
+
+        def codes(col, labels):
+            return (
+                df[col].cast(pl.String).replace_strict(labels, range(len(labels)))
+            ).to_numpy()
+
+        # empty wells are NaN or -1, so that they never pass a filter
+        self.couplexes = layer(df["couplexes"].to_numpy(), np.nan, np.float64)
+        self.lambda_ab1 = layer(df["lambda_ab1"].to_numpy(), np.nan, np.float64)
+        self.lambda_ab2 = layer(df["lambda_ab2"].to_numpy(), np.nan, np.float64)
+        self.qc_flags = layer(df["qc_flags"].to_numpy(), 0, np.uint8)
+        self.group_codes = layer(codes("group", self.groups), -1, np.int64)
+        self.sample_codes = layer(codes("sample_name", self.samples), -1, np.int64)
+        self.occupied = ~np.isnan(self.couplexes)
+
+        # the masks of the last filter, see update()
+        self._lambda_range = None
+        self._lambda_mask = self.occupied
+        self._selection = None
+        self._selection_mask = self.occupied
+
+    def update(
+        self, lambda_range: tuple, groups: tuple, samples: tuple, antibodies: tuple
+    ) -> np.ndarray:
+        """
+        This function applies the same filters as PICO.filtering() to the grid. Only the mask of the changed part of the filter is calculated again.
+
+        Args:
+            lambda_range (tuple): minimal and maximal lambda of both antibodies
+            groups (tuple): groups (reaction mixes from QIAcuity Software Suite) to be included
+            samples (tuple): samples to be included
+            antibodies (tuple): antibody pairs to be included
+
+        Returns:
+            np.ndarray: true for each visible well and antibody pair
+        """
+
+        lambda_range = tuple(lambda_range)
+        if lambda_range != self._lambda_range:
+            min_lambda, max_lambda = lambda_range
+            # NaN of empty wells is never within the range
+            self._lambda_mask = (
+                (self.lambda_ab1 >= min_lambda)
+                & (self.lambda_ab1 <= max_lambda)
+                & (self.lambda_ab2 >= min_lambda)
+                & (self.lambda_ab2 <= max_lambda)
+            )
+            self._lambda_range = lambda_range
+
+        selection = (tuple(groups), tuple(samples), tuple(antibodies))
+        if selection != self._selection:
+
+            def selected(labels, values):
+                # true for each label, the codes of the grid index this array
+                return np.array([label in values for label in labels], dtype=bool)
+
+            self._selection_mask = (
+                selected(self.groups, groups)[self.group_codes]
+                & selected(self.samples, samples)[self.sample_codes]
+                & selected(self.antibodies, antibodies)[:, None, None]
+                & self.occupied
+            )
+            self._selection = selection
+
+        return self._lambda_mask & self._selection_mask
+
+    def values(self, metric: str) -> np.ndarray:
+        """
+        This function returns the values of a metric for each antibody pair and well.
+
+        Args:
+            metric (str): a key of HEATMAP_METRICS
+
+        Returns:
+            np.ndarray: values of the shape (antibody pairs, rows, columns), NaN for empty wells
+        """
+
+        if metric == "couplexes":
+            return self.couplexes
+        if metric == "lambda":
+            return (self.lambda_ab1 + self.lambda_ab2) / 2
+        if metric == "qc":
+            # number of set bits of the flags
+            bits = np.unpackbits(self.qc_flags[..., None], axis=-1).sum(axis=-1)
+            return np.where(self.occupied, bits, np.nan)
+        raise ValueError(f"Unknown metric {metric}.")
+
+
+def plot_heatmap(
+    grid: WellGrid,
+    mask: np.ndarray,
+    antibodies: tuple,
+    metric: str,
+    colors: tuple,
+    width: float,
+    height: float,
+    dpi: int,
+) -> Figure:
+    """
+    This function draws the grid as one image per antibody pair. Wells, which are empty or filtered out, are grey. The color scale is the same for all antibody pairs and given by all wells of the plate, so that it does not change with the filters.
+
+    Args:
+        grid (WellGrid): the grid of the plate
+        mask (np.ndarray): visible wells, see WellGrid.update()
+        antibodies (tuple): antibody pairs with a panel
+        metric (str): a key of HEATMAP_METRICS
+        colors (tuple): colors of the lowest and the highest value, the color of hidden wells and the color of the text
+        width (float): width in pixels
+        height (float): height in pixels
+        dpi (int): resolution
+
+    Returns:
+        Figure: the heatmap
+    """
+
+    low, high, hidden, text = colors
+    values = grid.values(metric)
+    cmap = LinearSegmentedColormap.from_list("heatmap", [low, high])
+    cmap.set_bad(hidden)
+    # nothing is occupied, e.g. if all wells are hyperwells
+    vmin, vmax = (
+        (np.nanmin(values), np.nanmax(values)) if grid.occupied.any() else (0, 1)
+    )
+
+    # only the selected antibody pairs get a panel, wells filtered out by lambda stay visible as grey wells
+    layers = [i for i, name in enumerate(grid.antibodies) if name in antibodies]
+
+    # the figure is not created with pyplot, so it is not registered anywhere and needs no closing
+    figure = Figure(figsize=(width / dpi, height / dpi), dpi=dpi)
+    if not layers or not grid.occupied.any():
+        figure.text(
+            0.5,
+            0.5,
+            "The current selection contains no wells with a position on the plate.",
+            ha="center",
+            va="center",
+            color=text,
+        )
+        return figure
+
+    nrow, ncol = wrap_dims(len(layers))
+    axes = figure.subplots(nrow, ncol, squeeze=False)
+    nrows, ncols = grid.shape
+    for ax in axes.flat[len(layers) :]:
+        ax.set_axis_off()
+
+    for ax, i in zip(axes.flat, layers):
+        image = ax.imshow(
+            np.ma.masked_where(~mask[i], values[i]),
+            cmap=cmap,
+            vmin=vmin,
+            vmax=vmax,
+            interpolation="nearest",
+        )
+        ax.set_title(grid.antibodies[i].replace("\n", " "), color=text)
+        # the plate is labelled just as the nanoplate, i.e. rows A, B, ... and columns 1, 2, ...
+        ax.set_xticks(range(ncols), [str(col + 1) for col in range(ncols)])
+        ax.set_yticks(range(nrows), list(string.ascii_uppercase[:nrows]))
+        ax.xaxis.tick_top()
+        ax.tick_params(length=0, colors=text)
+        for spine in ax.spines.values():
+            spine.set_visible(False)
+
+    colorbar = figure.colorbar(image, ax=axes, shrink=0.8)
+    colorbar.set_label(HEATMAP_METRICS[metric], color=text)
+    colorbar.ax.tick_params(colors=text)
+
+    return figure
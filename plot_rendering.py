@@ -0,0 +1,180 @@
+# python packages
+import io
+import multiprocessing
+import os
+import pickle
+
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import matplotlib.pyplot as plt
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from plotnine import ggplot, theme
+
+# own functions
+from facet_cache import render_panel
+
+# plots contain local functions (e.g. the palettes of scale_*_manual), which only cloudpickle can send to other processes
+# cloudpickle is part of requirements.txt, without it all plots are rendered one after another in the app process
+try:
+    import cloudpickle
+except ImportError:
+    cloudpickle = None
+
+# number of processes rendering the static plots, i.e. the histogram, the plot of the couplexes and the lambda-range plot of a filter change are rendered at the same time
+# with cached panels, the changed facets of a plot are rendered at the same time as well
+# matplotlib and plotnine keep global state (pyplot, rcParams), so the plots are rendered in processes instead of threads
+# 1 means everything is rendered in the app process, which is the default on a single core
+PLOT_WORKERS = int(os.environ.get("PICO_PLOT_WORKERS", min(3, os.cpu_count() or 1)))
+
+# the pool is started once and then reused for all renders of this process
+_executor = None
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    """
+    This function returns the process pool. A new pool imports plotnine in all workers right away, so that the first plots do not wait for the import.
+
+    Returns:
+        ProcessPoolExecutor: the pool of rendering processes
+    """
+
+    global _executor
+
+    if _executor is None:
+        # spawn instead of fork, because forking the threads of a running shiny server is not safe
+        _executor = ProcessPoolExecutor(
+            max_workers=PLOT_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+        for _ in range(PLOT_WORKERS):
+            _executor.submit(_warm_up)
+
+    return _executor
+
+
+def _warm_up():
+    """
+    This function does nothing, it only makes a worker import this module.
+    """
+
+
+def render_png(plot, width: float, height: float, dpi: float) -> bytes:
+    """
+    This function renders a ggplot or a matplotlib figure (e.g. from facet_cache.compose()) as PNG with the Agg backend.
+
+    Args:
+        plot (ggplot | Figure): the plot
+        width (float): width in pixels
+        height (float): height in pixels
+        dpi (float): resolution
+
+    Returns:
+        bytes: the PNG image
+    """
+
+    if isinstance(plot, ggplot):
+        figure = (plot + theme(figure_size=(width / dpi, height / dpi), dpi=dpi)).draw()
+    else:
+        figure = plot
+        figure.set_size_inches(width / dpi, height / dpi)
+        figure.set_dpi(dpi)
+
+    buffer = io.BytesIO()
+    FigureCanvasAgg(figure).print_png(buffer)
+    # plotnine creates the figure with pyplot, which keeps a reference until it is closed
+    if isinstance(plot, ggplot):
+        plt.close(figure)
+
+    return buffer.getvalue()
+
+
+def _render_pickled(render, payload: bytes, *args):
+    """
+    This function runs in the workers and renders a plot pickled by cloudpickle with render_png() or facet_cache.render_panel().
+    """
+
+    return render(pickle.loads(payload), *args)
+
+
+def _run(render, *args) -> Future:
+    """
+    This function renders right away in the current process and returns the result or the error as finished Future.
+    """
+
+    future = Future()
+    try:
+        future.set_result(render(*args))
+    except Exception as e:
+        future.set_exception(e)
+
+    return future
+
+
+def _submit(render, plot: ggplot, *args) -> Future:
+    """
+    This function renders a ggplot in the pool, if there is one, and otherwise right away in the current process.
+    """
+
+    if PLOT_WORKERS > 1 and cloudpickle is not None:
+        return _get_executor().submit(
+            _render_pickled, render, cloudpickle.dumps(plot), *args
+        )
+
+    return _run(render, plot, *args)
+
+
+def _when_done(future: Future, function, *args) -> Future:
+    """
+    This function calls a function with the result of a Future as soon as it is finished. The function runs in the thread finishing the Future.
+    """
+
+    result = Future()
+
+    def done(finished):
+        try:
+            result.set_result(function(finished.result(), *args))
+        except Exception as e:
+            result.set_exception(e)
+
+    future.add_done_callback(done)
+
+    return result
+
+
+def submit_render(plot, width: float, height: float, dpi: float) -> Future:
+    """
+    This function starts the rendering of a plot and returns immediately. ggplots are rendered in the pool, if there is one. Figures are already drawn, so they are rendered in the current process. Futures of figures (e.g. from facet_cache.compose_when_done()) are rendered as soon as they are finished.
+
+    Args:
+        plot (ggplot | Figure | Future): the plot
+        width (float): width in pixels
+        height (float): height in pixels
+        dpi (float): resolution
+
+    Returns:
+        Future: the PNG image as bytes, once rendered
+    """
+
+    if isinstance(plot, Future):
+        return _when_done(plot, render_png, width, height, dpi)
+    if isinstance(plot, ggplot):
+        return _submit(render_png, plot, width, height, dpi)
+
+    return _run(render_png, plot, width, height, dpi)
+
+
+def submit_panel(plot: ggplot, width: float, height: float, dpi: int) -> Future:
+    """
+    This function starts the rendering of a single facet in the pool, if there is one, see facet_cache.render_panel().
+
+    Args:
+        plot (ggplot): the plot of the panel
+        width (float): width in inches
+        height (float): height in inches
+        dpi (int): resolution
+
+    Returns:
+        Future: the panel as RGBA array, once rendered
+    """
+
+    return _submit(render_panel, plot, width, height, dpi)
@@ -0,0 +1,117 @@
+import polars as pl
+
+# bits of the qc_flags column, several flags can be set for the same row
+# the flags of a row are decoded with qc_flag_names()
+QC_FLAGS = {
+    "lambda_out_of_range": 1,
+    "low_valid_partitions": 2,
+    "dead_volume_anomaly": 4,
+    "replicate_outlier": 8,
+    "high_diff_to_obs": 16,
+}
+
+
+def flag_quality(
+    df: pl.DataFrame,
+    lambda_range: tuple = (0.01, 0.25),
+    min_partition_fraction: float = 0.9,
+    max_robust_z: float = 3.5,
+    max_rel_diff: float = 0.01,
+) -> pl.DataFrame:
+    """
+    This function adds the bit-packed column qc_flags to the dataframe with the couplexes. All flags are calculated in one pass over the dataframe, so that filters and reports can use them later without any recalculation.
+
+    Args:
+        df (pl.DataFrame): dataframe with the calculated couplexes
+        lambda_range (tuple, optional): suggested range of lambda, see README. Defaults to (0.01, 0.25).
+        min_partition_fraction (float, optional): minimal number of valid partitions as fraction of the median of the plate. Defaults to 0.9.
+        max_robust_z (float, optional): maximal robust z-score of the dead volume within the plate and of the couplexes within replicates. Defaults to 3.5.
+        max_rel_diff (float, optional): maximal difference between observed and calculated double positives relative to the observed double positives. Defaults to 0.01.
+
+    Returns:
+        pl.DataFrame: df with the additional column qc_flags
+    """
+
+    # replicates are wells with the same group, sample and antibody pair
+    replicates = ["group", "sample_name", "antibodies"]
+    min_lambda, max_lambda = lambda_range
+
+    flags = [
+        # at least one of the antibodies is outside of the suggested lambda range
+        (
+            ~pl.col("lambda_ab1").is_between(min_lambda, max_lambda)
+            | ~pl.col("lambda_ab2").is_between(min_lambda, max_lambda),
+            QC_FLAGS["lambda_out_of_range"],
+        ),
+        # the well has much fewer valid partitions than the other wells of the plate
+        (
+            pl.col("valid_partitions")
+            < min_partition_fraction * pl.col("valid_partitions").median(),
+            QC_FLAGS["low_valid_partitions"],
+        ),
+        # the dead volume deviates from the rest of the plate
+        (
+            _robust_z("dead_volume").abs() > max_robust_z,
+            QC_FLAGS["dead_volume_anomaly"],
+        ),
+        # the number of couplexes deviates from the replicates
+        (
+            _robust_z("couplexes", over=replicates).abs() > max_robust_z,
+            QC_FLAGS["replicate_outlier"],
+        ),
+        # the dDPCS model did not match the observed double positives
+        # diff_to_obs is the squared difference
+        (
+            pl.col("diff_to_obs").sqrt()
+            > max_rel_diff * pl.col("positives_double"),
+            QC_FLAGS["high_diff_to_obs"],
+        ),
+    ]
+
+    return df.with_columns(
+        pl.sum_horizontal(
+            # missing values, e.g. no dead volume without plate format, do not set a flag
+            pl.when(condition.fill_null(False)).then(bit).otherwise(0)
+            for condition, bit in flags
+        )
+        .cast(pl.UInt8)
+        .alias("qc_flags")
+    )
+
+
+def _robust_z(col: str, over: list = None) -> pl.Expr:
+    """
+    This function returns the modified z-score based on the median absolute deviation (Iglewicz and Hoaglin), which is robust against the outliers it shall identify.
+
+    Args:
+        col (str): the column to score
+        over (list, optional): columns defining the groups, in which the score is calculated. Defaults to None, i.e. the entire column.
+
+    Returns:
+        pl.Expr: the modified z-score, 0 if the median absolute deviation is 0
+    """
+
+    median = pl.col(col).median()
+    if over:
+        median = median.over(over)
+    mad = (pl.col(col) - median).abs().median()
+    if over:
+        mad = mad.over(over)
+
+    return (
+        pl.when(mad > 0).then(0.6745 * (pl.col(col) - median) / mad).otherwise(0.0)
+    )
+
+
+def qc_flag_names(flags: int) -> list:
+    """
+    This function decodes the value of the qc_flags column.
+
+    Args:
+        flags (int): value of qc_flags
+
+    Returns:
+        list: names of the flags that are set
+    """
+
+    return [name for name, bit in QC_FLAGS.items() if flags & bit]
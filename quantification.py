@@ -0,0 +1,204 @@
+import polars as pl
+
+from plotnine import *
+from shinyswatch.theme import minty as shiny_theme
+
+# molecules per mol
+AVOGADRO = 6.02214076e23
+
+
+def read_dilutions(path: str) -> pl.DataFrame:
+    """
+    This function reads the dilution metadata of the samples from a .csv file with the columns sample_name and dilution and optionally series. Samples of the same series are dilutions of the same stock, e.g. a dilution series of a lysate. Without the column series, all samples belong to the same series.
+
+    Args:
+        path (str): path of the .csv file
+
+    Returns:
+        pl.DataFrame: sample_name, series and dilution (dilution factor, e.g. 100 for 1:100)
+    """
+
+    df = pl.read_csv(path)
+
+    missing = {"sample_name", "dilution"} - set(df.columns)
+    if missing:
+        raise ValueError(
+            f"The dilution file needs the columns sample_name and dilution, {', '.join(sorted(missing))} is missing."
+        )
+    if "series" not in df.columns:
+        df = df.with_columns(pl.lit("series").alias("series"))
+
+    df = df.select(
+        pl.col("sample_name").cast(pl.String),
+        pl.col("series").cast(pl.String),
+        pl.col("dilution").cast(pl.Float64),
+    )
+    if (df["dilution"] <= 0).any():
+        raise ValueError("All dilution factors need to be positive.")
+
+    return df.unique("sample_name", keep="last", maintain_order=True)
+
+
+def add_molar_concentration(
+    df: pl.DataFrame, df_dilutions: pl.DataFrame
+) -> pl.DataFrame:
+    """
+    This function converts the couplexes of each row into the molar concentration of the undiluted sample, i.e. couplexes / mastermix_volume * dilution * 1e6 / AVOGADRO (see the comment in couplex_calculation._couplexes()). Rows of samples without dilution get no concentration.
+
+    Args:
+        df (pl.DataFrame): df_couplexes or a filtered version of it
+        df_dilutions (pl.DataFrame): result of read_dilutions()
+
+    Returns:
+        pl.DataFrame: df with the additional columns series, dilution and couplexes_molar (mol/l)
+    """
+
+    return (
+        # the sample names are enums of this plate, the dilution file has strings
+        df.with_columns(pl.col("sample_name").cast(pl.String).alias("_sample"))
+        .join(
+            df_dilutions.rename({"sample_name": "_sample"}),
+            on="_sample",
+            how="left",
+            maintain_order="left",
+        )
+        .drop("_sample")
+        .with_columns(
+            (
+                pl.col("couplexes")
+                / _reaction_volume()
+                * pl.col("dilution")
+                # couplexes per ul to couplexes per l
+                * 1e6
+                / AVOGADRO
+            ).alias("couplexes_molar")
+        )
+    )
+
+
+def fit_standard_curves(df: pl.DataFrame) -> pl.DataFrame:
+    """
+    This function fits a standard curve for each series and antibody pair, i.e. couplexes = slope * relative_concentration + intercept with relative_concentration = 1 / dilution. The closed-form least squares solution is calculated for all series and antibody pairs at once in a single aggregation. The slope is the number of couplexes of the undiluted sample, the intercept is the background.
+
+    Args:
+        df (pl.DataFrame): result of add_molar_concentration()
+
+    Returns:
+        pl.DataFrame: one row per series and antibody pair with the number of points, slope, intercept, r_squared and the molar concentration of the undiluted sample
+    """
+
+    x = 1 / pl.col("dilution")
+    y = pl.col("couplexes").cast(pl.Float64)
+    # sums of squares around the means of each series and antibody pair
+    sxx = ((x - x.mean()) ** 2).sum()
+    sxy = ((x - x.mean()) * (y - y.mean())).sum()
+    syy = ((y - y.mean()) ** 2).sum()
+
+    return (
+        df.filter(pl.col("dilution").is_not_null())
+        .group_by(["series", "antibodies"], maintain_order=True)
+        .agg(
+            points=pl.len(),
+            dilutions=pl.col("dilution").n_unique(),
+            mean_x=x.mean(),
+            mean_y=y.mean(),
+            volume=_reaction_volume().mean(),
+            sxx=sxx,
+            sxy=sxy,
+            syy=syy,
+        )
+        # a line needs at least two different dilutions
+        .with_columns(
+            slope=pl.when(pl.col("dilutions") > 1).then(pl.col("sxy") / pl.col("sxx"))
+        )
+        .with_columns(
+            intercept=pl.col("mean_y") - pl.col("slope") * pl.col("mean_x"),
+            r_squared=pl.when(pl.col("syy") > 0).then(
+                pl.col("sxy") ** 2 / (pl.col("sxx") * pl.col("syy"))
+            ),
+            concentration_molar=pl.col("slope") / pl.col("volume") * 1e6 / AVOGADRO,
+        )
+        .select(
+            [
+                "series",
+                "antibodies",
+                "points",
+                "dilutions",
+                "slope",
+                "intercept",
+                "r_squared",
+                "concentration_molar",
+            ]
+        )
+    )
+
+
+def get_standard_curve_plot(df: pl.DataFrame, df_fits: pl.DataFrame) -> ggplot:
+    """
+    This function plots the couplexes over the relative concentration of the samples together with the fitted standard curves.
+
+    Args:
+        df (pl.DataFrame): result of add_molar_concentration()
+        df_fits (pl.DataFrame): result of fit_standard_curves()
+
+    Returns:
+        ggplot: one facet per antibody pair, one color per series
+    """
+
+    df = df.filter(pl.col("dilution").is_not_null()).with_columns(
+        (1 / pl.col("dilution")).alias("relative_concentration")
+    )
+    df_fits = df_fits.filter(pl.col("slope").is_not_null())
+
+    if df.is_empty():
+        return (
+            ggplot()
+            + annotate(
+                "text",
+                x=0.5,
+                y=0.6,
+                label="None of the displayed samples has a dilution.\nNothing to display :-(",
+                ha="center",
+                va="center",
+                size=16,
+                color=shiny_theme.colors.dark,
+            )
+            + theme_void()
+        )
+
+    return (
+        ggplot(df, aes("relative_concentration", "couplexes", color="series"))
+        + geom_point(size=3, alpha=0.7)
+        + geom_abline(
+            df_fits,
+            aes(intercept="intercept", slope="slope", color="series"),
+        )
+        + labs(x="Relative concentration (1 / dilution)", y="Number of couplexes", color="Series")
+        + facet_wrap("antibodies", scales="free")
+        + theme(
+            # remove background from facets
+            panel_background=element_blank(),
+            # background color of facet labels
+            strip_background=element_rect(fill=shiny_theme.colors.secondary),
+            # color of all the text
+            text=element_text(color=shiny_theme.colors.dark),
+            # text on the secondary color shall be white just as in the shiny theme
+            strip_text=element_text(color=shiny_theme.colors.light),
+        )
+    )
+
+
+def _reaction_volume() -> pl.Expr:
+    """
+    This function returns the volume the couplexes refer to. With a known plate format, the couplexes are corrected for the dead volume and refer to the master mix volume, otherwise they refer to the cycled volume of the well.
+
+    Returns:
+        pl.Expr: volume in ul
+    """
+
+    return (
+        pl.when(pl.col("mastermix_volume") > 0)
+        .then(pl.col("mastermix_volume"))
+        .otherwise(pl.col("volume_per_well"))
+        .cast(pl.Float64)
+    )
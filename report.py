@@ -0,0 +1,534 @@
+# python packages
+import argparse
+import asyncio
+import base64
+import functools
+import html
+import io
+import multiprocessing
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import matplotlib.pyplot as plt
+import polars as pl
+
+from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.figure import Figure
+from shinyswatch.theme import minty as shiny_theme
+
+# own functions
+from plot_rendering import render_png
+from quality_control import QC_FLAGS
+from snapshots import SNAPSHOT_ROOT, load_snapshot, save_snapshot
+
+# number of processes processing files and drawing the plots of a report
+REPORT_WORKERS = int(os.environ.get("PICO_REPORT_WORKERS", os.cpu_count() or 1))
+# resolution of the plots, the pages are A4 landscape
+REPORT_DPI = int(os.environ.get("PICO_REPORT_DPI", 150))
+PAGE_SIZE = (11.69, 8.27)
+# maximal number of table rows per page of the PDF, longer tables continue on the next page
+TABLE_ROWS_PER_PAGE = 30
+
+# plots of each plate in the order of the report, the tables follow after the plots
+PLOT_PAGES = {
+    "couplexes": "Number of couplexes",
+    "lambda_ranges": "\u03bb-ranges",
+    "heatmap_couplexes": "Plate layout: number of couplexes",
+    "heatmap_qc": "Plate layout: quality control flags",
+}
+
+# the pool is started once and then reused for all reports and files of this process
+_executor = None
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    """
+    This function returns the pool of worker processes with REPORT_WORKERS processes.
+
+    Returns:
+        ProcessPoolExecutor: the pool of the reports
+    """
+
+    global _executor
+
+    if _executor is None:
+        # spawn instead of fork, because forking the threads of a running shiny server is not safe
+        _executor = ProcessPoolExecutor(
+            max_workers=max(1, REPORT_WORKERS),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    return _executor
+
+
+def sample_summary(df: pl.DataFrame) -> pl.DataFrame:
+    """
+    This function summarises the replicates of each reaction mix, sample and antibody pair.
+
+    Args:
+        df (pl.DataFrame): df_couplexes
+
+    Returns:
+        pl.DataFrame: number of wells, median, mean and coefficient of variation of the couplexes and the number of flagged wells
+    """
+
+    return (
+        df.group_by(["group", "sample_name", "antibodies"])
+        .agg(
+            wells=pl.len(),
+            median=pl.col("couplexes").median(),
+            mean=pl.col("couplexes").mean(),
+            cv=pl.col("couplexes").std() / pl.col("couplexes").mean(),
+            flagged=(pl.col("qc_flags") != 0).sum(),
+        )
+        .with_columns(
+            pl.col(["group", "sample_name", "antibodies"]).cast(pl.String),
+            pl.col("mean").round(1),
+            pl.col("cv").round(3),
+        )
+        .sort(["group", "sample_name", "antibodies"])
+    )
+
+
+def qc_table(df: pl.DataFrame) -> pl.DataFrame:
+    """
+    This function lists all rows flagged by the quality control with the names of their flags.
+
+    Args:
+        df (pl.DataFrame): df_couplexes
+
+    Returns:
+        pl.DataFrame: well, labels, couplexes and the names of the flags
+    """
+
+    return (
+        df.filter(pl.col("qc_flags") != 0)
+        .select(
+            pl.col(["well", "group", "sample_name", "antibodies"]).cast(pl.String),
+            "couplexes",
+            # same names as qc_flag_names(), but for all rows at once
+            pl.concat_str(
+                [
+                    pl.when((pl.col("qc_flags") & bit) != 0).then(pl.lit(name))
+                    for name, bit in QC_FLAGS.items()
+                ],
+                separator=", ",
+                ignore_nulls=True,
+            ).alias("flags"),
+        )
+        .sort(["well", "antibodies"])
+    )
+
+
+@functools.lru_cache(maxsize=8)
+def _load(token: str, root: str):
+    """
+    This function restores a plate once per worker. The dataframes of a snapshot are memory-mapped, so all workers share the pages of the same files.
+    """
+
+    pico = load_snapshot(token, root)
+    if pico is None:
+        raise ValueError(f"There is no snapshot {token}.")
+
+    return pico
+
+
+def _render_plot_page(token: str, root: str, page: str, dpi: int) -> bytes:
+    """
+    This function draws a plot of a plate in a worker, see PLOT_PAGES.
+
+    Returns:
+        bytes: the plot as PNG
+    """
+
+    pico = _load(token, root)
+    selection = dict(
+        groups=tuple(pico.groups),
+        samples=tuple(pico.samples),
+        antibodies=tuple(pico.antibodies),
+    )
+    width, height = PAGE_SIZE[0] * dpi, (PAGE_SIZE[1] - 1) * dpi
+
+    # the report always shows the whole plate
+    pico.filtering(lambda_filter=False, filter_values_lambda=None, **selection)
+    if page == "couplexes":
+        plot = pico.get_couplex_plot(
+            lambda_filter=False, plot_type=("Boxplot", "Violinplot"), **selection
+        )
+    elif page == "lambda_ranges":
+        plot = pico.get_lambda_ranges(lambda_filter=False, **selection)
+    else:
+        plot = pico.get_plate_heatmap(
+            lambda_filter=False,
+            filter_values_lambda=None,
+            metric=page.removeprefix("heatmap_"),
+            width=width,
+            height=height,
+            dpi=dpi,
+            **selection,
+        )
+
+    return render_png(plot, width, height, dpi)
+
+
+def _title(pico) -> str:
+    """
+    This function returns the title of the pages of a plate.
+    """
+
+    return f"Plate {pico.plate_id} ({pico.file_name})"
+
+
+def _tables(pico) -> list:
+    """
+    This function returns the headings and the tables of a plate, which follow after its plots.
+    """
+
+    return [
+        ("Summary per sample", sample_summary(pico.df_couplexes)),
+        ("Wells flagged by the quality control", qc_table(pico.df_couplexes)),
+    ]
+
+
+def _pdf_image_page(title: str, heading: str, png: bytes) -> Figure:
+    """
+    This function places a rendered plot on a page of the PDF.
+    """
+
+    figure = Figure(figsize=PAGE_SIZE)
+    figure.text(0.03, 0.96, title, fontsize=9, color=shiny_theme.colors.dark)
+    figure.text(0.03, 0.925, heading, fontsize=14, color=shiny_theme.colors.dark)
+    ax = figure.add_axes([0, 0, 1, (PAGE_SIZE[1] - 1) / PAGE_SIZE[1]])
+    ax.imshow(plt.imread(io.BytesIO(png), format="png"), interpolation="antialiased")
+    ax.set_axis_off()
+
+    return figure
+
+
+def _pdf_table_pages(title: str, heading: str, df: pl.DataFrame) -> list:
+    """
+    This function draws a table on one or more pages of the PDF. The tables are drawn in the main process, they are text and not images.
+    """
+
+    if df.is_empty():
+        df = pl.DataFrame({"": ["none"]})
+
+    figures = []
+    for offset in range(0, len(df), TABLE_ROWS_PER_PAGE):
+        df_page = df.slice(offset, TABLE_ROWS_PER_PAGE)
+        figure = Figure(figsize=PAGE_SIZE)
+        figure.text(0.03, 0.96, title, fontsize=9, color=shiny_theme.colors.dark)
+        figure.text(0.03, 0.925, heading, fontsize=14, color=shiny_theme.colors.dark)
+        ax = figure.add_axes([0.03, 0.03, 0.94, 0.86])
+        ax.set_axis_off()
+        table = ax.table(
+            # antibody pairs are stored with line breaks for the facets of the plots
+            cellText=[
+                [str(value).replace("\n", " ") for value in row]
+                for row in df_page.iter_rows()
+            ],
+            colLabels=df_page.columns,
+            loc="upper center",
+            cellLoc="left",
+        )
+        table.auto_set_font_size(False)
+        table.set_fontsize(8)
+        for (row, _), cell in table.get_celld().items():
+            cell.set_edgecolor(shiny_theme.colors.light)
+            if row == 0:
+                cell.set_facecolor(shiny_theme.colors.primary)
+                cell.get_text().set_color(shiny_theme.colors.light)
+        figures.append(figure)
+
+    return figures
+
+
+def _html_table(df: pl.DataFrame) -> str:
+    """
+    This function converts a table into HTML.
+    """
+
+    if df.is_empty():
+        return "<p>none</p>"
+
+    header = "".join(f"<th>{html.escape(col)}</th>" for col in df.columns)
+    rows = "".join(
+        "<tr>"
+        + "".join(
+            f"<td>{html.escape(str(value).replace(chr(10), ' '))}</td>" for value in row
+        )
+        + "</tr>"
+        for row in df.iter_rows()
+    )
+
+    return f"<table><thead><tr>{header}</tr></thead><tbody>{rows}</tbody></table>"
+
+
+class _ChunkStream(io.RawIOBase):
+    """
+    Write-only stream, whose content is taken out chunk by chunk. PdfPages only needs write() and tell(), so the PDF can be streamed page by page.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _submit_pages(tokens: list, dpi: int, root: str) -> list:
+    """
+    This function starts drawing the plots of all plates in the pool of worker processes. The pool limits how many are drawn at the same time.
+
+    Returns:
+        list: one list of Futures of PNG images per plate, in the order of PLOT_PAGES
+    """
+
+    executor = _get_executor()
+
+    return [
+        [
+            executor.submit(_render_plot_page, token, root, page, dpi)
+            for page in PLOT_PAGES
+        ]
+        for token in tokens
+    ]
+
+
+def _cancel(jobs: list):
+    """
+    This function cancels all plots of a report, which are not drawn yet, e.g. after the download was cancelled.
+    """
+
+    for plot_jobs in jobs:
+        for job in plot_jobs:
+            job.cancel()
+
+
+def _report_chunks(picos: list, jobs: list, format: str):
+    """
+    This function writes the pages of the report in order, as soon as their plots are finished, see iter_report().
+    """
+
+    if format == "pdf":
+        stream = _ChunkStream()
+        with PdfPages(stream) as pdf:
+            for pico, plot_jobs in zip(picos, jobs):
+                title = _title(pico)
+                for heading, job in zip(PLOT_PAGES.values(), plot_jobs):
+                    pdf.savefig(_pdf_image_page(title, heading, job.result()))
+                    yield stream.take()
+                for heading, df in _tables(pico):
+                    for figure in _pdf_table_pages(title, heading, df):
+                        pdf.savefig(figure)
+                    yield stream.take()
+        # the end of the file is written, when PdfPages is closed
+        yield stream.take()
+
+    else:
+        yield (
+            "<!DOCTYPE html><html><head><meta charset='utf-8'>"
+            f"<title>PICO report {datetime.now():%Y-%m-%d %H:%M}</title><style>"
+            f"body {{font-family: sans-serif; color: {shiny_theme.colors.dark};}}"
+            "img {width: 100%;} table {border-collapse: collapse; font-size: 0.9em;}"
+            f"th {{background: {shiny_theme.colors.primary}; color: {shiny_theme.colors.light};}}"
+            f"th, td {{padding: 2px 8px; border: 1px solid {shiny_theme.colors.light};}}"
+            "</style></head><body>"
+        ).encode()
+        for pico, plot_jobs in zip(picos, jobs):
+            parts = [f"<h1>{html.escape(_title(pico))}</h1>"]
+            for heading, job in zip(PLOT_PAGES.values(), plot_jobs):
+                # the images are embedded, so the file is self-contained
+                image = base64.b64encode(job.result()).decode()
+                parts.append(
+                    f"<h2>{html.escape(heading)}</h2>"
+                    f"<img src='data:image/png;base64,{image}'>"
+                )
+            for heading, df in _tables(pico):
+                parts.append(f"<h2>{html.escape(heading)}</h2>{_html_table(df)}")
+            yield "".join(parts).encode()
+        yield b"</body></html>"
+
+
+def iter_report(
+    tokens: list,
+    format: str = "pdf",
+    dpi: int = REPORT_DPI,
+    root: str = SNAPSHOT_ROOT,
+):
+    """
+    This function generates the report of several processed plates as one multi-page PDF or as one self-contained HTML file. The plots of all plates are drawn at the same time by the pool of worker processes, which restore the plates from their snapshots. The pages are returned in order as soon as they and all pages before them are finished, so that the report can be written or downloaded while the rest is still being drawn.
+
+    Each plate gets the plot of the couplexes, the lambda-range plot, the heatmaps of the couplexes and the quality control flags, a summary per sample and a table of the flagged wells.
+
+    Args:
+        tokens (list): snapshot tokens of the plates, see snapshots.save_snapshot()
+        format (str, optional): "pdf" or "html". Defaults to "pdf".
+        dpi (int, optional): resolution of the plots. Defaults to REPORT_DPI.
+        root (str, optional): location of the snapshots. Defaults to SNAPSHOT_ROOT.
+
+    Yields:
+        bytes: the next part of the report
+    """
+
+    if format not in ("pdf", "html"):
+        raise ValueError(f"Unknown report format {format}.")
+
+    picos = [_load(token, root) for token in tokens]
+    jobs = _submit_pages(tokens, dpi, root)
+    try:
+        yield from _report_chunks(picos, jobs, format)
+    finally:
+        _cancel(jobs)
+
+
+async def aiter_report(
+    tokens: list,
+    format: str = "pdf",
+    dpi: int = REPORT_DPI,
+    root: str = SNAPSHOT_ROOT,
+):
+    """
+    This function is the asynchronous version of iter_report() for the app. Waiting for the plots and drawing the tables happen in a thread, so the server keeps serving the other sessions and outputs in the meantime.
+
+    Args:
+        tokens (list): snapshot tokens of the plates, see snapshots.save_snapshot()
+        format (str, optional): "pdf" or "html". Defaults to "pdf".
+        dpi (int, optional): resolution of the plots. Defaults to REPORT_DPI.
+        root (str, optional): location of the snapshots. Defaults to SNAPSHOT_ROOT.
+
+    Yields:
+        bytes: the next part of the report
+    """
+
+    if format not in ("pdf", "html"):
+        raise ValueError(f"Unknown report format {format}.")
+
+    picos = [_load(token, root) for token in tokens]
+    jobs = _submit_pages(tokens, dpi, root)
+    chunks = _report_chunks(picos, jobs, format)
+    step = None
+    try:
+        while True:
+            # the thread is shielded, so a cancelled download does not leave it running unnoticed
+            step = asyncio.ensure_future(asyncio.to_thread(next, chunks, None))
+            chunk = await asyncio.shield(step)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        # the plots, which are not drawn yet, are cancelled right away and not only when the generator is collected
+        _cancel(jobs)
+        # a generator cannot be closed while the thread is still running it, so the current page is finished first
+        if step is not None:
+            await asyncio.gather(step, return_exceptions=True)
+        chunks.close()
+
+
+def process_file(
+    file: str, hyperwells: bool, estimator: str, root: str, keep: bool = False
+) -> str:
+    """
+    This function processes a MultipleOccupancy file and saves the result as snapshot. It runs in the workers of process_files() and of the ingestion daemon (see ingest.py).
+
+    Args:
+        file (str): path of the MultipleOccupancy file
+        hyperwells (bool): see PICO
+        estimator (str): see PICO
+        root (str): location of the snapshots
+        keep (bool, optional): see save_snapshot(). Defaults to False.
+
+    Returns:
+        str: the token of the snapshot
+    """
+
+    # class
+    from pico import PICO
+
+    pico = PICO(
+        file_info={"name": Path(file).name, "datapath": file},
+        hyperwells=hyperwells,
+        estimator=estimator,
+    )
+
+    return save_snapshot(pico, root, keep)
+
+
+def process_files(
+    files: list,
+    hyperwells: bool = False,
+    estimator: str = "ddpcs",
+    root: str = SNAPSHOT_ROOT,
+) -> list:
+    """
+    This function processes MultipleOccupancy files in parallel and saves each plate as snapshot, so that the report and the app can restore them without processing them again.
+
+    Args:
+        files (list): paths of the MultipleOccupancy files
+        hyperwells (bool, optional): see PICO. Defaults to False.
+        estimator (str, optional): see PICO. Defaults to "ddpcs".
+        root (str, optional): location of the snapshots. Defaults to SNAPSHOT_ROOT.
+
+    Returns:
+        list: the snapshot tokens in the order of the files
+    """
+
+    return list(
+        _get_executor().map(
+            process_file,
+            files,
+            [hyperwells] * len(files),
+            [estimator] * len(files),
+            [root] * len(files),
+        )
+    )
+
+
+# command line interface to create reports without the app
+# python report.py examples/*.csv --out study.pdf
+# python report.py --snapshot TOKEN --out plate.html
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report of several PICO plates.")
+    parser.add_argument("files", nargs="*", help="MultipleOccupancy files")
+    parser.add_argument(
+        "--snapshot", action="append", default=[], help="token of a processed plate"
+    )
+    parser.add_argument("--out", required=True, help="the .pdf or .html file")
+    parser.add_argument("--hyperwells", action="store_true", help="combine hyperwells")
+    parser.add_argument(
+        "--estimator", default="ddpcs", choices=["ddpcs", "ml", "joint"]
+    )
+    parser.add_argument("--workers", type=int, default=REPORT_WORKERS)
+    parser.add_argument("--root", default=SNAPSHOT_ROOT, help="location of the snapshots")
+    args = parser.parse_args()
+    # the pool is started with the first files or plots
+    REPORT_WORKERS = args.workers
+
+    tokens = args.snapshot
+    if args.files:
+        tokens += process_files(args.files, args.hyperwells, args.estimator, args.root)
+    if not tokens:
+        parser.error("no files or snapshots given")
+
+    format = "html" if args.out.lower().endswith((".html", ".htm")) else "pdf"
+    with open(args.out, "wb") as f:
+        for chunk in iter_report(tokens, format, root=args.root):
+            f.write(chunk)
+    print(f"{len(tokens)} plates -> {args.out}")
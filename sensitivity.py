@@ -0,0 +1,69 @@
+import numpy as np
+import polars as pl
+
+# number of assumptions per volume, i.e. the grid has SWEEP_STEPS x SWEEP_STEPS assumptions
+SWEEP_STEPS = 5
+
+
+def sweep_couplexes(
+    df: pl.DataFrame, mastermix_factors: np.ndarray, volume_factors: np.ndarray
+) -> np.ndarray:
+    """
+    This function calculates the number of couplexes of each row for a grid of actual master mix volumes and volumes per well. The dead volume correction is only a rescaling of the couplexes in the cycled volume (see _couplexes() in couplex_calculation.py), so the dDPCS model is not solved again and all rows and assumptions are calculated in one broadcast.
+
+    Args:
+        df (pl.DataFrame): df_couplexes or a filtered version of it
+        mastermix_factors (np.ndarray): actual master mix volumes relative to the hardcoded ones in PICO._general_formatting()
+        volume_factors (np.ndarray): actual volumes per well relative to the ones of the MultipleOccupancy file
+
+    Returns:
+        np.ndarray: couplexes with one row per row of df and one column per master mix factor and volume factor (rows x mastermix factors x volume factors)
+    """
+
+    couplexes = df["couplexes"].cast(pl.Float64).to_numpy()
+    # without a known master mix volume, the couplexes refer to the cycled volume and there is nothing to rescale
+    corrected = (df["mastermix_volume"] != 0).to_numpy()
+
+    # couplexes = couplexes_cycled * mastermix_volume / volume_per_well, so other volumes only rescale the couplexes
+    ratio = mastermix_factors[:, None] / volume_factors[None, :]
+
+    return couplexes[:, None, None] * np.where(corrected[:, None, None], ratio, 1.0)
+
+
+def sensitivity_band(
+    df: pl.DataFrame, deviation: float, steps: int = SWEEP_STEPS
+) -> pl.DataFrame:
+    """
+    This function summarises how much the median number of couplexes of each sample and antibody pair shifts, if the master mix volume and the volume per well deviate by up to ±deviation from the assumed values.
+
+    Args:
+        df (pl.DataFrame): df_couplexes or a filtered version of it
+        deviation (float): maximal relative deviation of both volumes, e.g. 0.1 for ±10 %
+        steps (int, optional): number of assumptions per volume. Defaults to SWEEP_STEPS.
+
+    Returns:
+        pl.DataFrame: sample_name, antibodies, the median number of couplexes with the assumed volumes and the lowest and highest median of all assumptions
+    """
+
+    factors = 1 + np.linspace(-deviation, deviation, steps)
+    sweep = sweep_couplexes(df, factors, factors)
+
+    # one column per assumption, the medians of all assumptions are aggregated at once
+    assumptions = [f"assumption_{i}" for i in range(steps * steps)]
+    df_sweep = df.select("sample_name", "antibodies", "couplexes").with_columns(
+        pl.Series(name, sweep.reshape(len(df), -1)[:, i])
+        for i, name in enumerate(assumptions)
+    )
+
+    return (
+        df_sweep.group_by(["sample_name", "antibodies"], maintain_order=True)
+        .agg(
+            pl.col("couplexes").median().alias("couplexes_median"),
+            pl.col(assumptions).median(),
+        )
+        .with_columns(
+            pl.min_horizontal(assumptions).alias("couplexes_low"),
+            pl.max_horizontal(assumptions).alias("couplexes_high"),
+        )
+        .drop(assumptions)
+    )
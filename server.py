@@ -1,6 +1,13 @@
 # python packages
+import asyncio
+import functools
+import logging
 import tempfile
 import os
+import time
+
+from typing import NamedTuple
+from urllib.parse import parse_qs
 
 import polars as pl
 
@@ -8,16 +15,42 @@ from plotnine import ggplot, theme_void
 
 # shiny packages
 from shiny import Inputs, Outputs, Session, reactive, render, ui
-from shiny.types import FileInfo
+from shiny.types import FileInfo, SilentException
 
 # icons
 from icons import question_circle_fill
 
 # class
 from pico import PICO
+from study_store import StudyStore, get_trend_plot
+from ingest import IngestLedger
+from snapshots import load_snapshot, save_snapshot
+from quantification import read_dilutions
+from report import aiter_report
 
 # own functions
 from helpers import round_up
+from plot_rendering import submit_render
+
+logger = logging.getLogger(__name__)
+
+# time in seconds the filter control elements need to be unchanged before the filters are applied
+# dragging the slider therefore results in only one recalculation
+FILTER_DEBOUNCE = 0.3
+# seconds between two checks of the ledger of the ingestion daemon
+LEDGER_POLL_INTERVAL = 2
+
+
+class FilterState(NamedTuple):
+    """
+    Normalised state of all filter control elements. The field names match the arguments of PICO.filtering().
+    """
+
+    lambda_filter: bool
+    filter_values_lambda: tuple | None
+    groups: tuple
+    samples: tuple
+    antibodies: tuple
 
 
 def server(input: Inputs, output: Outputs, session: Session):
@@ -29,8 +62,9 @@ def server(input: Inputs, output: Outputs, session: Session):
     # central reactive variable for PICO instance
     pico_instance = reactive.Value(None)
 
+    # the file is processed again, if the hyperwell mode or the estimator is switched
     @reactive.Effect
-    @reactive.event(input.file1)
+    @reactive.event(input.file1, input.hyperwells, input.estimator)
     def _():
         # file can either be a list of FileInfo or None
         # in this specific case only one file can be uploaded so that file[0] contains the FileInfo for the uploaded file
@@ -38,45 +72,155 @@ def server(input: Inputs, output: Outputs, session: Session):
         # a FileInfo object contains "name", "size", "type" and "datapath" of the uploaded file
         file: list[FileInfo] | None = input.file1()
         if file is None:
-            # if no file is uploaded, no pico_instance is set
+            # the plate may be restored from a snapshot (see below), which does not contain the file itself
+            # so it cannot be processed again and stays as it is
+            if pico_instance.get() is not None:
+                ui.notification_show(
+                    "The plate was restored from a previous session. Upload the file again to change the hyperwells or the estimator.",
+                    type="warning",
+                )
+            return
+
+        # create an object of the class PICO with the information from file[0]
+        # use the slider_lambda to set min and max values of lambda and filter the dataframe accordingly
+        try:
+            pico_instance.set(
+                PICO(
+                    file_info=file[0],
+                    hyperwells=input.hyperwells(),
+                    estimator=input.estimator(),
+                ),
+            )
+        except ValueError as e:
+            # the parser did not recognise the file (see parsers.py)
+            ui.notification_show(str(e), type="error")
             pico_instance.set(None)
+        # the filters of a previous upload are not valid anymore
+        reset_filter_state()
+
+    ###############################################
+    # Coalesced and debounced filter state
+    ###############################################
+
+    # the five filter control elements are combined into one filter state
+    # every change is first stored with its time stamp in pending_filters
+    pending_filters = reactive.Value(None)
+    # after FILTER_DEBOUNCE seconds without changes, the pending state is copied into filter_state but only if anything effectively changed
+    filter_state = reactive.Value(None)
+    # the histogram only depends on the lambda part of the filter state
+    lambda_state = reactive.Value(None)
+
+    # the filters are rendered again for each new pico_instance with all items selected and without lambda filter, see dynamic_filters()
+    # the browser only sends the values of the control elements, if they differ from the previous ones
+    # so the filter state is set to the values shown by the new control elements instead of waiting for them
+    def reset_filter_state():
+        pico = pico_instance.get()
+        if pico is None:
+            state = None
         else:
-            # create an object of the class PICO with the information from file[0]
-            # use the slider_lambda to set min and max values of lambda and filter the dataframe accordingly
-            pico_instance.set(
-                PICO(file_info=file[0]),
+            state = FilterState(
+                lambda_filter=False,
+                filter_values_lambda=None,
+                groups=tuple(sorted(pico.groups)),
+                samples=tuple(sorted(pico.samples)),
+                antibodies=tuple(sorted(pico.antibodies)),
             )
+        filter_state.set(state)
+        lambda_state.set(state[:2] if state is not None else None)
 
     # this effect is watching for changes in the lambda control elements (box and slider) and for changes in the checkboxes
-    # and updates the property df_couplexes_filtered of the pico_instance using pico.filtering()
     @reactive.Effect
-    @reactive.event(
-        input.lambda_filter,
-        input.slider_lambda,
-        input.filter_group,
-        input.filter_sample,
-        input.filter_antibodies,
-    )
     def _():
+        lambda_filter = bool(input.lambda_filter())
+        state = FilterState(
+            lambda_filter=lambda_filter,
+            # the slider values are irrelevant as long as the lambda filter is not applied
+            # round them to the precision of the histogram to ignore tiny movements of the slider
+            filter_values_lambda=(
+                tuple(round(value, 2) for value in input.slider_lambda())
+                if lambda_filter
+                else None
+            ),
+            # the order of the ticked boxes does not matter for filtering
+            groups=tuple(sorted(input.filter_group())),
+            samples=tuple(sorted(input.filter_sample())),
+            antibodies=tuple(sorted(input.filter_antibodies())),
+        )
+        pending_filters.set((state, time.monotonic()))
+
+    # this effect waits until the control elements are unchanged for FILTER_DEBOUNCE seconds
+    @reactive.Effect
+    def _():
+        pending = pending_filters.get()
+        if pending is None:
+            return
+        state, changed_at = pending
+        remaining = FILTER_DEBOUNCE - (time.monotonic() - changed_at)
+        if remaining > 0:
+            # check again once the debounce time is over
+            reactive.invalidate_later(remaining)
+            return
+        # reactive.Value.set() only checks for identity, so the comparison of the normalised tuples needs to be done here
+        with reactive.isolate():
+            if state != filter_state.get():
+                filter_state.set(state)
+            if state[:2] != lambda_state.get():
+                lambda_state.set(state[:2])
+
+    # updates the property df_couplexes_filtered of the pico_instance using pico.filtering()
+    # all plots and the filter message depend on this calc, so the filtering is done once per change of the filter state
+    # in the interactive mode, none of them is shown and the calc only runs for the downloads of the filtered data
+    @reactive.Calc
+    def filtered_pico():
         pico = pico_instance.get()
+        state = filter_state.get()
         # obivously, this is only relevant if there is actually a file uploaded
-        if pico is not None:
+        # and as long as there is no filter state, df_couplexes_filtered is the unfiltered dataframe from the initialization of PICO
+        if pico is not None and state is not None:
             # if any of these have a value it shall perform the filtering
-            if (
-                input.lambda_filter()
-                or input.filter_group()
-                or input.filter_sample()
-                or input.filter_antibodies()
-            ):
-                pico.filtering(
-                    lambda_filter=input.lambda_filter(),
-                    filter_values_lambda=input.slider_lambda(),
-                    groups=input.filter_group(),
-                    samples=input.filter_sample(),
-                    antibodies=input.filter_antibodies(),
-                )
+            if state.lambda_filter or state.groups or state.samples or state.antibodies:
+                pico.filtering(**state._asdict())
             else:
                 pico.df_couplexes_filtered = pico.df_couplexes
+        return pico
+
+    # the processed state of an upload is saved as snapshot and its token is added to the url
+    # after a reload of the page or a restart of the worker, the url restores the state without uploading and processing the file again
+    async def send_snapshot(pico):
+        token = save_snapshot(pico)
+        await session.send_custom_message("pico_snapshot", {"token": token})
+
+    @reactive.Effect
+    @reactive.event(input.file1, input.hyperwells, input.estimator)
+    async def _():
+        pico = pico_instance.get()
+        # without a file, the plate is unchanged, see above
+        if pico is not None and input.file1() is not None:
+            await send_snapshot(pico)
+
+    @reactive.Effect
+    def _():
+        with reactive.isolate():
+            url_search = session.clientdata.url_search()
+        token = parse_qs(url_search.lstrip("?")).get("session", [None])[0]
+        if token is not None:
+            pico = load_snapshot(token)
+            if pico is None:
+                ui.notification_show(
+                    "The previous session expired, please upload the file again.",
+                    type="warning",
+                )
+            else:
+                pico_instance.set(pico)
+
+    # for the interactive mode the data is sent to the browser once per upload
+    # afterwards, interactive_plots.js does the filtering and plotting client-side
+    @reactive.Effect
+    @reactive.event(pico_instance)
+    async def _():
+        pico = pico_instance.get()
+        if pico is not None:
+            await session.send_custom_message("pico_payload", pico.get_plot_payload())
 
     # extrac the file name of the original file to make it available for the download
     @reactive.Calc
@@ -96,24 +240,16 @@ def server(input: Inputs, output: Outputs, session: Session):
             value=[0.01, 0.25],
         )
 
-    # this function is watching the lambda filter control elements and checkboxes to update the message with the number of values displayed
+    # this function is watching the filter state to update the message with the number of values displayed
     @reactive.Calc
-    @reactive.event(
-        input.lambda_filter,
-        input.slider_lambda,
-        input.filter_group,
-        input.filter_sample,
-        input.filter_antibodies,
-    )
     def filter_message():
-        pico = pico_instance.get()
-        if pico is not None:
-            if (
-                input.lambda_filter()
-                or input.filter_group()
-                or input.filter_sample()
-                or input.filter_antibodies()
-            ):
+        # the browser filters and counts the data itself in the interactive mode, see interactive_plots.js
+        if input.interactive_plots():
+            return ui.HTML("")
+        pico = filtered_pico()
+        state = filter_state.get()
+        if pico is not None and state is not None:
+            if state.lambda_filter or state.groups or state.samples or state.antibodies:
                 return ui.div(ui.HTML(pico.filter_msg))
         else:
             return ui.HTML("")
@@ -167,7 +303,15 @@ def server(input: Inputs, output: Outputs, session: Session):
                         max=round_up(pico.max_lambda, 1),
                         value=[0.01, 0.25],
                     ),
-                    ui.output_plot("render_lambda_hist", height="100px"),
+                    # the histogram is rendered by the server or in the browser depending on the interactive mode
+                    ui.panel_conditional(
+                        "!input.interactive_plots",
+                        ui.output_image("render_lambda_hist", height="100px"),
+                    ),
+                    ui.panel_conditional(
+                        "input.interactive_plots",
+                        ui.div(id="interactive_lambda_hist"),
+                    ),
                 ),
                 # the default is that all groups, samples and antibodies are selected
                 ui.card(
@@ -214,106 +358,406 @@ def server(input: Inputs, output: Outputs, session: Session):
     def switch_plot_type():
         pico = pico_instance.get()
         if pico != None:
-            return ui.input_checkbox_group(
-                "plot_type",
-                "Choose visualization:",
-                choices=["Boxplot", "Violinplot"],
-                selected=["Boxplot", "Violinplot"],
-                inline=True,
+            return ui.TagList(
+                ui.input_checkbox_group(
+                    "plot_type",
+                    "Choose visualization:",
+                    choices=["Boxplot", "Violinplot"],
+                    selected=["Boxplot", "Violinplot"],
+                    inline=True,
+                ),
+                # the band shows how the medians shift, if the pipetted volumes differ from the assumed ones
+                ui.input_slider(
+                    "sensitivity",
+                    ui.tooltip(
+                        ui.span(
+                            "Volume uncertainty (\u00b1 %): ",
+                            question_circle_fill,
+                        ),
+                        "The band shows the range of the median number of couplexes, if the master mix volume and the volume per well deviate by up to this percentage from the assumed values. The dDPCS model is not solved again, because the dead volume correction only rescales the couplexes.",
+                    ),
+                    min=0,
+                    max=25,
+                    value=0,
+                    step=5,
+                ),
             )
 
     ###############################################
     # Histogram of lambda range in sidebar
     ###############################################
 
-    # the plotting function needs to watch the inputs lambda_filter and slider_lambda
-    # otherwise the plot is not updated when the values are changed
+    # the plotting function only watches the lambda part of the filter state
+    # otherwise the plot would also be updated when the checkboxes are changed
     @reactive.Calc
-    @reactive.event(input.lambda_filter, input.slider_lambda)
     def plot_lambda_hist():
         pico = pico_instance.get()
-        if pico is None:
+        state = lambda_state.get()
+        if pico is None or state is None:
             # this will just display an empty plot, when no file is uploaded
             return ggplot() + theme_void()
         else:
             # this will generate the plot of the histogram
-            # if input.lambda_filter() is False, which is the default, there is no color formatting
+            # if lambda_filter is False, which is the default, there is no color formatting
             # otherwise, this will color the bins of the histograms that are used in the violin plot of the couplexes green
+            lambda_filter, filter_values_lambda = state
             return pico.get_lambda_hist(
-                lambda_filter=input.lambda_filter(),
-                filter_values_lambda=input.slider_lambda(),
+                lambda_filter=lambda_filter,
+                filter_values_lambda=filter_values_lambda,
             )
 
-    # calls plot_couplexes to plot the data
+    # the job starts the rendering of the histogram, see render_jobs()
+    @reactive.Calc
+    def job_lambda_hist():
+        width, height, dpi = image_size("render_lambda_hist")
+        return submit_render(plot_lambda_hist(), width, height, dpi)
+
     @output
-    @render.plot
-    def render_lambda_hist():
-        return plot_lambda_hist()
+    @render.image(delete_file=True)
+    async def render_lambda_hist():
+        return await rendered_image(job_lambda_hist())
 
     ###############################################
     # Violin plots of couplexes
     ###############################################
 
-    # the plotting function needs to watch the inputs lambda_filter and slider_lambda as well as the checkboxes to be updated when something changed
+    # the plotting function needs to watch the filter state and the plot type to be updated when something changed
     @reactive.Calc
-    @reactive.event(
-        input.lambda_filter,
-        input.slider_lambda,
-        input.filter_group,
-        input.filter_sample,
-        input.filter_antibodies,
-        input.plot_type,
-    )
     def plot_couplexes_violin():
-        pico = pico_instance.get()
-        if pico is None:
+        pico = filtered_pico()
+        state = filter_state.get()
+        if pico is None or state is None:
             # this will just display an empty plot, when no file is uploaded
             # so when downloaded, it'll be a white piece of paper
             return ggplot() + theme_void()
         else:
             return pico.get_couplex_plot(
-                lambda_filter=input.lambda_filter(),
-                groups=input.filter_group(),
-                samples=input.filter_sample(),
-                antibodies=input.filter_antibodies(),
+                lambda_filter=state.lambda_filter,
+                groups=state.groups,
+                samples=state.samples,
+                antibodies=state.antibodies,
                 plot_type=input.plot_type(),
+                sensitivity=input.sensitivity() / 100,
             )
 
-    # calls plot_couplexes to plot the data
+    # the job starts the rendering of the plot of the couplexes, see render_jobs()
+    @reactive.Calc
+    def job_couplexes_violin():
+        width, height, dpi = image_size("render_plot_couplexes_violin")
+        pico = filtered_pico()
+        state = filter_state.get()
+        # with cached panels, only the facets with changed data are rendered again, all of them at the same time in the pool
+        # the download still uses the ggplot of plot_couplexes_violin
+        if input.cached_panels() and pico is not None and state is not None:
+            plot = pico.get_couplex_panels(
+                lambda_filter=state.lambda_filter,
+                groups=state.groups,
+                samples=state.samples,
+                antibodies=state.antibodies,
+                plot_type=input.plot_type(),
+                sensitivity=input.sensitivity() / 100,
+                width=width,
+                height=height,
+                dpi=dpi,
+            )
+        else:
+            plot = plot_couplexes_violin()
+        return submit_render(plot, width, height, dpi)
+
     @output
-    @render.plot
-    def render_plot_couplexes_violin():
-        return plot_couplexes_violin()
+    @render.image(delete_file=True)
+    async def render_plot_couplexes_violin():
+        return await rendered_image(job_couplexes_violin())
 
     ###############################################
     # Range plots of lambda from experimental groups
     ###############################################
 
-    # the plotting function needs to watch the inputs lambda_filter and slider_lambda as well as the checkboxes to be updated when something changed
+    # the plotting function needs to watch the filter state to be updated when something changed
     @reactive.Calc
-    @reactive.event(
-        input.lambda_filter,
-        input.slider_lambda,
-        input.filter_group,
-        input.filter_sample,
-        input.filter_antibodies,
-    )
     def plot_lambda_ranges():
+        pico = filtered_pico()
+        state = filter_state.get()
+        if pico is None or state is None:
+            return ggplot() + theme_void()
+        else:
+            return pico.get_lambda_ranges(
+                lambda_filter=state.lambda_filter,
+                groups=state.groups,
+                samples=state.samples,
+                antibodies=state.antibodies,
+            )
+
+    # the job starts the rendering of the lambda-range plot, see render_jobs()
+    @reactive.Calc
+    def job_lambda_ranges():
+        width, height, dpi = image_size("render_plot_lambda_ranges")
+        pico = filtered_pico()
+        state = filter_state.get()
+        if input.cached_panels() and pico is not None and state is not None:
+            plot = pico.get_lambda_range_panels(
+                lambda_filter=state.lambda_filter,
+                groups=state.groups,
+                samples=state.samples,
+                antibodies=state.antibodies,
+                width=width,
+                height=height,
+                dpi=dpi,
+            )
+        else:
+            plot = plot_lambda_ranges()
+        return submit_render(plot, width, height, dpi)
+
+    @output
+    @render.image(delete_file=True)
+    async def render_plot_lambda_ranges():
+        return await rendered_image(job_lambda_ranges())
+
+    ###############################################
+    # Heatmap of the plate layout
+    ###############################################
+
+    # the job starts the rendering of the heatmap, see render_jobs()
+    # filtering only updates the mask of the well grid, the heatmap itself is an image and not a plot with one geom per well
+    @reactive.Calc
+    def job_plate_heatmap():
+        width, height, dpi = image_size("render_plate_heatmap")
+        pico = pico_instance.get()
+        state = filter_state.get()
+        if pico is None or state is None:
+            plot = ggplot() + theme_void()
+        else:
+            plot = pico.get_plate_heatmap(
+                lambda_filter=state.lambda_filter,
+                filter_values_lambda=state.filter_values_lambda,
+                groups=state.groups,
+                samples=state.samples,
+                antibodies=state.antibodies,
+                metric=input.heatmap_metric(),
+                width=width,
+                height=height,
+                dpi=dpi,
+            )
+        return submit_render(plot, width, height, dpi)
+
+    @output
+    @render.image(delete_file=True)
+    async def render_plate_heatmap():
+        return await rendered_image(job_plate_heatmap())
+
+    ###############################################
+    # Concurrent rendering of the static plots
+    ###############################################
+
+    # shiny updates the outputs one after another, so each output would only start rendering after the previous one is finished
+    # this effect runs before the outputs and starts all changed plots at once in the pool of plot_rendering.py
+    # the outputs then only wait for their image, which takes as long as the slowest plot instead of the sum of all plots
+    @reactive.effect(priority=1)
+    def render_jobs():
+        jobs = {
+            "render_lambda_hist": job_lambda_hist,
+            "render_plot_couplexes_violin": job_couplexes_violin,
+            "render_plot_lambda_ranges": job_lambda_ranges,
+            "render_plate_heatmap": job_plate_heatmap,
+        }
+        for output_id, job in jobs.items():
+            # hidden outputs (other tab, interactive plots) are not updated by shiny, so their plots are not rendered in vain
+            if session.clientdata.output_hidden(output_id) is not False:
+                continue
+            try:
+                job()
+            except SilentException:
+                # no file is uploaded yet or an input is not set, the output stays empty
+                pass
+            except Exception:
+                # the calc keeps the error, so the output shows it as well; an uncaught error would end the session
+                logger.exception("Rendering of %s failed", output_id)
+
+    def image_size(id: str) -> tuple:
+        # size of an output in device pixels, so that the image is as sharp as a plot rendered by shiny
+        # before the output is shown, its size is unknown and the default size of render.plot is used
+        pixelratio = session.clientdata.pixelratio() or 1
+        width = session.clientdata.output_width(id) or 640
+        height = session.clientdata.output_height(id) or 480
+        return width * pixelratio, height * pixelratio, round(96 * pixelratio)
+
+    async def rendered_image(job) -> dict:
+        # waiting does not block the server, so the other outputs and sessions are served in the meantime
+        png = await asyncio.wrap_future(job)
+        with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmpfile:
+            tmpfile.write(png)
+        # the image has the resolution of the device and is scaled to the size of the output
+        return {"src": tmpfile.name, "width": "100%", "height": "100%"}
+
+    ###############################################
+    # Editing of reaction mixes and sample names
+    ###############################################
+
+    # one row per well with its reaction mix and sample name
+    @output
+    @render.data_frame
+    def metadata_editor():
+        pico = pico_instance.get()
+        if pico is None:
+            return None
+        return render.DataGrid(pico.get_metadata(), editable=True)
+
+    # the wells are the key for the new labels and cannot be edited
+    @metadata_editor.set_patch_fn
+    def _(*, patch):
+        if patch["column_index"] == 0:
+            return metadata_editor.data()["well"][patch["row_index"]]
+        return patch["value"]
+
+    # the labels are replaced on a copy of the current pico_instance, so that everything depending on it is updated
+    @reactive.Effect
+    @reactive.event(input.apply_metadata)
+    async def _():
         pico = pico_instance.get()
         if pico is None:
+            ui.notification_show("Upload a file first.", type="warning")
+            return
+        pico = pico.remap_metadata(metadata_editor.data_patched())
+        pico_instance.set(pico)
+        # the filters are rendered again with the new labels
+        reset_filter_state()
+        # a reload of the page shall restore the new labels and not the ones of the upload
+        await send_snapshot(pico)
+
+    ###############################################
+    # Quantification with dilution series
+    ###############################################
+
+    # incremented after each upload of dilutions, the standard curves are fitted once per upload
+    dilutions_version = reactive.Value(0)
+
+    @reactive.Effect
+    @reactive.event(input.dilutions)
+    def _():
+        file: list[FileInfo] | None = input.dilutions()
+        pico = pico_instance.get()
+        if file is None:
+            return
+        if pico is None:
+            ui.notification_show("Upload a file first.", type="warning")
+            return
+        try:
+            pico.set_dilutions(read_dilutions(file[0]["datapath"]))
+        except (ValueError, pl.exceptions.PolarsError) as e:
+            ui.notification_show(str(e), type="error")
+            return
+        dilutions_version.set(dilutions_version.get() + 1)
+
+    # filtering only changes the displayed rows, the cached standard curves are not fitted again
+    @reactive.Calc
+    def plot_standard_curves():
+        dilutions_version.get()
+        pico = filtered_pico()
+        state = filter_state.get()
+        if pico is None or state is None or pico.df_dilutions is None:
             return ggplot() + theme_void()
         else:
-            return pico.get_lambda_ranges(
-                lambda_filter=input.lambda_filter(),
-                groups=input.filter_group(),
-                samples=input.filter_sample(),
-                antibodies=input.filter_antibodies(),
+            return pico.get_standard_curve_plot(antibodies=state.antibodies)
+
+    @output
+    @render.plot
+    def render_standard_curves():
+        return plot_standard_curves()
+
+    @output
+    @render.data_frame
+    def render_standard_curve_table():
+        dilutions_version.get()
+        pico = filtered_pico()
+        state = filter_state.get()
+        if pico is None or state is None or pico.df_dilutions is None:
+            return pl.DataFrame()
+        return pico.get_standard_curves(antibodies=state.antibodies)
+
+    ###############################################
+    # Study store of all processed plates
+    ###############################################
+
+    study_store = StudyStore()
+    # incremented after each append to update the trend plot
+    study_version = reactive.Value(0)
+
+    # append the current plate to the study store
+    @reactive.Effect
+    @reactive.event(input.store_append)
+    def _():
+        pico = pico_instance.get()
+        if pico is None:
+            ui.notification_show("Upload a file first.", type="warning")
+        else:
+            study_store.append(pico)
+            study_version.set(study_version.get() + 1)
+            ui.notification_show(
+                f"Plate {pico.plate_id} was added to the study store.",
+                type="message",
             )
 
+    # the ingestion daemon (see ingest.py) appends plates to the same store and records them in its ledger
+    # the ledger is checked every few seconds, new plates are announced with a link to their snapshot
+    ingest_ledger = IngestLedger(study_store.root)
+    # plates ingested before the session started are not announced
+    announced = None
+
+    @reactive.poll(
+        lambda: (
+            ingest_ledger.path.stat().st_mtime_ns
+            if ingest_ledger.path.exists()
+            else None
+        ),
+        LEDGER_POLL_INTERVAL,
+    )
+    def ingested():
+        return ingest_ledger.read().filter(pl.col("status") == "done")
+
+    @reactive.Effect
+    def _():
+        nonlocal announced
+        df = ingested()
+        if announced is not None:
+            df_new = df.filter(~pl.col("sha256").is_in(announced))
+            for row in df_new.iter_rows(named=True):
+                ui.notification_show(
+                    ui.span(
+                        f"Plate {row['plate_id']} was ingested from "
+                        f"{os.path.basename(row['path'])}. ",
+                        # the snapshot restores the plate just as a bookmarked session
+                        ui.a("Open", href=f"?session={row['token']}"),
+                    ),
+                    type="message",
+                    duration=None,
+                )
+            if not df_new.is_empty():
+                with reactive.isolate():
+                    study_version.set(study_version.get() + 1)
+        announced = set(df["sha256"].to_list())
+
+    # the query reads the parquet files of all stored plates, so its result is kept per selection
+    # the version is part of the key, thus, appended plates are queried again
+    @functools.lru_cache(maxsize=8)
+    def query_study(version: int, samples: tuple, antibodies: tuple) -> pl.DataFrame:
+        return study_store.query(samples=samples, antibodies=antibodies)
+
+    # the trend plot shows the stored plates for the currently selected samples and antibodies
     @output
     @render.plot
-    def render_plot_lambda_ranges():
-        return plot_lambda_ranges()
+    async def render_study_trend():
+        # the study tab is usually hidden, changing the filters then does not touch the store
+        if session.clientdata.output_hidden("render_study_trend") is not False:
+            return None
+        version = study_version.get()
+        state = filter_state.get()
+        df = await asyncio.to_thread(
+            query_study,
+            version,
+            state.samples if state is not None else None,
+            state.antibodies if state is not None else None,
+        )
+        return get_trend_plot(df)
 
     ###############################################
     # Downloads
@@ -334,12 +778,37 @@ def server(input: Inputs, output: Outputs, session: Session):
     # same as download above but with the filtered dataframe
     @render.download(filename=lambda: f"{extract_filename()}_processed_filtered.csv")
     def download_data_filtered():
-        pico = pico_instance.get()
+        # make sure the filtered dataframe matches the current filter state
+        pico = filtered_pico()
         if pico is None:
             yield pl.DataFrame().write_csv()
         else:
             yield pico.get_processed_filtered_data().write_csv()
 
+    @render.download(filename=lambda: f"{extract_filename()}_quantified.csv")
+    def download_quantification():
+        dilutions_version.get()
+        pico = filtered_pico()
+        if pico is None or pico.df_dilutions is None:
+            yield pl.DataFrame().write_csv()
+        else:
+            yield pico.get_quantified_data().write_csv()
+
+    # the current plate is saved as snapshot, so that the workers of the report restore it instead of receiving it
+    # the download is asynchronous, so the server is not blocked while the pages are drawn
+    @render.download(
+        filename=lambda: f"{extract_filename()}_report.{input.report_format()}"
+    )
+    async def download_report():
+        pico = pico_instance.get()
+        format = input.report_format()
+        if pico is None:
+            ui.notification_show("Upload a file first.", type="warning")
+            return
+        token = await asyncio.to_thread(save_snapshot, pico)
+        async for chunk in aiter_report([token], format=format):
+            yield chunk
+
     @render.download(filename=lambda: f"{extract_filename()}_plot_couplexes.pdf")
     def download_plot_couplexes():
         plt = plot_couplexes_violin()
@@ -0,0 +1,7 @@
+// the server sends a token after each upload (see snapshots.py)
+// it is stored in the url, so that a reload of the page restores the processed state
+Shiny.addCustomMessageHandler("pico_snapshot", function (message) {
+  const url = new URL(window.location.href);
+  url.searchParams.set("session", message.token);
+  window.history.replaceState(null, "", url);
+});
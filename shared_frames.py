@@ -0,0 +1,90 @@
+# python packages
+import os
+import shutil
+import tempfile
+import uuid
+import weakref
+
+from pathlib import Path
+
+import polars as pl
+import pyarrow as pa
+
+
+class SharedFrames:
+    """
+    Transport of polars dataframes between processes without pickling. Each dataframe is written once as uncompressed Arrow IPC file into shared memory (/dev/shm, if available) and the receiving process memory-maps the file instead of reading and parsing it. Only the path of the file (the handle) is sent to the other process.
+
+    All files of an instance live in their own directory, which is removed by close(). Use the instance as context manager or bind it to a shiny session with session.on_ended(frames.close). If neither happens, the directory is removed when the instance is garbage collected or the interpreter exits.
+    """
+
+    def __init__(self, directory: str = None):
+        # /dev/shm is a RAM disk on linux, otherwise the files are memory-mapped from the temp directory
+        if directory is None:
+            directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+        self.directory = Path(tempfile.mkdtemp(prefix="pico_frames_", dir=directory))
+        self.handles = set()
+        self._finalizer = weakref.finalize(
+            self, shutil.rmtree, self.directory, ignore_errors=True
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def export(self, df: pl.DataFrame) -> str:
+        """
+        This function writes a dataframe to shared memory.
+
+        Args:
+            df (pl.DataFrame): the dataframe to share
+
+        Returns:
+            str: the handle, which is passed to attach() in the other process
+        """
+
+        handle = str(self.directory / f"{uuid.uuid4().hex}.arrow")
+        # memory mapping only works for uncompressed files
+        df.write_ipc(handle, compression="uncompressed")
+        self.handles.add(handle)
+
+        return handle
+
+    def release(self, handle: str):
+        """
+        This function removes a shared dataframe. Processes that already attached it keep their mapping until they drop the dataframe.
+
+        Args:
+            handle (str): the handle returned by export()
+        """
+
+        self.handles.discard(handle)
+        Path(handle).unlink(missing_ok=True)
+
+    def close(self):
+        """
+        This function removes all shared dataframes of this instance.
+        """
+
+        self.handles.clear()
+        self._finalizer()
+
+
+def attach(handle: str) -> pl.DataFrame:
+    """
+    This function attaches a shared dataframe in the receiving process. The data is memory-mapped, i.e. the pages are shared with the sending process and not copied.
+
+    Args:
+        handle (str): the handle returned by SharedFrames.export()
+
+    Returns:
+        pl.DataFrame: the shared dataframe
+    """
+
+    # pyarrow maps the file and the arrow buffers point directly into the mapped pages
+    with pa.memory_map(handle) as source:
+        table = pa.ipc.open_file(source).read_all()
+
+    return pl.from_arrow(table)
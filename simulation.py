@@ -0,0 +1,316 @@
+# python packages
+import argparse
+import itertools
+import string
+
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+# own functions
+from plate_layout import PLATE_LAYOUTS
+
+# colors of the fluorescence detection channels, the first letters form the colorpairs
+COLORS = ["Green", "Yellow", "Orange", "Red"]
+
+# columns of the MultipleOccupancy file of the QIAcuity Software Suite 2.5.0.1
+MO_HEADER = [
+    "Plate name",
+    "Plate ID",
+    "Plate type",
+    "Well",
+    "Hyperwell",
+    "Reaction Mix name",
+    "Sample name",
+    "Target names",
+    "Categories",
+    "Group",
+    "Valid partitions",
+    "Volume per well [μL]",
+    "Count categories",
+    "Count random",
+    "Random variation",
+    "Lambda",
+    "Lambda error",
+    "Conc. per group [cp/µl]",
+    "Conc. per group error",
+    "Concentration factor",
+    "Template volume [µl]",
+    "Total volume [µl]",
+    "Undiluted Conc. per group [cp/µl]",
+    "Undiluted Conc. per group [cp/µl] error",
+    "Conversion factor",
+    "Conversion factor unit",
+    "Conv. Undiluted Conc. per group",
+    "Conv. Undiluted Conc. per group error",
+    "% intact",
+    "% intact error",
+]
+# version 3.1.0.0 added these columns
+MO_HEADER_3 = MO_HEADER + [
+    "CXT matrix RM template name",
+    "CXT matrix RM template ID",
+    "REF",
+]
+
+# number of partitions simulated at once, this limits the memory to a few hundred MB
+CHUNK_PARTITIONS = 2**23
+
+
+def simulate_plate(
+    wells: int = 24,
+    channels: int = 2,
+    partitions: int = 26000,
+    lambda_range: tuple = (0.02, 0.2),
+    couplex_lambda_range: tuple = (0.0, 0.05),
+    seed: int = None,
+) -> tuple:
+    """
+    This function simulates a dPCR plate of a PICO experiment. In each well, the free molecules of each antibody and the couplexes of each pair of antibodies are Poisson distributed into the partitions. A partition is positive in a channel if it contains a free molecule of the antibody or a couplex with it. All partitions of a chunk of wells are drawn at once with numpy.
+
+    Args:
+        wells (int, optional): number of wells, at most 96. The plate type is the smallest nanoplate holding them. Defaults to 24.
+        channels (int, optional): number of fluorescence channels, i.e. antibodies (2, 3 or 4). Defaults to 2.
+        partitions (int, optional): number of partitions per well. Defaults to 26000.
+        lambda_range (tuple, optional): range of the mean number of free antibody molecules per partition, drawn uniformly per well and antibody. Defaults to (0.02, 0.2).
+        couplex_lambda_range (tuple, optional): range of the mean number of couplexes per partition, drawn uniformly per well and antibody pair. Defaults to (0.0, 0.05).
+        seed (int, optional): seed of the random number generator. Defaults to None.
+
+    Returns:
+        tuple: the MultipleOccupancy dataframe (see write_multiple_occupancy()) and the truth with one row per well and colorpair
+    """
+
+    if channels not in (2, 3, 4):
+        raise ValueError("Number of colors not 2, 3 or 4")
+
+    # the smallest nanoplate holding all wells
+    plate = next(
+        (
+            name
+            for name, (rows, cols) in sorted(
+                PLATE_LAYOUTS.items(), key=lambda item: item[1][0] * item[1][1]
+            )
+            if 0 < wells <= rows * cols
+        ),
+        None,
+    )
+    if plate is None:
+        raise ValueError(f"No nanoplate has {wells} wells")
+
+    rng = np.random.default_rng(seed)
+    pairs = list(itertools.combinations(range(channels), 2))
+    colors = COLORS[:channels]
+    targets = [f"Antibody {i + 1}" for i in range(channels)]
+
+    # like the QIAcuity, the wells are numbered column by column
+    well_names = [
+        f"{row}{col}"
+        for col in range(1, (wells - 1) // 8 + 2)
+        for row in string.ascii_uppercase[:8]
+    ][:wells]
+    # a few partitions of each well are invalid, the cycled volume scales with the valid partitions
+    valid_partitions = partitions - rng.integers(0, partitions // 50 + 1, wells)
+    volume_per_well = np.round(
+        valid_partitions / partitions * (20.5 if partitions > 10000 else 10.5), 3
+    )
+    mastermix_volume = 42 if partitions > 10000 else 13
+
+    lambdas = rng.uniform(*lambda_range, (wells, channels))
+    couplex_lambdas = rng.uniform(*couplex_lambda_range, (wells, len(pairs)))
+
+    # groups like "+-+" are numbered by reading + as 1 and - as 0, the QIAcuity lists them in descending order
+    n_groups = 2**channels
+    counts = np.zeros((wells, n_groups), dtype=np.int64)
+    couplexes = np.zeros((wells, len(pairs)), dtype=np.int64)
+
+    step = max(1, CHUNK_PARTITIONS // partitions)
+    for start in range(0, wells, step):
+        chunk = slice(start, min(start + step, wells))
+        n_wells = chunk.stop - chunk.start
+
+        valid = np.arange(partitions) < valid_partitions[chunk, None]
+
+        # free antibodies only matter as positive or negative, so a uniform number decides about each partition
+        positive = rng.random((n_wells, partitions, channels)) < -np.expm1(
+            -lambdas[chunk, None, :]
+        )
+        # the couplexes are counted to know the truth
+        for k, (i, j) in enumerate(pairs):
+            molecules = rng.poisson(
+                couplex_lambdas[chunk, k, None], (n_wells, partitions)
+            )
+            couplexes[chunk, k] = (molecules * valid).sum(axis=1)
+            positive[:, :, i] |= molecules > 0
+            positive[:, :, j] |= molecules > 0
+        # group of each partition, invalid partitions get the extra group n_groups
+        group = positive @ (1 << np.arange(channels - 1, -1, -1))
+        group[~valid] = n_groups
+        # one bincount for all wells of the chunk, each well has its own range of bins
+        counts[chunk] = np.bincount(
+            (group + np.arange(n_wells)[:, None] * (n_groups + 1)).ravel(),
+            minlength=n_wells * (n_groups + 1),
+        ).reshape(n_wells, n_groups + 1)[:, :n_groups]
+
+    group_names = [
+        "".join(
+            "+" if code >> (channels - 1 - c) & 1 else "-" for c in range(channels)
+        )
+        for code in range(n_groups)
+    ]
+    order = np.arange(n_groups)[::-1]
+
+    df_mo = pl.DataFrame(
+        {
+            "Plate name": "simulation",
+            "Plate ID": f"simulation-{seed}",
+            "Plate type": f"Nanoplate {'26K' if partitions > 10000 else '8.5K'} {plate}",
+            "Well": np.repeat(well_names, n_groups),
+            "Hyperwell": "-",
+            "Reaction Mix name": "Simulation",
+            "Sample name": np.repeat(
+                [f"Simulation {well}" for well in well_names], n_groups
+            ),
+            "Target names": ",".join(targets),
+            "Categories": "-".join(color[0] for color in colors),
+            "Group": np.tile(np.array(group_names)[order], wells),
+            "Valid partitions": np.repeat(valid_partitions, n_groups),
+            "Volume per well [μL]": np.repeat(volume_per_well, n_groups),
+            "Count categories": counts[:, order].ravel(),
+        }
+    )
+
+    df_truth = pl.DataFrame(
+        {
+            "well": np.repeat(well_names, len(pairs)),
+            "colorpair": np.tile(
+                [colors[i][0] + colors[j][0] for i, j in pairs], wells
+            ),
+            "antibody1": np.tile([targets[i] for i, j in pairs], wells),
+            "antibody2": np.tile([targets[j] for i, j in pairs], wells),
+            "lambda_free1": lambdas[:, [i for i, j in pairs]].ravel(),
+            "lambda_free2": lambdas[:, [j for i, j in pairs]].ravel(),
+            "lambda_couplexes": couplex_lambdas.ravel(),
+            # couplexes in the valid partitions and extrapolated to the master mix volume like calculate_couplexes()
+            "couplexes_cycled": couplexes.ravel(),
+            "couplexes_true": (
+                couplexes * (mastermix_volume / volume_per_well)[:, None]
+            ).ravel(),
+        }
+    )
+
+    return df_mo, df_truth
+
+
+def write_multiple_occupancy(
+    df_mo: pl.DataFrame, path: str, version: str = "3.1.0.0"
+):
+    """
+    This function writes a simulated plate in the format of the MultipleOccupancy file, i.e. with the line "sep=," and all columns of the version. Columns that are not simulated are filled with "-".
+
+    Args:
+        df_mo (pl.DataFrame): first result of simulate_plate()
+        path (str): path of the .csv file
+        version (str, optional): version of the QIAcuity Software Suite, "2.5.0.1" or "3.1.0.0". Defaults to "3.1.0.0".
+    """
+
+    header = MO_HEADER_3 if version == "3.1.0.0" else MO_HEADER
+    df = df_mo.with_columns(
+        pl.lit("-").alias(col) for col in header if col not in df_mo.columns
+    ).select(header)
+
+    with open(path, "wb") as f:
+        # version 2.5.0.1 starts with a byte order mark
+        if version == "2.5.0.1":
+            f.write(b"\xef\xbb\xbf")
+        f.write(b"sep=,\n")
+        df.write_csv(f)
+
+
+def compare_with_truth(pico, df_truth: pl.DataFrame) -> pl.DataFrame:
+    """
+    This function compares the couplexes calculated by the estimator of the PICO object with the truth of the simulation.
+
+    Args:
+        pico (PICO): an object of the class PICO created from the simulated file
+        df_truth (pl.DataFrame): second result of simulate_plate()
+
+    Returns:
+        pl.DataFrame: well, colorpair, calculated and true couplexes and the relative error
+    """
+
+    return (
+        pico.df_couplexes.select(
+            pl.col(["well", "colorpair"]).cast(pl.String), "couplexes"
+        )
+        .join(df_truth, on=["well", "colorpair"], how="inner")
+        .with_columns(
+            (
+                (pl.col("couplexes") - pl.col("couplexes_true"))
+                / pl.col("couplexes_true")
+            ).alias("relative_error")
+        )
+    )
+
+
+# command line interface to generate plates as test data or load for the pipeline
+# python simulation.py --plates 10 --wells 96 --channels 4 --out simulated/
+# python simulation.py --channels 3 --check
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Simulation of MultipleOccupancy files with known couplexes."
+    )
+    parser.add_argument("--plates", type=int, default=1, help="number of plates")
+    parser.add_argument("--wells", type=int, default=24, help="wells per plate")
+    parser.add_argument("--channels", type=int, default=2, help="2, 3 or 4")
+    parser.add_argument("--partitions", type=int, default=26000)
+    parser.add_argument("--version", default="3.1.0.0", help="format of the file")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="simulated", help="output directory")
+    parser.add_argument(
+        "--estimator", default="ddpcs", help="ddpcs, ml or joint, used by --check"
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="process the files and compare with the truth",
+    )
+    args = parser.parse_args()
+
+    out = Path(args.out)
+    out.mkdir(parents=True, exist_ok=True)
+    for plate in range(args.plates):
+        df_mo, df_truth = simulate_plate(
+            wells=args.wells,
+            channels=args.channels,
+            partitions=args.partitions,
+            seed=args.seed + plate,
+        )
+        path = out / f"simulation_{args.seed + plate}.csv"
+        write_multiple_occupancy(df_mo, path, version=args.version)
+        df_truth.write_csv(path.with_suffix(".truth.csv"))
+        print(path)
+
+        if args.check:
+            # class
+            from pico import PICO
+
+            df = compare_with_truth(
+                PICO(
+                    file_info={"name": path.name, "datapath": str(path)},
+                    estimator=args.estimator,
+                ),
+                df_truth,
+            )
+            print(
+                df.group_by("colorpair", maintain_order=True).agg(
+                    wells=pl.len(),
+                    mean_relative_error=pl.col("relative_error").mean(),
+                    mean_absolute_relative_error=pl.col("relative_error").abs().mean(),
+                )
+            )
+
+    if args.check:
+        from couplex_calculation import SOLVE_CACHE
+
+        print(f"solve cache: {SOLVE_CACHE.stats()}")
@@ -0,0 +1,123 @@
+# python packages
+import json
+import os
+import re
+import secrets
+import shutil
+import time
+
+from pathlib import Path
+
+# own functions
+from shared_frames import attach
+
+# location of the snapshots, can be changed with the environment variable PICO_SNAPSHOTS
+SNAPSHOT_ROOT = os.environ.get(
+    "PICO_SNAPSHOTS", str(Path(__file__).parent / "snapshots")
+)
+# snapshots older than this are removed, when a new snapshot is saved
+MAX_AGE_DAYS = float(os.environ.get("PICO_SNAPSHOTS_MAX_AGE_DAYS", 7))
+# snapshots with this file are never removed, e.g. the plates of the ingestion daemon, which are linked in the study store
+KEEP_FILE = "keep"
+
+# the dataframes and attributes of PICO needed to display everything after a restore
+FRAMES = ["df_couplexes", "df_lambda", "df_lambda_aggregates"]
+METADATA = [
+    "file_name",
+    "file_version",
+    "plate_format",
+    "plate_id",
+    "plate_name",
+    "hyperwells",
+    "estimator",
+    "vol",
+    "min_lambda",
+    "max_lambda",
+    "groups",
+    "samples",
+    "antibodies",
+]
+
+# tokens are generated by secrets.token_urlsafe, everything else is rejected before touching the file system
+TOKEN_PATTERN = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+
+
+def save_snapshot(pico, root: str = SNAPSHOT_ROOT, keep: bool = False) -> str:
+    """
+    This function writes the processed state of a PICO object as uncompressed Arrow IPC files and a small JSON file with the metadata.
+
+    Args:
+        pico (PICO): a processed object of the class PICO
+        root (str, optional): location of the snapshots. Defaults to SNAPSHOT_ROOT.
+        keep (bool, optional): exclude the snapshot from the removal after MAX_AGE_DAYS. Defaults to False.
+
+    Returns:
+        str: the token to restore the snapshot with load_snapshot()
+    """
+
+    _prune(Path(root))
+
+    token = secrets.token_urlsafe(24)
+    directory = Path(root) / token
+    directory.mkdir(parents=True)
+
+    # uncompressed, so that the files can be memory-mapped when restoring
+    for name in FRAMES:
+        getattr(pico, name).write_ipc(
+            directory / f"{name}.arrow", compression="uncompressed"
+        )
+    with open(directory / "metadata.json", "w") as f:
+        json.dump({name: getattr(pico, name) for name in METADATA}, f)
+    if keep:
+        (directory / KEEP_FILE).touch()
+
+    return token
+
+
+def load_snapshot(token: str, root: str = SNAPSHOT_ROOT):
+    """
+    This function restores a PICO object from a snapshot. The dataframes are memory-mapped, i.e. nothing is parsed and the operating system loads the pages when they are used.
+
+    Args:
+        token (str): the token returned by save_snapshot()
+        root (str, optional): location of the snapshots. Defaults to SNAPSHOT_ROOT.
+
+    Returns:
+        PICO | None: the restored object or None if there is no such snapshot
+    """
+
+    # class
+    from pico import PICO
+
+    if not TOKEN_PATTERN.match(token or ""):
+        return None
+    directory = Path(root) / token
+    if not (directory / "metadata.json").exists():
+        return None
+
+    with open(directory / "metadata.json") as f:
+        metadata = json.load(f)
+    frames = {name: attach(str(directory / f"{name}.arrow")) for name in FRAMES}
+
+    return PICO.from_snapshot(frames=frames, metadata=metadata)
+
+
+def _prune(root: Path):
+    """
+    This function removes all snapshots older than MAX_AGE_DAYS, except the snapshots saved with keep=True.
+
+    Args:
+        root (Path): location of the snapshots
+    """
+
+    if not root.exists():
+        return
+
+    oldest = time.time() - MAX_AGE_DAYS * 24 * 60 * 60
+    for directory in root.iterdir():
+        if (
+            directory.is_dir()
+            and directory.stat().st_mtime < oldest
+            and not (directory / KEEP_FILE).exists()
+        ):
+            shutil.rmtree(directory, ignore_errors=True)
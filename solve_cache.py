@@ -0,0 +1,200 @@
+# python packages
+import os
+import threading
+import uuid
+
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+# maximal number of entries kept in memory and on disk
+CACHE_SIZE = int(os.environ.get("PICO_SOLVE_CACHE_SIZE", 100_000))
+# directory of the on-disk store, without it the cache only lives in the memory of the process
+# the batch CLI and all workers of the app share their results with, e.g., PICO_SOLVE_CACHE=/var/cache/pico
+CACHE_ROOT = os.environ.get("PICO_SOLVE_CACHE")
+
+
+class SolveCache:
+    """
+    Memo table of a row-wise solver, e.g. the dDPCS model. The key is the exact tuple of the inputs of a row, so replicate wells, controls and repeated uploads of the same plate are solved only once per process. The table is bounded and evicts the least recently used entries.
+
+    With a root directory, the table is additionally stored as Arrow IPC file. It is read on the first use and merged with the table of the other processes on save(), the file is replaced atomically so that readers never see a partial file. Entries of processes saving at the same time may get lost, which only costs a solve.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        key_columns: list,
+        value_columns: list,
+        maxsize: int = CACHE_SIZE,
+        root: str = CACHE_ROOT,
+    ):
+        self.key_columns = key_columns
+        self.value_columns = value_columns
+        self.maxsize = maxsize
+        self.path = Path(root) / f"{name}.arrow" if root else None
+
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.duplicates = 0
+        self._loaded = False
+        self._unsaved = 0
+        # the daemon and batch jobs may solve plates in several threads
+        self._lock = threading.RLock()
+
+    def solve(self, inputs: np.ndarray, solver) -> np.ndarray:
+        """
+        This function returns the results of all rows. Identical rows are looked up once, only the rows missing in the table are passed to the solver.
+
+        Args:
+            inputs (np.ndarray): one row per row to solve and one column per key column
+            solver (function): solves a 2d array of inputs and returns one row of results per row
+
+        Returns:
+            np.ndarray: one row of results per input row, in the order of the inputs
+        """
+
+        with self._lock:
+            self._load()
+
+            unique, inverse = np.unique(inputs, axis=0, return_inverse=True)
+            keys = list(map(tuple, unique.tolist()))
+            results = np.empty((len(keys), len(self.value_columns)), dtype=np.int64)
+
+            missing = []
+            for row, key in enumerate(keys):
+                result = self.entries.get(key)
+                if result is None:
+                    missing.append(row)
+                else:
+                    self.entries.move_to_end(key)
+                    results[row] = result
+
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+            self.duplicates += len(inputs) - len(keys)
+
+        if missing:
+            results[missing] = solver(unique[missing])
+
+            with self._lock:
+                for row in missing:
+                    self.entries[keys[row]] = tuple(results[row].tolist())
+                self._evict()
+                self._unsaved += len(missing)
+            self.save()
+
+        return results[inverse.reshape(-1)]
+
+    def stats(self) -> dict:
+        """
+        This function returns the statistics of the lookups of this process.
+
+        Returns:
+            dict: hits and misses of the unique rows, rows resolved as duplicate of another row of the same call, the number of entries and the hit rate of all rows
+        """
+
+        rows = self.hits + self.misses + self.duplicates
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "duplicates": self.duplicates,
+            "entries": len(self.entries),
+            "hit_rate": (self.hits + self.duplicates) / rows if rows else None,
+        }
+
+    def clear(self):
+        """
+        This function empties the table in memory and resets the statistics. The on-disk store is kept.
+        """
+
+        with self._lock:
+            self.entries.clear()
+            self.hits = self.misses = self.duplicates = 0
+            self._unsaved = 0
+
+    def save(self):
+        """
+        This function merges the new entries into the on-disk store. Entries of this process win over entries of other processes, because they were used most recently.
+        """
+
+        if self.path is None or not self._unsaved:
+            return
+
+        with self._lock:
+            df = self._to_frame()
+            tmp = self.path.with_name(f".{self.path.name}.{uuid.uuid4().hex}")
+            try:
+                if self.path.exists():
+                    df = pl.concat([pl.read_ipc(self.path), df])
+                df = df.unique(
+                    self.key_columns, keep="last", maintain_order=True
+                ).tail(self.maxsize)
+
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                df.write_ipc(tmp)
+                os.replace(tmp, self.path)
+            except OSError:
+                # the store is only a cache, the results are still returned if it is not writable
+                tmp.unlink(missing_ok=True)
+                return
+
+            # the merged table also contains the entries of the other processes
+            self._from_frame(df)
+            self._unsaved = 0
+
+    def _load(self):
+        """
+        This function reads the on-disk store once per process.
+        """
+
+        if self._loaded:
+            return
+        self._loaded = True
+
+        if self.path is not None and self.path.exists():
+            self._from_frame(pl.read_ipc(self.path))
+
+    def _evict(self):
+        """
+        This function removes the least recently used entries above the maximal size.
+        """
+
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def _to_frame(self) -> pl.DataFrame:
+        """
+        This function converts the table into a dataframe with the key and value columns, the least recently used entries first.
+
+        Returns:
+            pl.DataFrame: one row per entry
+        """
+
+        return pl.DataFrame(
+            [key + value for key, value in self.entries.items()],
+            schema={
+                **{col: pl.Float64 for col in self.key_columns},
+                **{col: pl.Int64 for col in self.value_columns},
+            },
+            orient="row",
+        )
+
+    def _from_frame(self, df: pl.DataFrame):
+        """
+        This function replaces the table by the entries of a dataframe of _to_frame().
+
+        Args:
+            df (pl.DataFrame): one row per entry
+        """
+
+        n_keys = len(self.key_columns)
+        self.entries = OrderedDict(
+            (row[:n_keys], row[n_keys:])
+            for row in df.select(self.key_columns + self.value_columns).iter_rows()
+        )
+        self._evict()
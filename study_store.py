@@ -0,0 +1,328 @@
+# python packages
+import argparse
+import os
+import re
+import uuid
+
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+import polars as pl
+
+from plotnine import *
+from shinyswatch.theme import minty as shiny_theme
+
+# the app and the ingestion daemon append to the same store, fcntl locks the index while one of them updates it
+# fcntl only exists on unix, elsewhere only one process should append at a time
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# default location of the study store, can be changed with the environment variable PICO_STUDY_STORE
+DEFAULT_ROOT = os.environ.get(
+    "PICO_STUDY_STORE", str(Path(__file__).parent / "study_store")
+)
+
+# labels are stored as strings because every plate has its own enums (see PICO._compact_dtypes())
+LABEL_COLUMNS = [
+    "group",
+    "sample_name",
+    "well",
+    "colorpair",
+    "antibodies",
+    "antibody1",
+    "antibody2",
+]
+
+# the index contains one row per plate, run, reaction mix, sample and antibody pair
+INDEX_KEYS = ["plate_id", "run_date", "group", "sample_name", "antibodies"]
+
+# date of the run at the beginning of the plate name, e.g. V20231115_TL_PICO_U937_4EBP1
+RUN_DATE_PATTERN = re.compile(r"^\D*(\d{8})(?!\d)")
+
+
+def run_date_from_name(plate_name: str) -> datetime | None:
+    """
+    This function extracts the date of the run from the name of a plate.
+
+    Args:
+        plate_name (str): the plate name of the MultipleOccupancy file
+
+    Returns:
+        datetime | None: the date of the run or None, if the plate name contains no date
+    """
+
+    match = RUN_DATE_PATTERN.match(plate_name or "")
+    if match is None:
+        return None
+    try:
+        return datetime.strptime(match.group(1), "%Y%m%d")
+    except ValueError:
+        return None
+
+
+@contextmanager
+def file_lock(path: Path):
+    """
+    This function locks a file against updates of other processes, which use the same lock. The lock is a separate file next to it, so that the file itself can be replaced.
+
+    Args:
+        path (Path): the file to be updated
+    """
+
+    if fcntl is None:
+        yield
+        return
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path.with_suffix(".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def replace_parquet(df: pl.DataFrame, path: Path):
+    """
+    This function writes a dataframe to a temporary file first and then replaces the file, so that a crash never leaves a broken file and readers never see a partial file.
+
+    Args:
+        df (pl.DataFrame): the new content
+        path (Path): the Parquet file
+    """
+
+    # the name is unique, so that processes without the lock never write the same temporary file
+    tmp_path = path.with_suffix(f".{uuid.uuid4().hex[:8]}.tmp")
+    df.write_parquet(tmp_path)
+    os.replace(tmp_path, path)
+
+
+class StudyStore:
+    """
+    Append-only store of all processed plates. Each processed df_couplexes is written as its own Parquet file into a directory per plate (plate_id=...), sorted by reaction mix, sample and antibody pair. A small index file maps reaction mixes, samples and antibody pairs to the files, so that queries only open the files that can contain matching rows.
+    """
+
+    def __init__(self, root: str = DEFAULT_ROOT):
+        self.root = Path(root)
+        self.index_path = self.root / "index.parquet"
+
+    def append(self, pico, run_date: datetime = None) -> Path:
+        """
+        This function appends the results of a processed plate to the store. Nothing is ever overwritten, appending the same plate twice results in two runs of this plate.
+
+        Args:
+            pico (PICO): a processed object of the class PICO
+            run_date (datetime, optional): date of the run. Defaults to None, i.e. the date in the plate name or now, if the plate name contains no date.
+
+        Returns:
+            Path: the written Parquet file
+        """
+
+        run_date = run_date or run_date_from_name(pico.plate_name) or datetime.now()
+
+        df = (
+            pico.df_couplexes.with_columns(
+                pl.col(LABEL_COLUMNS).cast(pl.String),
+                pl.lit(pico.plate_id).alias("plate_id"),
+                pl.lit(run_date).cast(pl.Datetime("us")).alias("run_date"),
+            )
+            # sorting allows the Parquet statistics of the row groups to skip data within a file
+            .sort(["group", "sample_name", "antibodies"])
+        )
+
+        # the plate ID comes from the file, so only safe characters are used in the name of the directory
+        safe_id = re.sub(r"[^A-Za-z0-9_-]", "_", pico.plate_id)
+        plate_dir = self.root / f"plate_id={safe_id}"
+        plate_dir.mkdir(parents=True, exist_ok=True)
+        path = plate_dir / f"{run_date:%Y%m%dT%H%M%S}_{uuid.uuid4().hex[:8]}.parquet"
+        df.write_parquet(path, statistics=True)
+
+        # add the new file to the index
+        index = (
+            df.select(INDEX_KEYS)
+            .unique()
+            .with_columns(pl.lit(str(path.relative_to(self.root))).alias("path"))
+        )
+        # the index is read and written under the lock, otherwise the file of a concurrent append could be lost
+        with file_lock(self.index_path):
+            if self.index_path.exists():
+                index = pl.concat([pl.read_parquet(self.index_path), index])
+            replace_parquet(index, self.index_path)
+
+        return path
+
+    def read_index(self) -> pl.DataFrame:
+        """
+        This function returns the index of the store.
+
+        Returns:
+            pl.DataFrame: plate_id, run_date, group, sample_name, antibodies and the path of the file
+        """
+
+        if not self.index_path.exists():
+            return pl.DataFrame(
+                schema={
+                    "plate_id": pl.String,
+                    "run_date": pl.Datetime("us"),
+                    "group": pl.String,
+                    "sample_name": pl.String,
+                    "antibodies": pl.String,
+                    "path": pl.String,
+                }
+            )
+
+        return pl.read_parquet(self.index_path)
+
+    def query(
+        self,
+        groups: list = None,
+        samples: list = None,
+        antibodies: list = None,
+        plate_ids: list = None,
+    ) -> pl.DataFrame:
+        """
+        This function returns the couplexes of all stored plates matching the filters. None means no filtering for this column.
+
+        Args:
+            groups (list, optional): reaction mixes. Defaults to None.
+            samples (list, optional): sample names. Defaults to None.
+            antibodies (list, optional): antibody pairs. Defaults to None.
+            plate_ids (list, optional): plate IDs. Defaults to None.
+
+        Returns:
+            pl.DataFrame: the matching rows of all stored df_couplexes with plate_id and run_date
+        """
+
+        filters = [
+            pl.col(col).is_in(values)
+            for col, values in [
+                ("group", groups),
+                ("sample_name", samples),
+                ("antibodies", antibodies),
+                ("plate_id", plate_ids),
+            ]
+            if values is not None
+        ]
+
+        # first, the index decides which files need to be opened at all
+        index = self.read_index()
+        if filters:
+            index = index.filter(*filters)
+        paths = index["path"].unique().sort().to_list()
+        if not paths:
+            return pl.DataFrame()
+
+        # then, only the matching rows of these files are read
+        # the plate_id is also a column of the files, so the directory names are not parsed
+        # the columns differ between the estimators (e.g. couplexes_se of the ML estimator), so each file is scanned on its own and missing columns are null
+        df = pl.concat(
+            [
+                pl.scan_parquet(self.root / path, hive_partitioning=False)
+                for path in paths
+            ],
+            how="diagonal_relaxed",
+        )
+        if filters:
+            df = df.filter(*filters)
+
+        return df.collect()
+
+
+def get_trend_plot(df: pl.DataFrame) -> ggplot:
+    """
+    This function plots the couplexes of the stored plates over the run dates.
+
+    Args:
+        df (pl.DataFrame): result of StudyStore.query()
+
+    Returns:
+        ggplot: the couplexes per sample over time, one facet per antibody pair
+    """
+
+    if df.is_empty():
+        return (
+            ggplot()
+            + annotate(
+                "text",
+                x=0.5,
+                y=0.6,
+                label="The study store contains no matching plates.\nNothing to display :-(",
+                ha="center",
+                va="center",
+                size=16,
+                color=shiny_theme.colors.dark,
+            )
+            + theme_void()
+        )
+
+    # one point per plate and sample, the mean over the replicates
+    df_trend = df.group_by(["run_date", "plate_id", "sample_name", "antibodies"]).agg(
+        couplexes=pl.col("couplexes").mean()
+    )
+
+    return (
+        ggplot(df_trend, aes("run_date", "couplexes", color="sample_name"))
+        + geom_line()
+        + geom_point(size=3)
+        + labs(x="Run date", y="Mean number of couplexes", color="Sample")
+        + facet_wrap("antibodies")
+        + theme(
+            # remove background from facets
+            panel_background=element_blank(),
+            # background color of facet labels
+            strip_background=element_rect(fill=shiny_theme.colors.secondary),
+            # color of all the text
+            text=element_text(color=shiny_theme.colors.dark),
+            # text on the secondary color shall be white just as in the shiny theme
+            strip_text=element_text(color=shiny_theme.colors.light),
+        )
+    )
+
+
+# command line interface to fill and query the store without the app
+# python study_store.py append examples/*.csv
+# python study_store.py query --sample "Sample 1" --out trend.csv
+if __name__ == "__main__":
+    # class
+    from pico import PICO
+
+    parser = argparse.ArgumentParser(description="Study store of processed PICO plates.")
+    parser.add_argument("--root", default=DEFAULT_ROOT, help="location of the store")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    append_parser = commands.add_parser("append", help="process and store files")
+    append_parser.add_argument("files", nargs="+", help="MultipleOccupancy files")
+
+    query_parser = commands.add_parser("query", help="query the stored couplexes")
+    query_parser.add_argument("--group", action="append", help="reaction mix")
+    query_parser.add_argument("--sample", action="append", help="sample name")
+    query_parser.add_argument("--antibodies", action="append", help="antibody pair")
+    query_parser.add_argument("--plate-id", action="append", help="plate ID")
+    query_parser.add_argument("--out", help="write the result to this .csv file")
+
+    args = parser.parse_args()
+    store = StudyStore(args.root)
+
+    if args.command == "append":
+        for file in args.files:
+            pico = PICO(file_info={"name": Path(file).name, "datapath": file})
+            print(f"{file} -> {store.append(pico)}")
+    else:
+        df = store.query(
+            groups=args.group,
+            samples=args.sample,
+            # antibody pairs are given as in the downloads, i.e. "ab1 & ab2"
+            antibodies=(
+                [pair.replace(" & ", "\n&\n") for pair in args.antibodies]
+                if args.antibodies
+                else None
+            ),
+            plate_ids=args.plate_id,
+        )
+        if args.out:
+            df.write_csv(args.out)
+        else:
+            print(df)
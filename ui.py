@@ -9,6 +9,12 @@ from shiny import ui
 # icons
 from icons import question_circle_fill
 
+# supported versions of the MultipleOccupancy file
+from parsers import PARSERS
+
+# values of the plate heatmap
+from plate_layout import HEATMAP_METRICS
+
 
 app_ui = ui.page_fluid(
     ui.card(
@@ -62,12 +68,13 @@ app_ui = ui.page_fluid(
                             ui.span(
                                 "Currently supported files: ",
                                 ui.tags.ul(
-                                    ui.tags.li(
-                                        "MultipleOccupancy file (.csv) from QIAcuity Software Suite 2.5.0.1"
-                                    ),
-                                    ui.tags.li(
-                                        "MultipleOccupancy file (.csv) from QIAcuity Software Suite 3.1.0.0"
-                                    ),
+                                    # one entry per registered parser
+                                    *[
+                                        ui.tags.li(
+                                            f"MultipleOccupancy file (.csv) from QIAcuity Software Suite {version}"
+                                        )
+                                        for version in PARSERS
+                                    ]
                                 ),
                             ),
                         ),
@@ -79,6 +86,36 @@ app_ui = ui.page_fluid(
                         multiple=False,
                         width="100%",
                     ),
+                    # all wells of a hyperwell are combined into one reaction before the couplexes are calculated
+                    ui.input_switch(
+                        "hyperwells",
+                        "Combine the wells of hyperwells",
+                        False,
+                    ),
+                    # the dDPCS model looks at each pair of channels on its own, the joint estimation uses all groups of a well
+                    ui.input_radio_buttons(
+                        "estimator",
+                        "Estimation of the couplexes",
+                        {
+                            "ddpcs": "dDPCS model (each colorpair on its own)",
+                            "ml": "Maximum likelihood (dDPCS model with standard errors)",
+                            "joint": "Joint estimation (all colorpairs of a well at once)",
+                        },
+                        selected="ddpcs",
+                    ),
+                    # in the interactive mode the plots are drawn in the browser and the server is not involved when filtering
+                    # hidden outputs are suspended by shiny, so the static plots are not rendered in this mode
+                    ui.input_switch(
+                        "interactive_plots",
+                        "Interactive plots (rendered in the browser)",
+                        False,
+                    ),
+                    # each facet of the static plots is rendered on its own and cached, so that filtering only renders the changed facets
+                    ui.input_switch(
+                        "cached_panels",
+                        "Cache plot panels (faster filtering)",
+                        False,
+                    ),
                     # this renders the filter boxes and the lambda filter after the upload of a file
                     ui.output_ui("dynamic_filters"),
                     ui.layout_columns(
@@ -93,6 +130,20 @@ app_ui = ui.page_fluid(
                             class_="down-button-height",
                         ),
                     ),
+                    # keeps the results of this plate for the comparison with other runs in the tab "Study"
+                    ui.input_action_button("store_append", "Add plate to study store"),
+                    # all plots and tables of the plate in one file, the plots are drawn in parallel (see report.py)
+                    ui.layout_columns(
+                        ui.input_radio_buttons(
+                            "report_format",
+                            "Report format:",
+                            {"pdf": "PDF", "html": "HTML"},
+                            selected="pdf",
+                            inline=True,
+                        ),
+                        ui.download_button("download_report", "Download report"),
+                        class_="d-flex align-items-center",
+                    ),
                 ),
                 # CSS width of sidebar
                 width="33%",
@@ -111,8 +162,20 @@ app_ui = ui.page_fluid(
                             ),
                             class_="d-flex align-items-center",
                         ),
-                        ui.output_ui("render_filter_message"),
-                        ui.output_plot("render_plot_couplexes_violin", height="600px"),
+                        # in the interactive mode, the message is written by interactive_plots.js
+                        # the output is hidden then, so the server does not filter on each change of the filters
+                        ui.panel_conditional(
+                            "!input.interactive_plots",
+                            ui.output_ui("render_filter_message"),
+                            ui.output_image(
+                                "render_plot_couplexes_violin", height="600px"
+                            ),
+                        ),
+                        ui.panel_conditional(
+                            "input.interactive_plots",
+                            ui.div(id="interactive_filter_message"),
+                            ui.div(id="interactive_couplexes"),
+                        ),
                     ),
                 ),
                 ui.nav_panel(
@@ -123,15 +186,92 @@ app_ui = ui.page_fluid(
                             "Download plot as PDF",
                             class_="float-right",
                         ),
-                        ui.output_plot(
-                            "render_plot_lambda_ranges", width="100%", height="600px"
+                        ui.panel_conditional(
+                            "!input.interactive_plots",
+                            ui.output_image(
+                                "render_plot_lambda_ranges",
+                                width="100%",
+                                height="600px",
+                            ),
+                        ),
+                        ui.panel_conditional(
+                            "input.interactive_plots",
+                            ui.div(id="interactive_lambda_ranges"),
+                        ),
+                    ),
+                ),
+                ui.nav_panel(
+                    "Plate layout",
+                    ui.card(
+                        ui.input_radio_buttons(
+                            "heatmap_metric",
+                            "Value of each well:",
+                            HEATMAP_METRICS,
+                            selected="couplexes",
+                            inline=True,
+                        ),
+                        # wells, which are empty or filtered out, are grey
+                        ui.output_image("render_plate_heatmap", height="600px"),
+                    ),
+                ),
+                ui.nav_panel(
+                    "Metadata",
+                    ui.card(
+                        ui.p(
+                            "Double-click a cell to correct reaction mixes and sample names of the wells. The number of couplexes is not calculated again, only the labels are replaced."
+                        ),
+                        ui.output_data_frame("metadata_editor"),
+                        ui.input_action_button("apply_metadata", "Apply changes"),
+                    ),
+                ),
+                ui.nav_panel(
+                    "Quantification",
+                    ui.card(
+                        ui.layout_columns(
+                            ui.input_file(
+                                "dilutions",
+                                ui.tooltip(
+                                    ui.span(
+                                        "Upload dilutions: ",
+                                        question_circle_fill,
+                                    ),
+                                    "A .csv file with the columns sample_name, dilution (e.g. 100 for 1:100) and optionally series (samples diluted from the same stock).",
+                                ),
+                                accept=[".csv"],
+                                multiple=False,
+                                width="100%",
+                            ),
+                            ui.download_button(
+                                "download_quantification",
+                                "Download quantified data",
+                            ),
+                            class_="d-flex align-items-center",
+                        ),
+                        ui.output_plot("render_standard_curves", height="600px"),
+                        ui.output_data_frame("render_standard_curve_table"),
+                    ),
+                ),
+                ui.nav_panel(
+                    "Study",
+                    ui.card(
+                        ui.p(
+                            "Mean number of couplexes of all plates in the study store for the selected samples and antibodies."
                         ),
+                        ui.output_plot("render_study_trend", height="600px"),
                     ),
                 ),
             ),
         ),
     ),
     ui.include_css(Path(__file__).parent / "styles.css"),
+    # vega-lite is used for the interactive plots, which are drawn in the browser
+    # the minified builds (vega 5.30.0, vega-lite 5.20.1, vega-embed 6.26.0, all BSD-3-Clause) are served
+    # with the app, so that it also works without access to a cdn
+    ui.include_js(Path(__file__).parent / "vega.min.js"),
+    ui.include_js(Path(__file__).parent / "vega-lite.min.js"),
+    ui.include_js(Path(__file__).parent / "vega-embed.min.js"),
+    ui.include_js(Path(__file__).parent / "interactive_plots.js"),
+    ui.include_js(Path(__file__).parent / "session.js"),
     # how to adjust the colors in the plot
     # theme=Path(__file__).parent / "theme_freecastle.css",
     theme=shinyswatch.theme.minty,